@@ -3,8 +3,8 @@ import warnings
 
 warnings.filterwarnings("ignore", category=DeprecationWarning)
 
-from elx.state import StateManager
-from elx.tap import Tap
+from elx.state import StateManager, ShardedStateManager
+from elx.tap import Tap, discover_catalogs
 from elx.target import Target
 from elx.runner import Runner
 from elx.catalog import Catalog
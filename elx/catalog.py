@@ -1,6 +1,129 @@
-from typing import List, Optional, Tuple
-from pydantic import BaseModel, Field
+from fnmatch import translate
+from typing import Dict, List, Optional, Pattern, Tuple
+from pydantic import BaseModel, Field, PrivateAttr
 import logging
+import re
+
+GLOB_CHARACTERS = ("*", "?", "[")
+
+
+def is_glob(pattern: str) -> bool:
+    """
+    Check whether a pattern segment contains glob characters.
+
+    Args:
+        pattern (str): The pattern segment, e.g. "users" or "audit_*".
+
+    Returns:
+        bool: True if the segment is a glob, False if it is an exact name.
+    """
+    return any(character in pattern for character in GLOB_CHARACTERS)
+
+
+def compile_globs(patterns: List[str]) -> Optional[Pattern]:
+    """
+    Compile glob patterns into a single regular expression.
+
+    Args:
+        patterns (List[str]): The glob patterns, e.g. ["audit_*", "tmp_?"].
+
+    Returns:
+        Optional[Pattern]: A regex matching any of the patterns, None if there are no patterns.
+    """
+    if not patterns:
+        return None
+
+    return re.compile("|".join(f"(?:{translate(pattern)})" for pattern in patterns))
+
+
+class SelectionPatterns:
+    """
+    Selection patterns compiled once, so they can be matched against all streams
+    and properties of a catalog in a single pass.
+
+    A pattern is a stream name, optionally followed by a property path, separated
+    by dots. The stream name and the first property segment can be globs,
+    e.g. ["users", "users.email", "*.audit_*", "sales_*.internal_*"].
+    """
+
+    def __init__(self, patterns: List[str]):
+        # Property paths by exact stream name, an empty path selects the stream itself.
+        self.exact: Dict[str, List[List[str]]] = {}
+        # Property paths by compiled stream glob.
+        self.globs: List[Tuple[Pattern, List[str]]] = []
+
+        for pattern in patterns:
+            stream_name, *path = pattern.split(".")
+
+            if is_glob(stream_name):
+                self.globs.append((compile_globs([stream_name]), path))
+            else:
+                self.exact.setdefault(stream_name, []).append(path)
+
+        # A combined regex to quickly reject streams that match none of the globs.
+        self.any_glob = compile_globs(
+            [
+                pattern.split(".")[0]
+                for pattern in patterns
+                if is_glob(pattern.split(".")[0])
+            ]
+        )
+
+        # Property globs are compiled once as well.
+        self.property_globs: Dict[str, Pattern] = {}
+        for stream_paths in [*self.exact.values(), [path for _, path in self.globs]]:
+            for path in stream_paths:
+                if path and is_glob(path[0]):
+                    self.property_globs[path[0]] = compile_globs([path[0]])
+
+    def paths(self, stream_id: str) -> List[List[str]]:
+        """
+        Get the property paths that apply to a stream.
+
+        Args:
+            stream_id (str): The stream id.
+
+        Returns:
+            List[List[str]]: The property paths, an empty path refers to the entire stream.
+        """
+        paths = list(self.exact.get(stream_id, []))
+
+        if self.any_glob and self.any_glob.fullmatch(stream_id):
+            paths += [path for regex, path in self.globs if regex.fullmatch(stream_id)]
+
+        return paths
+
+    def breadcrumbs(self, stream: "Stream") -> List[List[str]]:
+        """
+        Get the metadata breadcrumbs of a stream that match a pattern.
+
+        Args:
+            stream (Stream): The stream to match.
+
+        Returns:
+            List[List[str]]: The matching breadcrumbs, an empty breadcrumb refers to the entire stream.
+        """
+        breadcrumbs = []
+
+        for path in self.paths(stream.tap_stream_id):
+            # The entire stream.
+            if not path:
+                breadcrumbs.append([])
+
+            # All properties matching the glob.
+            elif path[0] in self.property_globs:
+                regex = self.property_globs[path[0]]
+                breadcrumbs += [
+                    ["properties", property_name, *path[1:]]
+                    for property_name in stream.stream_schema.get("properties", {})
+                    if regex.fullmatch(property_name)
+                ]
+
+            # An exact property.
+            else:
+                breadcrumbs.append(["properties", *path])
+
+        return breadcrumbs
 
 
 class Stream(BaseModel):
@@ -14,6 +137,18 @@ class Stream(BaseModel):
     is_view: Optional[bool] = False
     metadata: List[dict] = Field(default_factory=list)
 
+    # Index of breadcrumb -> position in `metadata`, together with the identity
+    # and length of the list it was built for.
+    _metadata_index: Dict[Tuple, int] = PrivateAttr(default_factory=dict)
+    _metadata_index_key: Optional[Tuple[int, int]] = PrivateAttr(default=None)
+
+    def __eq__(self, other: object) -> bool:
+        """Streams are equal if their fields are equal, the private attributes only hold caches."""
+        if not isinstance(other, Stream):
+            return NotImplemented
+
+        return self.__dict__ == other.__dict__
+
     @property
     def name(self) -> str:
         """The name of the stream is the stream_id"""
@@ -37,15 +172,62 @@ class Stream(BaseModel):
         # If metadata does exists, return value of `selected` property
         return metadata.get("selected", True)
 
+    def _build_metadata_index(self) -> Dict[Tuple, int]:
+        """
+        Build the breadcrumb index of the metadata. The first metadata entry
+        for a breadcrumb wins, just like a linear scan would.
+
+        Returns:
+            Dict[Tuple, int]: Mapping of breadcrumb tuples to their position in `metadata`.
+        """
+        index = {}
+        for position, metadata in enumerate(self.metadata):
+            index.setdefault(tuple(metadata["breadcrumb"]), position)
+
+        self._metadata_index = index
+        self._metadata_index_key = (id(self.metadata), len(self.metadata))
+        return index
+
+    def _find_metadata_index(self, breadcrumb: List[str]) -> Optional[int]:
+        """
+        Find the position of the metadata entry for a breadcrumb.
+
+        Args:
+            breadcrumb (List[str]): The breadcrumb to find.
+
+        Returns:
+            Optional[int]: The position in `metadata` if found, otherwise None.
+        """
+        key = tuple(breadcrumb)
+
+        # Rebuild the index if the metadata list was replaced or resized.
+        rebuilt = self._metadata_index_key != (id(self.metadata), len(self.metadata))
+        index = self._build_metadata_index() if rebuilt else self._metadata_index
+
+        position = index.get(key)
+
+        # Entries can be replaced in place, and a new list can get the id of a
+        # replaced one, so rebuild the index once if the entry is stale. Misses
+        # don't rebuild it, as `upsert_metadata` usually looks up new breadcrumbs.
+        if (
+            not rebuilt
+            and position is not None
+            and tuple(self.metadata[position]["breadcrumb"]) != key
+        ):
+            position = self._build_metadata_index().get(key)
+
+        return position
+
     def find_metadata_by_breadcrumb(self, breadcrumb: List[str]) -> Optional[dict]:
         """
         Find metadata by breadcrumb.
         """
-        for metadata in self.metadata:
-            if metadata["breadcrumb"] == breadcrumb:
-                return metadata["metadata"]
+        position = self._find_metadata_index(breadcrumb)
 
-        return None
+        if position is None:
+            return None
+
+        return self.metadata[position]["metadata"]
 
     def upsert_metadata(
         self,
@@ -71,10 +253,107 @@ class Stream(BaseModel):
                 }
             )
 
+            # Keep the breadcrumb index in sync with the appended entry.
+            self._metadata_index.setdefault(tuple(breadcrumb), len(self.metadata) - 1)
+            self._metadata_index_key = (id(self.metadata), len(self.metadata))
+
 
 class Catalog(BaseModel):
     streams: List[Stream] = Field(default_factory=list)
 
+    # Streams that are owned by this catalog and can be modified in place,
+    # keyed by id to keep the stream objects (and thus their ids) alive.
+    _owned_streams: Dict[int, Stream] = PrivateAttr(default_factory=dict)
+
+    # Index of tap_stream_id -> position in `streams`, together with the identity
+    # and length of the list it was built for.
+    _stream_index: Dict[str, int] = PrivateAttr(default_factory=dict)
+    _stream_index_key: Optional[Tuple[int, int]] = PrivateAttr(default=None)
+
+    def __eq__(self, other: object) -> bool:
+        """Catalogs are equal if their fields are equal, the private attributes only hold caches."""
+        if not isinstance(other, Catalog):
+            return NotImplemented
+
+        return self.__dict__ == other.__dict__
+
+    def _copy(self) -> "Catalog":
+        """
+        Make a shallow copy of the catalog. The streams are shared with the
+        original catalog until they are modified (copy-on-write).
+
+        Returns:
+            Catalog: A new catalog that shares its streams with this catalog.
+        """
+        catalog = self.model_copy(update={"streams": list(self.streams)})
+        catalog._owned_streams = {}
+        catalog._stream_index = {}
+        catalog._stream_index_key = None
+        return catalog
+
+    def _mutable_stream(self, index: int) -> Stream:
+        """
+        Get the stream at `index` so it can be modified. If the stream is still
+        shared with another catalog, it is replaced by a deep copy first.
+
+        Args:
+            index (int): The index of the stream in `streams`.
+
+        Returns:
+            Stream: A stream that is owned by this catalog.
+        """
+        stream = self.streams[index]
+
+        if id(stream) not in self._owned_streams:
+            stream = stream.model_copy(deep=True)
+            self.streams[index] = stream
+            self._owned_streams[id(stream)] = stream
+
+        return stream
+
+    def _build_stream_index(self) -> Dict[str, int]:
+        """
+        Build the stream_id index of the streams. The first stream with a
+        stream_id wins, just like a linear scan would.
+
+        Returns:
+            Dict[str, int]: Mapping of stream_ids to their position in `streams`.
+        """
+        index = {}
+        for position, stream in enumerate(self.streams):
+            index.setdefault(stream.tap_stream_id, position)
+
+        self._stream_index = index
+        self._stream_index_key = (id(self.streams), len(self.streams))
+        return index
+
+    def _find_stream_index(self, stream_id: str) -> Optional[int]:
+        """
+        Find the index of a stream by stream_id.
+
+        Args:
+            stream_id (str): The stream_id to find.
+
+        Returns:
+            Optional[int]: The index of the stream if found, otherwise None.
+        """
+        # Rebuild the index if the streams list was replaced or resized.
+        rebuilt = self._stream_index_key != (id(self.streams), len(self.streams))
+        index = self._build_stream_index() if rebuilt else self._stream_index
+
+        position = index.get(stream_id)
+
+        # Streams can be replaced in place, and a new list can get the id of a
+        # replaced one, so rebuild the index once if the stream is stale.
+        if (
+            not rebuilt
+            and position is not None
+            and self.streams[position].tap_stream_id != stream_id
+        ):
+            position = self._build_stream_index().get(stream_id)
+
+        return position
+
     def find_stream(self, stream_id: str) -> Optional[Stream]:
         """
         Find a stream by stream_id.
@@ -85,78 +364,106 @@ class Catalog(BaseModel):
         Returns:
             Optional[Stream]: The stream if found, otherwise None.
         """
-        for stream in self.streams:
-            if stream.tap_stream_id == stream_id:
-                return stream
+        index = self._find_stream_index(stream_id)
 
-        return None
+        if index is None:
+            return None
+
+        return self.streams[index]
 
     def deselect(
         self,
         patterns: Optional[List[str]] = None,
     ) -> "Catalog":
         """
-        Deselect streams and properties from the catalog.
+        Deselect streams and properties from the catalog. The stream name and the
+        first property segment of a pattern can be globs.
 
         Args:
-            patterns (Optional[List[str]]): List of patterns to deselect. E.g. ["users", "users.email"]
+            patterns (Optional[List[str]]): List of patterns to deselect. E.g. ["users", "users.email", "*.audit_*"]
 
         Returns:
             Catalog: A new catalog with deselected streams and properties.
         """
-        # Make a copy of the existing catalog.
-        catalog = self.copy(deep=True)
+        # Make a copy of the existing catalog, streams are copied when modified.
+        catalog = self._copy()
 
         # Return catalog if no patterns to deselect.
         if patterns is None:
             return catalog
 
-        for pattern in patterns:
-            # Split the pattern into nodes.
-            nodes = pattern.split(".")
+        # Compile the patterns once and match them against all streams in one pass.
+        selection_patterns = SelectionPatterns(patterns)
 
-            # Find the stream.
-            stream = catalog.find_stream(nodes[0])
+        for index, stream in enumerate(catalog.streams):
+            # Find the stream and property breadcrumbs to deselect.
+            breadcrumbs = selection_patterns.breadcrumbs(stream)
 
-            # If an invalid stream is found, skip it.
-            if stream is None:
+            # Skip streams that don't match any pattern.
+            if not breadcrumbs:
                 continue
 
-            # Wether to deselect the stream or a property.
-            breadcrumb = ["properties"] + nodes[1:] if len(nodes) > 1 else []
+            stream = catalog._mutable_stream(index)
 
-            # Update or create metadata.
-            stream.upsert_metadata(
-                breadcrumb=breadcrumb,
-                metadata={
-                    "selected": False,
-                },
-            )
+            for breadcrumb in breadcrumbs:
+                # Update or create metadata.
+                stream.upsert_metadata(
+                    breadcrumb=breadcrumb,
+                    metadata={
+                        "selected": False,
+                    },
+                )
 
-            # If deselecting an entire stream (not a property), also update
-            # schema.selected to stay consistent with metadata. This is needed
-            # because singer-python's is_selected() short-circuits on
-            # schema.selected before checking metadata.
-            if not breadcrumb:
-                stream.stream_schema["selected"] = False
+                # If deselecting an entire stream (not a property), also update
+                # schema.selected to stay consistent with metadata. This is needed
+                # because singer-python's is_selected() short-circuits on
+                # schema.selected before checking metadata.
+                if not breadcrumb:
+                    stream.stream_schema["selected"] = False
 
         return catalog
 
     def select(self, streams: Optional[List[str]]) -> "Catalog":
-        # Make a copy of the existing catalog.
-        catalog = self.copy(deep=True)
+        """
+        Select streams in the catalog, all other streams are deselected.
+
+        Args:
+            streams (Optional[List[str]]): The streams to select, can be globs. E.g. ["users", "sales_*"]
+
+        Returns:
+            Catalog: A new catalog with the selected streams.
+        """
+        # Make a copy of the existing catalog, streams are copied when modified.
+        catalog = self._copy()
 
         # Simply return the catalog if no streams are selected.
         if streams is None:
             return catalog
 
+        # Compile the glob patterns once, other names are matched exactly.
+        exact_streams = set(streams)
+        glob_streams = compile_globs([stream for stream in streams if is_glob(stream)])
+
         # Loop through the streams in the catalog.
-        for stream in catalog.streams:
+        for index, stream in enumerate(catalog.streams):
             # Check if stream is selected
-            is_selected = (stream.tap_stream_id in streams) or (
-                stream.safe_name in streams
+            is_selected = any(
+                name in exact_streams
+                or (glob_streams is not None and glob_streams.fullmatch(name))
+                for name in (stream.tap_stream_id, stream.safe_name)
             )
 
+            # Skip the stream if it already has the right selection.
+            metadata = stream.find_metadata_by_breadcrumb(breadcrumb=[])
+            if (
+                metadata is not None
+                and metadata.get("selected") == is_selected
+                and stream.stream_schema.get("selected") == is_selected
+            ):
+                continue
+
+            stream = catalog._mutable_stream(index)
+
             # Upsert the metadata.
             stream.upsert_metadata(
                 breadcrumb=[],
@@ -183,13 +490,15 @@ class Catalog(BaseModel):
         Returns:
             Catalog: A new catalog with updated replication settings.
         """
-        # Make a copy of the existing catalog.
-        catalog = self.copy(deep=True)
+        # Make a copy of the existing catalog, streams are copied when modified.
+        catalog = self._copy()
 
         # Loop over the streams
-        for stream in catalog.streams:
+        for index, stream in enumerate(catalog.streams):
             # If the stream is specified in `replication_keys` dictionary
             if stream.tap_stream_id in replication_keys:
+                stream = catalog._mutable_stream(index)
+
                 # Set the replication method to INCREMENTAL
                 stream.replication_method = "INCREMENTAL"
 
@@ -211,22 +520,24 @@ class Catalog(BaseModel):
         """
         Adds custom properties to stream schema and metadata.
         """
-        # Make a copy of the existing catalog.
-        catalog = self.copy(deep=True)
+        # Make a copy of the existing catalog, streams are copied when modified.
+        catalog = self._copy()
 
         # Loop over the streams referenced in the `custom_schema`
         for stream_name in custom_schema.keys():
             # Find the stream
-            stream = catalog.find_stream(stream_name)
+            index = catalog._find_stream_index(stream_name)
 
             # If the stream is not found, skip it
-            if stream is None:
+            if index is None:
                 # Log warning about an invalid stream name in the schema configuration
                 logging.warning(
                     f"Found stream `{stream_name}` in the `schema` definition that does not exist in the catalog."
                 )
                 continue
 
+            stream = catalog._mutable_stream(index)
+
             # Get the custom properties for the current stream
             custom_properties = custom_schema[stream.tap_stream_id]
 
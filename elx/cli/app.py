@@ -1,29 +1,33 @@
+import sys
 from pathlib import Path
 import typer
 from rich import print
 
+from elx.cli import bench
 from elx.cli import debug
-
-# from elx.cli import invoke
+from elx.cli import invoke
 from elx.cli import catalog
 from dotenv import load_dotenv, dotenv_values
 
 app = typer.Typer()
 
 app.command()(debug.debug)
-# app.command()(invoke.invoke)
+app.command()(invoke.invoke)
 app.command()(catalog.catalog)
+app.command()(bench.bench)
 
 
 def cli():
     env_path = Path.cwd() / ".env"
     loaded_env = load_dotenv(env_path)
 
-    # Use rich to print the loaded env
+    # Use rich to print the loaded env, to stderr so the output of commands
+    # like `elx bench` stays machine readable.
     if loaded_env:
         env_variables = dotenv_values(env_path)
         print(
-            f"[bold]Loaded environment variables:[/bold] {', '.join(env_variables.keys())}"
+            f"[bold]Loaded environment variables:[/bold] {', '.join(env_variables.keys())}",
+            file=sys.stderr,
         )
 
     return app()
@@ -0,0 +1,247 @@
+import asyncio
+import contextlib
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+from subprocess import Popen
+from typing import Generator, List, Optional
+
+import typer
+from elx import StateManager
+from elx.runner import Runner
+from elx.singer import BUFFER_SIZE_LIMIT
+from elx.target import Target
+from elx.cli.utils import find_instances_of_type, request_instance
+
+# Seconds between checks whether the benchmark reached its bounds.
+CHECK_INTERVAL = 0.1
+
+# A target that discards all records, it only confirms the states it receives.
+DISCARD_TARGET_SCRIPT = """
+import json
+import sys
+
+for line in sys.stdin:
+    message = json.loads(line)
+    if message.get("type") == "STATE":
+        print(json.dumps(message["value"]), flush=True)
+"""
+
+
+class DiscardTarget(Target):
+    """
+    A target that discards all records, to benchmark a tap on its own. It runs
+    as an inline script of the current Python interpreter, so it doesn't need
+    an executable file, e.g. in a temporary directory that is mounted noexec.
+    """
+
+    def __init__(self):
+        super().__init__(spec="discard", executable=sys.executable)
+
+    @contextlib.asynccontextmanager
+    async def process(
+        self,
+        tap_process: Popen,
+    ) -> Generator[Popen, None, None]:
+        """
+        Run the target process.
+
+        Args:
+            tap_process (Popen): The process where the tap is running.
+
+        Returns:
+            Popen: The target process.
+        """
+        yield await asyncio.create_subprocess_exec(
+            sys.executable,
+            "-c",
+            DISCARD_TARGET_SCRIPT,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            limit=BUFFER_SIZE_LIMIT,
+        )
+
+
+async def run_bounded(
+    runner: Runner,
+    streams: Optional[List[str]],
+    records: Optional[int],
+    seconds: Optional[float],
+) -> None:
+    """
+    Run the runner until it finishes or reaches a bound, whichever comes first.
+
+    Args:
+        runner (Runner): The runner to run.
+        streams (Optional[List[str]]): The streams to run.
+        records (Optional[int]): The number of records after which the tap is stopped.
+        seconds (Optional[float]): The number of seconds after which the tap is stopped.
+    """
+    run = asyncio.ensure_future(runner.async_run(streams=streams))
+    started_at = None
+
+    while not run.done():
+        # Start the clock once the tap is running.
+        if started_at is None and runner._tap_process is not None:
+            started_at = time.monotonic()
+
+        if (records is not None and sum(runner.record_counts.values()) >= records) or (
+            seconds is not None
+            and started_at is not None
+            and time.monotonic() - started_at >= seconds
+        ):
+            runner.stop()
+            break
+
+        await asyncio.wait([run], timeout=CHECK_INTERVAL)
+
+    await run
+
+
+def report(name: str, runner: Runner, elx_cpu_seconds: float, tap_only: bool) -> dict:
+    """
+    Create the benchmark report of a run.
+
+    Args:
+        name (str): The name of the benchmarked runner.
+        runner (Runner): The runner that ran.
+        elx_cpu_seconds (float): The cpu time of elx itself during the run.
+        tap_only (bool): Whether the tap ran into the discard target.
+
+    Returns:
+        dict: The benchmark report.
+    """
+    metrics = runner.metrics.to_dict()
+    duration = metrics["duration_seconds"]
+    streams = {
+        stream_name: runner.metrics.stream(stream_name)
+        for stream_name in runner.metrics.streams
+    }
+    total_records = sum(stream["records"] for stream in streams.values())
+    total_bytes = sum(stream["bytes"] for stream in streams.values())
+
+    for stream in streams.values():
+        stream["bytes_per_second"] = (
+            stream["bytes"] / stream["duration_seconds"]
+            if stream["duration_seconds"] > 0
+            else None
+        )
+
+    cpu_seconds = [
+        metrics["tap_cpu_seconds"],
+        metrics["target_cpu_seconds"],
+        elx_cpu_seconds,
+    ]
+    total_cpu_seconds = sum(value for value in cpu_seconds if value is not None)
+
+    def cpu_share(value: Optional[float]) -> Optional[float]:
+        if value is None or not total_cpu_seconds:
+            return None
+        return value / total_cpu_seconds
+
+    return {
+        "runner": name,
+        "tap": runner.tap.executable,
+        "target": None if tap_only else runner.target.executable,
+        "tap_only": tap_only,
+        "duration_seconds": duration,
+        "records": total_records,
+        "bytes": total_bytes,
+        "records_per_second": total_records / duration if duration > 0 else None,
+        "bytes_per_second": total_bytes / duration if duration > 0 else None,
+        "state_checkpoints": metrics["state_checkpoints"],
+        "elx_cpu_seconds": elx_cpu_seconds,
+        "tap_cpu_seconds": metrics["tap_cpu_seconds"],
+        "target_cpu_seconds": metrics["target_cpu_seconds"],
+        "tap_cpu_share": cpu_share(metrics["tap_cpu_seconds"]),
+        "target_cpu_share": cpu_share(metrics["target_cpu_seconds"]),
+        "elx_cpu_share": cpu_share(elx_cpu_seconds),
+        "tap_peak_rss_bytes": metrics["tap_peak_rss_bytes"],
+        "target_peak_rss_bytes": metrics["target_peak_rss_bytes"],
+        "streams": streams,
+    }
+
+
+def bench(
+    locator: str,
+    runner: str = typer.Option(None, help="The name of the runner to benchmark."),
+    stream: List[str] = typer.Option(
+        None, help="The streams to run, defaults to all selected streams."
+    ),
+    records: int = typer.Option(None, help="Stop the tap after this many records."),
+    seconds: float = typer.Option(None, help="Stop the tap after this many seconds."),
+    tap_only: bool = typer.Option(
+        False, help="Run the tap into a target that discards all records."
+    ),
+    output: Path = typer.Option(
+        None, help="Write the report to this file instead of stdout."
+    ),
+):
+    """
+    Benchmark the throughput of an elx runner. The runner starts without state
+    and its state is not saved. The report is printed as JSON.
+
+    Args:
+        locator (str): The locator to the module or path to file.
+        runner (str): A default runner to select.
+        stream (List[str]): The streams to run.
+        records (int): The number of records after which the tap is stopped.
+        seconds (float): The number of seconds after which the tap is stopped.
+        tap_only (bool): Whether to run the tap into a target that discards all records.
+        output (Path): The file to write the report to.
+    """
+    instances = list(find_instances_of_type(locator, Runner))
+
+    if len(instances) == 0:
+        print("No runners found.")
+        return
+
+    selected_runner = request_instance(
+        instances=instances,
+        default_name=runner,
+        message="Which runner do you want to benchmark?",
+    )
+
+    with tempfile.TemporaryDirectory() as state_directory:
+        # Run a copy of the runner, so the state of the runner is not touched.
+        bench_runner = selected_runner._copy()
+        bench_runner.state_manager = StateManager(base_path=state_directory)
+
+        if tap_only:
+            bench_runner.target = DiscardTarget()
+
+        # Install the tap and target and discover the catalog up front, so they
+        # don't count toward the duration, throughput and cpu time of the run.
+        for singer in [bench_runner.tap, bench_runner.target]:
+            if not singer.is_installed:
+                singer.install()
+        bench_runner.tap.catalog
+
+        cpu_started_at = time.process_time()
+        asyncio.run(
+            run_bounded(
+                bench_runner,
+                streams=stream or None,
+                records=records,
+                seconds=seconds,
+            )
+        )
+        elx_cpu_seconds = time.process_time() - cpu_started_at
+
+    content = json.dumps(
+        report(
+            selected_runner.name,
+            bench_runner,
+            elx_cpu_seconds=elx_cpu_seconds,
+            tap_only=tap_only,
+        ),
+        indent=2,
+    )
+
+    if output:
+        output.write_text(content)
+    else:
+        typer.echo(content)
@@ -1,14 +1,154 @@
+import asyncio
+import contextlib
 import json
 import os
+import time
+from collections import deque
 from pathlib import Path
+from typing import List, Optional
 
 import inquirer
-from rich.console import Console
+import typer
+from rich.console import Console, Group
+from rich.live import Live
+from rich.panel import Panel
 from rich.table import Table
 from rich.json import JSON
 from elx.runner import Runner
 from elx.cli.utils import obfuscate_secrets, find_instances_of_type
-from rich.progress import Progress, BarColumn, TextColumn, TimeElapsedColumn
+
+# The number of lines of the stderr of the tap and target shown in the dashboard.
+STDERR_TAIL_LINES = 10
+
+# The number of times per second the dashboard is refreshed.
+REFRESH_PER_SECOND = 4
+
+
+class StderrTail:
+    """
+    Keeps the last lines of the stderr of the tap and target, instead of
+    printing them over the dashboard.
+    """
+
+    def __init__(self, max_lines: int = STDERR_TAIL_LINES):
+        """
+        Args:
+            max_lines (int): The number of lines to keep.
+        """
+        self.lines = deque(maxlen=max_lines)
+
+    def writelines(self, line: str) -> None:
+        self.lines.append(line.rstrip("\n"))
+
+    def write(self, text: str) -> int:
+        for line in text.splitlines():
+            if line.strip():
+                self.lines.append(line)
+
+        return len(text)
+
+    def flush(self) -> None:
+        pass
+
+
+def format_bytes(size: Optional[float]) -> str:
+    """
+    Format a number of bytes for humans, e.g. "1.5 MiB".
+
+    Args:
+        size (Optional[float]): The number of bytes.
+
+    Returns:
+        str: The formatted size, "-" if it is unknown.
+    """
+    if size is None:
+        return "-"
+
+    for unit in ["B", "KiB", "MiB", "GiB"]:
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+    return f"{size:.1f} TiB"
+
+
+def dashboard(runner: Runner, stderr_tail: StderrTail) -> Group:
+    """
+    Render the live throughput of a running runner.
+
+    Args:
+        runner (Runner): The running runner.
+        stderr_tail (StderrTail): The last lines of the stderr of the tap and target.
+
+    Returns:
+        Group: The dashboard.
+    """
+    metrics = runner.metrics
+
+    streams = Table(title=f"Running {runner.name}", expand=True)
+    streams.add_column("Stream", style="bold")
+    streams.add_column("Records", justify="right")
+    streams.add_column("Records/s", justify="right")
+    streams.add_column("Bytes", justify="right")
+
+    # The dashboard is rendered by the refresh thread of Live while the run adds
+    # streams and stderr lines, so iterate over snapshots of them.
+    for stream_name, stream_metrics in list(metrics.streams.items()):
+        records_per_second = stream_metrics.records_per_second
+        streams.add_row(
+            stream_name,
+            f"{stream_metrics.records:,}",
+            f"{records_per_second:,.0f}" if records_per_second is not None else "-",
+            format_bytes(stream_metrics.bytes),
+        )
+
+    last_state = (
+        f"{time.monotonic() - metrics.last_state_at:.1f}s ago"
+        if metrics.last_state_at is not None
+        else "never"
+    )
+
+    summary = Table(show_header=False)
+    summary.add_column("Metric", style="bold")
+    summary.add_column("Value")
+    summary.add_row("Elapsed", f"{metrics.duration:.1f}s")
+    summary.add_row("State checkpoints", str(metrics.state_checkpoints))
+    summary.add_row("Last state", last_state)
+    # A write buffer that stays full means the target can't keep up with the tap.
+    summary.add_row(
+        "Target write buffer", format_bytes(runner.target_write_buffer_size)
+    )
+
+    return Group(
+        streams,
+        summary,
+        Panel("\n".join(list(stderr_tail.lines)), title="stderr", title_align="left"),
+    )
+
+
+def run_with_dashboard(
+    runner: Runner,
+    streams: Optional[List[str]],
+    console: Console,
+) -> None:
+    """
+    Run a runner while showing a live dashboard of its throughput.
+
+    Args:
+        runner (Runner): The runner to run.
+        streams (Optional[List[str]]): The streams to run, defaults to all selected streams.
+        console (Console): The console to show the dashboard on.
+    """
+    stderr_tail = StderrTail()
+
+    # The stderr of the tap and target is forwarded to sys.stderr, show its tail instead.
+    with contextlib.redirect_stderr(stderr_tail), Live(
+        console=console,
+        get_renderable=lambda: dashboard(runner, stderr_tail),
+        refresh_per_second=REFRESH_PER_SECOND,
+        redirect_stderr=False,
+    ):
+        asyncio.run(runner.async_run(streams=streams))
 
 
 def select_runner(runners: dict[str, Runner]) -> Runner:
@@ -38,9 +178,23 @@ def select_runner(runners: dict[str, Runner]) -> Runner:
     return runners[runner_name]
 
 
-def debug(locator: str):
+def debug(
+    locator: str,
+    run: bool = typer.Option(
+        False,
+        help="Run the runner with a live throughput dashboard, the state is saved.",
+    ),
+    stream: List[str] = typer.Option(
+        None, help="The streams to run, defaults to all selected streams."
+    ),
+):
     """
     Debug an elx runner.
+
+    Args:
+        locator (str): The locator to the module or path to file.
+        run (bool): Whether to run the runner with a live throughput dashboard.
+        stream (List[str]): The streams to run.
     """
     # Get all the runners from the variables
     runners = {
@@ -101,21 +255,5 @@ def debug(locator: str):
 
     console.print(table)
 
-    # runner.tap.invoke()
-
-    # with Progress(
-    #     "[progress.description]{task.description}",
-    #     BarColumn(),
-    #     "[progress.percentage]{task.percentage:>3.0f}%",
-    #     TextColumn("[bold blue]{task.fields[stream]}"),
-    #     # TimeElapsedColumn(),
-    # ) as progress:
-    #     task = progress.add_task(
-    #         "Testing tap streams",
-    #         stream="stream",
-    #         total=len(runner.tap.streams),
-    #     )
-
-    #     for stream in runner.tap.streams:
-    #         progress.update(task, advance=1, stream=stream.name)
-    #         runner.tap.invoke([stream.name], limit=2, debug=False)
+    if run:
+        run_with_dashboard(runner, streams=stream or None, console=console)
@@ -1,46 +1,61 @@
+from typing import List
+
 import inquirer
 import typer
-from pathlib import Path
 from elx.tap import Tap
-from elx.cli.utils import find_instances_of_type
+from elx.cli.utils import find_instances_of_type, request_instance
+from rich import print_json
 
 
 def invoke(
-    locator: Path,
-    limit: int = typer.Option(3, help="Limit the number of records to ingest"),
+    locator: str,
+    tap: str = typer.Option(None, help="The name of the tap to invoke."),
+    stream: List[str] = typer.Option(None, help="The streams to invoke."),
+    limit: int = typer.Option(3, help="Limit the number of records per stream."),
+    timeout: float = typer.Option(None, help="Stop the tap after this many seconds."),
 ):
     """
-    Invoke a target or tap.
+    Invoke a tap and print the first records of every stream. The tap is
+    stopped as soon as every stream has enough records.
 
     Args:
-        path (str): The path to the target or tap.
+        locator (str): The locator to the module or path to file.
+        tap (str): A default tap to select.
+        stream (List[str]): The streams to invoke, asked for if not given.
+        limit (int): The number of records per stream.
+        timeout (float): The maximum number of seconds to invoke the tap for.
     """
-    # Get all instances from foo that are of type Tap
-    taps = {tap.executable: tap for tap in find_instances_of_type(locator, Tap)}
-
-    questions = [
-        inquirer.List(
-            "tap",
-            message="Which tap do you want to invoke?",
-            choices=taps.keys(),
-            carousel=True,
-        ),
-    ]
-
-    tap_name = inquirer.prompt(questions)["tap"]
-
-    tap = taps[tap_name]
-
-    streams = [
-        inquirer.List(
-            "stream",
-            message="Which stream do you want to invoke?",
-            choices=["all", *[stream.name for stream in tap.streams]],
-            default="all",
-            carousel=True,
-        ),
-    ]
-
-    stream_name = inquirer.prompt(streams)["stream"]
-
-    tap.invoke([stream_name], limit=limit)
+    instances = list(find_instances_of_type(locator, Tap))
+
+    if len(instances) == 0:
+        print("No taps found.")
+        return
+
+    tap = request_instance(
+        instances=instances,
+        default_name=tap,
+        message="Which tap do you want to invoke?",
+    )
+
+    if not stream:
+        questions = [
+            inquirer.List(
+                "stream",
+                message="Which stream do you want to invoke?",
+                choices=[
+                    "all",
+                    *[
+                        stream.name
+                        for stream in tap.catalog.streams
+                        if stream.is_selected
+                    ],
+                ],
+                default="all",
+                carousel=True,
+            ),
+        ]
+
+        stream_name = inquirer.prompt(questions)["stream"]
+        stream = None if stream_name == "all" else [stream_name]
+
+    print_json(data=tap.sample(streams=stream, limit=limit, timeout=timeout))
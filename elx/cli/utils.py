@@ -1,29 +1,209 @@
+import ast
 import importlib
-from importlib.machinery import SourceFileLoader
+import importlib.util
+import json
 import os
 import pkgutil
-from typing import Any, Generator, List
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any, Generator, List, Optional
 
 import inquirer
 
+from elx.json_temp_file import is_private_directory
 
-def find_sub_modules(module: Any) -> Generator:
+# Calls that create the instances elx looks for, modules without them are not imported.
+INSTANCE_CONSTRUCTORS = {"Tap", "Target", "Runner"}
+
+# Environment variable to import every submodule instead of scanning them first, e.g.
+# when instances are created by factory functions or subclasses.
+FULL_IMPORT_ENV_VAR = "ELX_FULL_IMPORT"
+
+# File that caches the result of the scan of every module by its modification time.
+SCAN_CACHE_FILE_NAME = "module_scan.json"
+
+
+def user_cache_directory() -> Path:
+    """
+    Get the cache directory of elx for the current user, e.g. `~/.cache/elx`.
+
+    Returns:
+        Path: The cache directory.
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "elx"
+
+
+def creates_instances(path: str) -> bool:
+    """
+    Statically check whether a module calls one of the constructors of elx
+    instances, e.g. `Tap(...)` or `elx.Runner(...)`, without importing it.
+
+    Args:
+        path (str): The path to the source of the module.
+
+    Returns:
+        bool: Whether the module may create instances. True if it can't be parsed,
+            so importing it surfaces the error.
+    """
+    try:
+        with open(path, "rb") as source_file:
+            tree = ast.parse(source_file.read(), filename=path)
+    except (OSError, SyntaxError, ValueError):
+        return True
+
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Call):
+            continue
+
+        if isinstance(node.func, ast.Name) and node.func.id in INSTANCE_CONSTRUCTORS:
+            return True
+
+        if (
+            isinstance(node.func, ast.Attribute)
+            and node.func.attr in INSTANCE_CONSTRUCTORS
+        ):
+            return True
+
+    return False
+
+
+class ModuleScanCache:
+    """
+    Caches which modules may create instances by the modification time of their
+    source, so unchanged modules aren't parsed again by the next command. The
+    cache is skipped if its directory isn't private to the current user, as
+    other users could plant entries that hide modules.
+    """
+
+    def __init__(self, path: Optional[Path] = None):
+        """
+        Args:
+            path (Optional[Path]): The cache file, defaults to a file in the cache directory of the user.
+        """
+        self.path = path or user_cache_directory() / SCAN_CACHE_FILE_NAME
+        self.changed = False
+        self.entries = {}
+
+        if not is_private_directory(self.path.parent):
+            return
+
+        try:
+            self.entries = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            pass
+
+    def creates_instances(self, path: str) -> bool:
+        """
+        Check whether a module may create instances, see `creates_instances`.
+
+        Args:
+            path (str): The path to the source of the module.
+
+        Returns:
+            bool: Whether the module may create instances.
+        """
+        modified_at = os.stat(path).st_mtime_ns
+        entry = self.entries.get(path)
+
+        if entry is not None and entry[0] == modified_at:
+            return entry[1]
+
+        result = creates_instances(path)
+        self.entries[path] = [modified_at, result]
+        self.changed = True
+        return result
+
+    def save(self) -> None:
+        """
+        Save the cache if it changed. The cache is optional, so failing to write it is ignored.
+        """
+        if not self.changed:
+            return
+
+        try:
+            self.path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+
+            if not is_private_directory(self.path.parent):
+                return
+
+            # Write to a temporary file first and move it into place, so
+            # concurrent commands never read a partially written cache.
+            with tempfile.NamedTemporaryFile(
+                mode="w",
+                dir=self.path.parent,
+                suffix=".json",
+                delete=False,
+            ) as cache_file:
+                json.dump(self.entries, cache_file)
+
+            os.replace(cache_file.name, self.path)
+        except OSError:
+            return
+
+        self.changed = False
+
+
+def walk_module_specs(paths: List[str], prefix: str) -> Generator:
     """
-    Find all submodules of a module.
+    Find the specs of all submodules in the paths of a package, without importing them.
+
+    Args:
+        paths (List[str]): The search paths of the package.
+        prefix (str): The prefix of the module names, e.g. "package.".
+
+    Returns:
+        Generator: A generator of module specs.
+    """
+    for module_info in pkgutil.iter_modules(paths, prefix):
+        spec = module_info.module_finder.find_spec(module_info.name)
+
+        if spec is None:
+            continue
+
+        yield spec
+
+        if module_info.ispkg and spec.submodule_search_locations:
+            yield from walk_module_specs(
+                spec.submodule_search_locations, f"{module_info.name}."
+            )
+
+
+def find_sub_modules(module: Any, scan: bool = True) -> Generator:
+    """
+    Find all submodules of a module. When scanning, only the submodules that
+    create elx instances (see `creates_instances`) are imported, so module
+    level code of other modules, e.g. discovery, doesn't run.
 
     Args:
         module (Any): The module to find submodules of.
+        scan (bool): Whether to scan the submodules before importing them.
 
     Returns:
         Generator: A generator of submodules.
     """
-    for loader, module_name, is_pkg in pkgutil.walk_packages(module.__path__):
-        yield loader.find_module(module_name).load_module(module_name)
+    cache = ModuleScanCache() if scan else None
+
+    try:
+        for spec in walk_module_specs(module.__path__, f"{module.__name__}."):
+            # Modules without a Python source, e.g. extension modules, can't be scanned.
+            if (
+                cache is None
+                or not spec.has_location
+                or not spec.origin.endswith(".py")
+                or cache.creates_instances(spec.origin)
+            ):
+                yield importlib.import_module(spec.name)
+    finally:
+        if cache is not None:
+            cache.save()
 
 
 def find_instances_of_type(locator: str, type: Any) -> Generator[Any, None, None]:
     """
-    Find all instances of a type in a module or path.
+    Find all instances of a type in a module or path. Submodules are scanned
+    before they are imported, set `ELX_FULL_IMPORT=true` to import them all.
 
     Args:
         locator (str): The locator to the module or path to file.
@@ -34,7 +214,11 @@ def find_instances_of_type(locator: str, type: Any) -> Generator[Any, None, None
     """
     # If the locator is a file, load the module
     if locator.endswith(".py"):
-        module = SourceFileLoader("module", locator).load_module()
+        spec = importlib.util.spec_from_file_location("module", locator)
+        module = importlib.util.module_from_spec(spec)
+        # Register the module like an import, e.g. for dataclasses and pickling.
+        sys.modules[spec.name] = module
+        spec.loader.exec_module(module)
         yield from [
             instance for instance in vars(module).values() if isinstance(instance, type)
         ]
@@ -43,7 +227,9 @@ def find_instances_of_type(locator: str, type: Any) -> Generator[Any, None, None
         start_module = importlib.import_module(locator)
 
         # Find all submodules of the module
-        for module in find_sub_modules(start_module):
+        scan = os.environ.get(FULL_IMPORT_ENV_VAR, "").lower() not in ("1", "true")
+
+        for module in find_sub_modules(start_module, scan=scan):
             yield from [
                 instance
                 for instance in vars(module).values()
@@ -104,9 +290,12 @@ def obfuscate_secrets(config: dict, secrets: dict = os.environ) -> str:
     Returns:
         str: The obfuscated config.
     """
+    # Build a new config, the config of a plugin is memoized and must not be modified.
+    obfuscated_config = dict(config)
+    secret_values = set(secrets.values())
+
     for key, value in config.items():
-        for secret_key, secret_value in secrets.items():
-            if secret_value == value:
-                config[key] = secret_value[:3] + "*" * (len(secret_value) - 3)
+        if isinstance(value, str) and value in secret_values:
+            obfuscated_config[key] = value[:3] + "*" * (len(value) - 3)
 
-    return config
+    return obfuscated_config
@@ -1,5 +1,10 @@
+import asyncio
+import queue
+import threading
+from pathlib import Path
 from typing import Generator, Iterable, List, Mapping, Sequence
 from elx import Runner
+from elx.catalog import Catalog
 from dagster import (
     AssetsDefinition,
     Nothing,
@@ -8,6 +13,7 @@ from dagster import (
     multi_asset,
     AssetOut,
     SourceAsset,
+    TimeWindowPartitionsDefinition,
     AssetKey,
     AssetDep,
     get_dagster_logger,
@@ -17,11 +23,140 @@ from elx.extensions.dagster.utils import dagster_safe_name, generate_description
 logger = get_dagster_logger()
 
 
+def load_catalog(runner: Runner, catalog_snapshot: str | Path | None = None) -> Catalog:
+    """
+    Load the catalog to build the assets from. With a snapshot directory, the
+    catalog is loaded from the snapshot of the tap, and discovered and saved
+    only if there is no snapshot yet.
+
+    Args:
+        runner (Runner): The runner to load the catalog for.
+        catalog_snapshot (str | Path | None): The directory of the catalog snapshots.
+
+    Returns:
+        Catalog: The catalog.
+    """
+    if catalog_snapshot is None:
+        return runner.tap.catalog
+
+    catalog = runner.tap.load_catalog_snapshot(catalog_snapshot)
+
+    if catalog is None:
+        logger.info(
+            f"No catalog snapshot for {runner.tap.executable}, discovering the catalog."
+        )
+        catalog = runner.tap.save_catalog_snapshot(catalog_snapshot)
+
+    return catalog
+
+
+def check_catalog_drift(runner: Runner, catalog: Catalog) -> None:
+    """
+    Warn if the discovered catalog differs from the catalog the assets were built from.
+
+    Args:
+        runner (Runner): The runner to check.
+        catalog (Catalog): The catalog the assets were built from.
+    """
+    if runner.tap.catalog == catalog:
+        return
+
+    snapshot_streams = {stream.name for stream in catalog.streams if stream.is_selected}
+    discovered_streams = {
+        stream.name for stream in runner.tap.catalog.streams if stream.is_selected
+    }
+
+    logger.warning(
+        f"The catalog of {runner.tap.executable} differs from its snapshot "
+        f"(added streams: {sorted(discovered_streams - snapshot_streams)}, "
+        f"removed streams: {sorted(snapshot_streams - discovered_streams)}). "
+        "Remove the snapshot to rebuild the assets."
+    )
+
+
+def performance_metadata(runner: Runner, stream: str) -> dict:
+    """
+    Get the performance metrics of a stream and its run as Dagster metadata.
+
+    Args:
+        runner (Runner): The runner that ran the stream.
+        stream (str): The name of the stream.
+
+    Returns:
+        dict: The metrics that are known, e.g. cpu time is unknown on platforms without /proc.
+    """
+    stream_metrics = runner.metrics.stream(stream)
+    # The number of records is already the row count.
+    stream_metrics.pop("records")
+
+    metrics = {
+        **stream_metrics,
+        **{f"run_{key}": value for key, value in runner.metrics.to_dict().items()},
+    }
+
+    return {key: value for key, value in metrics.items() if value is not None}
+
+
+def run_incrementally(
+    runner: Runner,
+    streams: List[str],
+    parallelism: int = 1,
+) -> Generator[str, None, None]:
+    """
+    Run a runner in a separate thread and yield the streams as soon as they are complete.
+
+    Args:
+        runner (Runner): The runner to run.
+        streams (List[str]): The streams to run.
+        parallelism (int): The number of groups of streams that run at the same time.
+
+    Yields:
+        Generator[str, None, None]: The names of the completed streams.
+    """
+    completed_streams = queue.Queue()
+    # Marks the end of the run, with the exception of the run if it failed.
+    done = object()
+    exceptions = []
+
+    def run() -> None:
+        try:
+            asyncio.run(
+                runner.async_run(
+                    streams=streams,
+                    logger=logger,
+                    on_stream_complete=completed_streams.put,
+                    parallelism=parallelism,
+                )
+            )
+        except BaseException as e:
+            exceptions.append(e)
+        finally:
+            completed_streams.put(done)
+
+    thread = threading.Thread(target=run, name=f"elx-{runner.name}", daemon=True)
+    thread.start()
+
+    while (stream := completed_streams.get()) is not done:
+        yield stream
+
+    thread.join()
+
+    if exceptions:
+        raise exceptions[0]
+
+
 def load_assets(
     runner: Runner,
-    deps: Iterable[AssetKey | str | Sequence[str] | AssetsDefinition | SourceAsset | AssetDep] | None = None,
+    deps: Iterable[
+        AssetKey | str | Sequence[str] | AssetsDefinition | SourceAsset | AssetDep
+    ]
+    | None = None,
     key_prefix: str | Sequence[str] | None = None,
     group_name: str | None = None,
+    catalog_snapshot: str | Path | None = None,
+    incremental_outputs: bool = False,
+    partitions_def: TimeWindowPartitionsDefinition | None = None,
+    parallelism: int = 1,
 ) -> List[AssetsDefinition]:
     """
     Load the assets for a runner, each asset represents one tap target combination.
@@ -31,11 +166,23 @@ def load_assets(
         deps (Iterable[AssetKey | str | Sequence[str] | AssetsDefinition | SourceAsset | AssetDep] | None): Upstream assets upon which the assets depend.
         key_prefix (str | Sequence[str] | None): Key prefix for the assets. If not provided, defaults to the tap executable name.
         group_name (str | None): Group name for the assets. If not provided, defaults to the tap executable name.
+        catalog_snapshot (str | Path | None): Directory of catalog snapshots to build the assets from, instead of
+            running discovery when the definitions are loaded. A missing snapshot is discovered and saved, and
+            drift from the discovered catalog is checked at run time.
+        incremental_outputs (bool): Emit the output of every stream as soon as the stream is completely loaded,
+            so downstream assets can start while other streams are still running. Defaults to False.
+        partitions_def (TimeWindowPartitionsDefinition | None): Partition the assets by time window. Every partition
+            runs with `{PARTITION_START}` and `{PARTITION_END}` in the interpolation values and its own state file,
+            so backfills run as many independent runs.
+        parallelism (int): Split the selected streams into this many groups, which run as separate taps and
+            targets at the same time within the step. The bookmarks are merged per stream. Defaults to 1.
 
     Returns:
         List[AssetsDefinition]: The assets.
     """
 
+    catalog = load_catalog(runner, catalog_snapshot)
+
     def run_factory(runner: Runner) -> callable:
         """
         Create a run function for a runner.
@@ -57,36 +204,75 @@ def load_assets(
             Yields:
                 Generator[Output, None, None]: The names of the selected outputs.
             """
+            # Every partition runs with its own interpolation values and state.
+            context_runner = runner
+            if context.has_partition_key:
+                time_window = context.partition_time_window
+                context_runner = runner.partition(
+                    key=context.partition_key,
+                    start=time_window.start,
+                    end=time_window.end,
+                )
+
+            if catalog_snapshot is not None:
+                check_catalog_drift(context_runner, catalog)
+
             # Build a mapping from dagster-safe names back to original stream names
             stream_name_mapping = {
                 dagster_safe_name(stream.name): stream.name
-                for stream in runner.tap.catalog.streams
+                for stream in context_runner.tap.catalog.streams
                 if stream.is_selected
             }
 
-            # Execute the runner and yield the selected outputs.
-            runner.run(
-                streams=list(context.selected_output_names),
-                logger=logger,
-            )
-
-            for context_output_name in context.selected_output_names:
+            def output(context_output_name: str) -> Output:
                 # Get the original stream name to look up the row count
                 original_stream_name = stream_name_mapping.get(
                     context_output_name, context_output_name
                 )
-                row_count = runner.record_counts.get(original_stream_name, 0)
+                row_count = context_runner.record_counts.get(original_stream_name, 0)
 
-                yield Output(
+                return Output(
                     value=Nothing,
                     output_name=context_output_name,
                     metadata={
-                        "state_path": f"{runner.state_manager.base_path}/{runner.state_file_name}",
-                        "state": runner.load_state(),
+                        "state_path": f"{context_runner.state_manager.base_path}/{context_runner.state_file_name}",
+                        "state": context_runner.load_state(),
                         "row_count": row_count,
+                        **performance_metadata(context_runner, original_stream_name),
                     },
                 )
 
+            streams = [
+                stream_name_mapping.get(context_output_name, context_output_name)
+                for context_output_name in context.selected_output_names
+            ]
+
+            # Yield the outputs of the streams as soon as they are complete.
+            emitted_output_names = set()
+
+            if incremental_outputs:
+                for stream in run_incrementally(context_runner, streams, parallelism):
+                    context_output_name = dagster_safe_name(stream)
+
+                    if (
+                        context_output_name in context.selected_output_names
+                        and context_output_name not in emitted_output_names
+                    ):
+                        emitted_output_names.add(context_output_name)
+                        yield output(context_output_name)
+            else:
+                # Execute the context_runner.
+                context_runner.run(
+                    streams=streams,
+                    logger=logger,
+                    parallelism=parallelism,
+                )
+
+            # Yield the remaining selected outputs, e.g. of streams without records.
+            for context_output_name in context.selected_output_names:
+                if context_output_name not in emitted_output_names:
+                    yield output(context_output_name)
+
         return run
 
     return [
@@ -100,10 +286,11 @@ def load_assets(
                     key_prefix=key_prefix or dagster_safe_name(runner.tap.executable),
                     code_version=runner.tap.hash_key,
                 )
-                for stream in runner.tap.catalog.streams
+                for stream in catalog.streams
                 if stream.is_selected
             },
             can_subset=True,
+            partitions_def=partitions_def,
             group_name=group_name or dagster_safe_name(runner.tap.executable),
             compute_kind="python",
         )(run_factory(runner))
@@ -0,0 +1,206 @@
+import codecs
+import json
+import re
+from typing import Any, Generator, List
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+class IncompleteValue(Exception):
+    """Raised when a value is not completely received yet."""
+
+    pass
+
+
+class JsonArrayParser:
+    """
+    Incrementally parses the items of an array under a top-level key of a JSON
+    object, e.g. the `streams` of a catalog, while the document is being received.
+    Items are returned as soon as they are complete, so the document never has to
+    be held in memory as a whole.
+    """
+
+    def __init__(self, key: str):
+        """
+        Args:
+            key (str): The top-level key of the array to parse, e.g. "streams".
+        """
+        self.key = key
+        self.values: dict = {}
+        self.buffer = ""
+        self.position = 0
+        self.state = "object_start"
+        self.closed = False
+        self.decoder = json.JSONDecoder()
+        self.utf8_decoder = codecs.getincrementaldecoder("utf-8")()
+        self._current_key = None
+        # Size the remaining buffer has to reach before retrying an incomplete value.
+        self._minimum_size = 0
+
+    def feed(self, chunk: bytes) -> List[Any]:
+        """
+        Feed a chunk of the document to the parser.
+
+        Args:
+            chunk (bytes): The next chunk of the document.
+
+        Returns:
+            List[Any]: The array items that were completed by this chunk.
+        """
+        self.buffer += self.utf8_decoder.decode(chunk)
+
+        # Wait for more data if the previous attempt ran out of data, this keeps
+        # parsing linear for values that span many chunks.
+        if len(self.buffer) - self.position < self._minimum_size:
+            return []
+
+        return list(self._parse())
+
+    def close(self) -> List[Any]:
+        """
+        Signal the end of the document.
+
+        Returns:
+            List[Any]: The array items that were completed by the end of the document.
+
+        Raises:
+            json.JSONDecodeError: If the document is incomplete or invalid.
+        """
+        self.buffer += self.utf8_decoder.decode(b"", final=True)
+        self.closed = True
+        items = list(self._parse())
+
+        if self.state != "end":
+            raise json.JSONDecodeError(
+                "Unexpected end of document", self.buffer, self.position
+            )
+
+        return items
+
+    def _skip_whitespace(self) -> bool:
+        """
+        Skip whitespace in the buffer.
+
+        Returns:
+            bool: True if there is a character to parse, False if more data is needed.
+        """
+        self.position = WHITESPACE.match(self.buffer, self.position).end()
+        return self.position < len(self.buffer)
+
+    def _expect(self, characters: str) -> str:
+        """
+        Consume one of the expected characters.
+
+        Args:
+            characters (str): The characters that are allowed at this position.
+
+        Returns:
+            str: The consumed character.
+
+        Raises:
+            json.JSONDecodeError: If another character is found.
+        """
+        character = self.buffer[self.position]
+
+        if character not in characters:
+            raise json.JSONDecodeError(
+                f"Expecting one of '{characters}'", self.buffer, self.position
+            )
+
+        self.position += 1
+        return character
+
+    def _decode(self) -> Any:
+        """
+        Decode the next value in the buffer.
+
+        Returns:
+            Any: The decoded value.
+
+        Raises:
+            IncompleteValue: If the value is incomplete and more data is needed.
+            json.JSONDecodeError: If the document is closed and the value is invalid.
+        """
+        try:
+            value, end = self.decoder.raw_decode(self.buffer, self.position)
+        except json.JSONDecodeError:
+            if self.closed:
+                raise
+            self._minimum_size = 2 * (len(self.buffer) - self.position)
+            raise IncompleteValue()
+
+        # A value that ends at the end of the buffer could be truncated, e.g. a number.
+        if end == len(self.buffer) and not self.closed:
+            self._minimum_size = 2 * (len(self.buffer) - self.position)
+            raise IncompleteValue()
+
+        self.position = end
+        self._minimum_size = 0
+        return value
+
+    def _parse(self) -> Generator[Any, None, None]:
+        """
+        Parse as much of the buffer as possible.
+
+        Yields:
+            Any: The completed array items.
+        """
+        try:
+            while self._skip_whitespace():
+                if self.state == "object_start":
+                    self._expect("{")
+                    self.state = "key_or_object_end"
+
+                elif self.state in ("key", "key_or_object_end"):
+                    if self.state == "key_or_object_end" and self._expect('}"') == "}":
+                        self.state = "end"
+                        continue
+                    if self.state == "key":
+                        self._expect('"')
+                    # Decode the key including its opening quote.
+                    self.position -= 1
+                    self._current_key = self._decode()
+                    self.state = "colon"
+
+                elif self.state == "colon":
+                    self._expect(":")
+                    self.state = (
+                        "array_start" if self._current_key == self.key else "value"
+                    )
+
+                elif self.state == "value":
+                    self.values[self._current_key] = self._decode()
+                    self.state = "key_separator"
+
+                elif self.state == "key_separator":
+                    self.state = "key" if self._expect(",}") == "," else "end"
+
+                elif self.state == "array_start":
+                    self._expect("[")
+                    self.state = "item_or_array_end"
+
+                elif self.state in ("item", "item_or_array_end"):
+                    if (
+                        self.state == "item_or_array_end"
+                        and self.buffer[self.position] == "]"
+                    ):
+                        self.position += 1
+                        self.state = "key_separator"
+                        continue
+                    yield self._decode()
+                    self.state = "item_separator"
+
+                elif self.state == "item_separator":
+                    self.state = (
+                        "item" if self._expect(",]") == "," else "key_separator"
+                    )
+
+                else:
+                    raise json.JSONDecodeError("Extra data", self.buffer, self.position)
+        except IncompleteValue:
+            # Wait for more data to complete the value.
+            pass
+        finally:
+            # Drop the parsed part of the buffer.
+            self.buffer = self.buffer[self.position :]
+            self.position = 0
@@ -1,15 +1,189 @@
+import atexit
 import contextlib
+import errno
+import hashlib
 import json
+import os
+import re
+import shutil
+import stat
+import time
 from pathlib import Path
 import tempfile
-from typing import Generator
+from typing import Callable, Generator, Optional, TypeVar
+
+# Directory for content-addressed files that are reused between runs.
+CACHE_DIRECTORY_NAME = "elx"
+
+# Content-addressed files that weren't used for this long are removed.
+CACHE_MAX_AGE = 24 * 60 * 60
+# The maximum total size of the content-addressed files that are kept, as they
+# are kept in memory when the temporary directory is `/dev/shm`.
+CACHE_MAX_BYTES = 128 * 1024 * 1024
+# The names of content-addressed files, the sha256 of the content and a suffix.
+CACHE_FILE_PATTERN = re.compile(r"^[0-9a-f]{64}\.[a-z]+$")
+
+# Environment variable to override the directory of temporary files.
+TEMP_DIR_ENV_VAR = "ELX_TEMP_DIR"
+
+# Environment variable to allow writing to the default temporary directory on
+# disk if the temporary directory is full.
+DISK_FALLBACK_ENV_VAR = "ELX_DISK_FALLBACK"
+
+# Memory-backed directory that is preferred for temporary files.
+SHARED_MEMORY_DIRECTORY = "/dev/shm"
+
+
+def temp_directory() -> Path:
+    """
+    Get the directory for temporary files, e.g. the config, catalog and state
+    that are handed off to taps and targets. This is `ELX_TEMP_DIR` if set,
+    otherwise `/dev/shm` if it is writable, so the files (and secrets) are kept
+    in memory instead of on disk, otherwise the default temporary directory.
+
+    Returns:
+        Path: The directory for temporary files.
+    """
+    if os.environ.get(TEMP_DIR_ENV_VAR):
+        return Path(os.environ[TEMP_DIR_ENV_VAR])
+
+    if os.access(SHARED_MEMORY_DIRECTORY, os.W_OK | os.X_OK):
+        return Path(SHARED_MEMORY_DIRECTORY)
+
+    return Path(tempfile.gettempdir())
+
+
+T = TypeVar("T")
+
+# A private directory for content-addressed files, if the shared one can't be trusted.
+_private_cache_directory: Optional[Path] = None
+
+
+def with_disk_fallback(write: Callable[[Path], T]) -> T:
+    """
+    Write to the temporary directory. If the temporary directory is full, e.g. a
+    small `/dev/shm`, only write to the default temporary directory on disk if
+    `ELX_DISK_FALLBACK=true`, as the files may contain secrets.
+
+    Args:
+        write (Callable[[Path], T]): Writes to the given temporary directory.
+
+    Returns:
+        T: The result of the write.
+
+    Raises:
+        OSError: If the temporary directory is full and there is no fallback to disk.
+    """
+    directory = temp_directory()
+
+    try:
+        return write(directory)
+    except OSError as e:
+        disk_directory = Path(tempfile.gettempdir())
+
+        if e.errno != errno.ENOSPC or directory == disk_directory:
+            raise
+
+        if os.environ.get(DISK_FALLBACK_ENV_VAR, "").lower() not in ("1", "true"):
+            raise OSError(
+                errno.ENOSPC,
+                f"The temporary directory {directory} is full. Set {TEMP_DIR_ENV_VAR} to "
+                f"another directory, or {DISK_FALLBACK_ENV_VAR}=true to write to "
+                f"{disk_directory} on disk instead.",
+            ) from e
+
+        return write(disk_directory)
+
+
+def is_private_directory(path: Path) -> bool:
+    """
+    Check that a directory is owned by the current user and only accessible by
+    them, so the files in it can't have been planted by other users.
+
+    Args:
+        path (Path): The directory.
+
+    Returns:
+        bool: Whether the directory is private.
+    """
+    try:
+        path_stat = os.lstat(path)
+    except OSError:
+        return False
+
+    return (
+        stat.S_ISDIR(path_stat.st_mode)
+        and path_stat.st_uid == os.getuid()
+        and not path_stat.st_mode & 0o077
+    )
+
+
+def cache_directory(base_directory: Path) -> Path:
+    """
+    Get the directory for content-addressed files in a temporary directory. If
+    the directory is owned or writable by another user, a private directory is
+    used instead, which is removed when the process exits.
+
+    Args:
+        base_directory (Path): The temporary directory.
+
+    Returns:
+        Path: The directory for content-addressed files.
+    """
+    global _private_cache_directory
+
+    directory = base_directory / CACHE_DIRECTORY_NAME
+
+    with contextlib.suppress(FileExistsError):
+        directory.mkdir(mode=0o700)
+
+    if is_private_directory(directory):
+        return directory
+
+    if _private_cache_directory is None:
+        _private_cache_directory = Path(tempfile.mkdtemp(prefix="elx-"))
+        atexit.register(shutil.rmtree, _private_cache_directory, ignore_errors=True)
+
+    return _private_cache_directory
+
+
+def evict_cached_files(directory: Path) -> None:
+    """
+    Remove content-addressed files that weren't used for `CACHE_MAX_AGE`
+    seconds, and the least recently used files beyond `CACHE_MAX_BYTES` in
+    total, so they don't fill up a memory-backed temporary directory. The most
+    recently used file is always kept.
+
+    Args:
+        directory (Path): The directory of the content-addressed files.
+    """
+    files = []
+
+    for entry in os.scandir(directory):
+        if not CACHE_FILE_PATTERN.match(entry.name):
+            continue
+
+        with contextlib.suppress(FileNotFoundError):
+            file_stat = entry.stat(follow_symlinks=False)
+            files.append((file_stat.st_mtime, file_stat.st_size, entry.path))
+
+    files.sort(reverse=True)
+    expired_at = time.time() - CACHE_MAX_AGE
+    total_size = 0
+
+    for index, (modified_at, size, path) in enumerate(files):
+        total_size += size
+
+        if index > 0 and (total_size > CACHE_MAX_BYTES or modified_at < expired_at):
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(path)
 
 
 @contextlib.contextmanager
 def json_temp_file(content: dict) -> Generator[Path, None, None]:
     """
-    Write a json object to a temporary file. The file is deleted after the
-    context manager exits.
+    Write a json object to a temporary file that is only readable by the
+    current user. The file is deleted after the context manager exits.
 
     Args:
         content (dict): The object to write to the file.
@@ -17,17 +191,80 @@ def json_temp_file(content: dict) -> Generator[Path, None, None]:
     Yields:
         Path: Path to the catalog.
     """
-    try:
-        # Use tempfile to create a temporary config file.
+
+    def write(directory: Path) -> Path:
+        # Use tempfile to create a temporary config file, which is created with 0600 permissions.
         with tempfile.NamedTemporaryFile(
             mode="w",
             suffix=".json",
+            dir=directory,
             delete=False,
         ) as catalog_file:
-            # Write the config attribute to the config file.
-            catalog_file.write(json.dumps(content))
+            path = Path(catalog_file.name)
+            try:
+                # Write the config attribute to the config file.
+                json.dump(content, catalog_file)
+                catalog_file.flush()
+            except BaseException:
+                path.unlink()
+                raise
+
+        return path
+
+    path = with_disk_fallback(write)
+
+    try:
         # Yield the path to the config file.
-        yield Path(catalog_file.name)
+        yield path
     finally:
         # Always delete the catalog file.
-        Path(catalog_file.name).unlink()
+        path.unlink(missing_ok=True)
+
+
+def content_addressed_file(content: bytes, suffix: str = ".json") -> Path:
+    """
+    Write content to a file named after the hash of the content. If the file
+    already exists it is reused, so identical content is only written once.
+    Files that are not used anymore are evicted when new files are written.
+
+    Args:
+        content (bytes): The content to write to the file.
+        suffix (str): The suffix of the file.
+
+    Returns:
+        Path: Path to the file.
+    """
+    file_name = f"{hashlib.sha256(content).hexdigest()}{suffix}"
+
+    def write(base_directory: Path) -> Path:
+        directory = cache_directory(base_directory)
+        path = directory / file_name
+
+        try:
+            # Mark the file as used, so it isn't evicted.
+            os.utime(path)
+            return path
+        except FileNotFoundError:
+            pass
+
+        # Write to a temporary file first and move it into place, so a
+        # concurrent reader never sees a partially written file.
+        with tempfile.NamedTemporaryFile(
+            mode="wb",
+            dir=directory,
+            suffix=suffix,
+            delete=False,
+        ) as temp_file:
+            try:
+                temp_file.write(content)
+                temp_file.flush()
+            except BaseException:
+                os.unlink(temp_file.name)
+                raise
+
+        os.replace(temp_file.name, path)
+        evict_cached_files(directory)
+
+        return path
+
+    return with_disk_fallback(write)
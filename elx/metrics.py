@@ -0,0 +1,307 @@
+import asyncio
+import os
+import time
+from typing import Dict, List, Optional
+
+# Seconds between samples of the cpu time and memory of a process.
+SAMPLE_INTERVAL = 0.5
+
+
+class StreamMetrics:
+    """
+    Throughput of a stream during a run.
+    """
+
+    def __init__(self, started_at: float):
+        """
+        Args:
+            started_at (float): The monotonic time the run started at.
+        """
+        self.run_started_at = started_at
+        self.records = 0
+        self.bytes = 0
+        self.started_at: Optional[float] = None
+        self.first_record_at: Optional[float] = None
+        self.last_message_at: Optional[float] = None
+
+    def observe(self, message_type: str, size: int, now: float) -> None:
+        """
+        Observe a message of the stream.
+
+        Args:
+            message_type (str): The type of the message, e.g. "RECORD".
+            size (int): The size of the message in bytes.
+            now (float): The monotonic time the message was received at.
+        """
+        if self.started_at is None:
+            self.started_at = now
+
+        if message_type == "RECORD":
+            self.records += 1
+            if self.first_record_at is None:
+                self.first_record_at = now
+
+        self.bytes += size
+        self.last_message_at = now
+
+    @property
+    def duration(self) -> float:
+        """
+        Returns:
+            float: The seconds between the first and the last message of the stream.
+        """
+        if self.started_at is None:
+            return 0.0
+
+        return self.last_message_at - self.started_at
+
+    @property
+    def records_per_second(self) -> Optional[float]:
+        """
+        Returns:
+            Optional[float]: The records per second, None if the duration is too short to tell.
+        """
+        if self.duration <= 0:
+            return None
+
+        return self.records / self.duration
+
+    @property
+    def time_to_first_record(self) -> Optional[float]:
+        """
+        Returns:
+            Optional[float]: The seconds from the start of the run to the first record.
+        """
+        if self.first_record_at is None:
+            return None
+
+        return self.first_record_at - self.run_started_at
+
+    def to_dict(self) -> dict:
+        """
+        Returns:
+            dict: The metrics of the stream.
+        """
+        return {
+            "records": self.records,
+            "bytes": self.bytes,
+            "duration_seconds": self.duration,
+            "records_per_second": self.records_per_second,
+            "time_to_first_record_seconds": self.time_to_first_record,
+        }
+
+
+class ProcessMetrics:
+    """
+    Resource usage of a process, sampled from /proc while the process runs.
+    On platforms without /proc no samples are taken.
+    """
+
+    def __init__(self, pid: int):
+        """
+        Args:
+            pid (int): The id of the process.
+        """
+        self.pid = pid
+        self.cpu_seconds: Optional[float] = None
+        self.peak_rss_bytes: Optional[int] = None
+
+    def sample(self) -> bool:
+        """
+        Sample the cpu time and peak memory of the process.
+
+        Returns:
+            bool: False if the process can't be sampled (anymore).
+        """
+        try:
+            with open(f"/proc/{self.pid}/stat") as stat_file:
+                # The command can contain spaces, the fields start after its closing parenthesis.
+                fields = stat_file.read().rsplit(")", 1)[1].split()
+            with open(f"/proc/{self.pid}/status") as status_file:
+                status = status_file.read()
+        except (FileNotFoundError, ProcessLookupError, IndexError):
+            return False
+
+        # utime and stime are the 14th and 15th field of the stat file.
+        ticks = int(fields[11]) + int(fields[12])
+        self.cpu_seconds = ticks / os.sysconf("SC_CLK_TCK")
+
+        for line in status.splitlines():
+            # VmHWM is the peak resident set size in kB.
+            if line.startswith("VmHWM:"):
+                self.peak_rss_bytes = int(line.split()[1]) * 1024
+                break
+
+        return True
+
+    async def sample_until_exit(
+        self, process: asyncio.subprocess.Process, interval: float = SAMPLE_INTERVAL
+    ) -> None:
+        """
+        Sample the process until it exits.
+
+        Args:
+            process (asyncio.subprocess.Process): The process to sample.
+            interval (float): The seconds between samples.
+        """
+        while process.returncode is None and self.sample():
+            await asyncio.sleep(interval)
+
+    @staticmethod
+    def merge(metrics: List[Optional["ProcessMetrics"]]) -> Optional["ProcessMetrics"]:
+        """
+        Combine the metrics of processes that ran at the same time.
+
+        Args:
+            metrics (List[Optional[ProcessMetrics]]): The metrics of the processes.
+
+        Returns:
+            Optional[ProcessMetrics]: The total cpu time and the sum of the peak memory
+                (an upper bound of the combined peak), None if there are no metrics.
+        """
+        metrics = [item for item in metrics if item is not None]
+
+        if not metrics:
+            return None
+
+        merged = ProcessMetrics(pid=metrics[0].pid)
+        cpu_seconds = [
+            item.cpu_seconds for item in metrics if item.cpu_seconds is not None
+        ]
+        peak_rss_bytes = [
+            item.peak_rss_bytes for item in metrics if item.peak_rss_bytes is not None
+        ]
+        merged.cpu_seconds = sum(cpu_seconds) if cpu_seconds else None
+        merged.peak_rss_bytes = sum(peak_rss_bytes) if peak_rss_bytes else None
+        return merged
+
+    def to_dict(self) -> dict:
+        """
+        Returns:
+            dict: The metrics of the process.
+        """
+        return {
+            "cpu_seconds": self.cpu_seconds,
+            "peak_rss_bytes": self.peak_rss_bytes,
+        }
+
+
+class RunMetrics:
+    """
+    Performance metrics of a run: throughput per stream, state checkpoints and
+    the resource usage of the tap and target.
+    """
+
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.finished_at: Optional[float] = None
+        self.streams: Dict[str, StreamMetrics] = {}
+        self.state_checkpoints = 0
+        self.last_state_at: Optional[float] = None
+        self.tap: Optional[ProcessMetrics] = None
+        self.target: Optional[ProcessMetrics] = None
+
+    def start(self) -> None:
+        """
+        Start the clock of the run, e.g. once the tap and target have been started,
+        so installing and discovering the tap don't count toward the duration.
+        """
+        self.started_at = time.monotonic()
+
+    @staticmethod
+    def merge(metrics: List["RunMetrics"]) -> "RunMetrics":
+        """
+        Combine the metrics of runs that ran at the same time, e.g. groups of streams.
+
+        Args:
+            metrics (List[RunMetrics]): The metrics of the runs.
+
+        Returns:
+            RunMetrics: The combined metrics.
+        """
+        merged = RunMetrics()
+
+        if not metrics:
+            return merged
+
+        merged.started_at = min(item.started_at for item in metrics)
+        if all(item.finished_at is not None for item in metrics):
+            merged.finished_at = max(item.finished_at for item in metrics)
+
+        for item in metrics:
+            merged.streams.update(item.streams)
+            merged.state_checkpoints += item.state_checkpoints
+
+        last_states_at = [item.last_state_at for item in metrics if item.last_state_at]
+        merged.last_state_at = max(last_states_at) if last_states_at else None
+
+        merged.tap = ProcessMetrics.merge([item.tap for item in metrics])
+        merged.target = ProcessMetrics.merge([item.target for item in metrics])
+        return merged
+
+    def observe(self, message_type: str, stream: Optional[str], size: int) -> None:
+        """
+        Observe a message of the tap.
+
+        Args:
+            message_type (str): The type of the message, e.g. "RECORD".
+            stream (Optional[str]): The stream of the message, if any.
+            size (int): The size of the message in bytes.
+        """
+        if not stream:
+            return
+
+        if stream not in self.streams:
+            self.streams[stream] = StreamMetrics(self.started_at)
+
+        self.streams[stream].observe(message_type, size, time.monotonic())
+
+    def checkpoint(self) -> None:
+        """
+        Count a state checkpoint of the target.
+        """
+        self.state_checkpoints += 1
+        self.last_state_at = time.monotonic()
+
+    def finish(self) -> None:
+        """
+        Mark the end of the run.
+        """
+        self.finished_at = time.monotonic()
+
+    @property
+    def duration(self) -> float:
+        """
+        Returns:
+            float: The seconds the run took, or has been running.
+        """
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    def stream(self, stream: str) -> dict:
+        """
+        Get the metrics of a stream.
+
+        Args:
+            stream (str): The name of the stream.
+
+        Returns:
+            dict: The metrics of the stream, empty metrics if it had no messages.
+        """
+        return self.streams.get(stream, StreamMetrics(self.started_at)).to_dict()
+
+    def to_dict(self) -> dict:
+        """
+        Returns:
+            dict: The metrics of the run.
+        """
+        tap = self.tap.to_dict() if self.tap else {}
+        target = self.target.to_dict() if self.target else {}
+
+        return {
+            "duration_seconds": self.duration,
+            "state_checkpoints": self.state_checkpoints,
+            "tap_cpu_seconds": tap.get("cpu_seconds"),
+            "tap_peak_rss_bytes": tap.get("peak_rss_bytes"),
+            "target_cpu_seconds": target.get("cpu_seconds"),
+            "target_peak_rss_bytes": target.get("peak_rss_bytes"),
+        }
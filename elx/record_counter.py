@@ -1,12 +1,52 @@
 import json
+from typing import Dict, List, Optional, Set
+from elx.metrics import RunMetrics
+
 
 class RecordCounter:
     """
     A line writer that counts RECORD messages per stream from Singer tap output.
+
+    It also tracks which streams are complete. Taps sync streams one after the
+    other, so a stream is finished by the tap once messages of another stream
+    follow it. It is complete once the target has confirmed (by emitting it)
+    a STATE that the tap emitted after that, as targets only emit a state when
+    all records before it are written. Taps that interleave streams, e.g. parent
+    and child streams, return to a finished stream, which is then no longer
+    finished. If the stream was already completed, streams are only completed
+    at the end of the run from then on.
     """
 
-    def __init__(self):
+    def __init__(
+        self,
+        metrics: Optional[RunMetrics] = None,
+        track_completion: bool = False,
+    ):
+        """
+        Args:
+            metrics (Optional[RunMetrics]): Metrics to observe the messages with, if any.
+            track_completion (bool): Whether to track which streams are complete.
+        """
+        self.metrics = metrics
+        self.track_completion = track_completion
         self.counts: dict[str, int] = {}
+        self.streams: List[str] = []
+        self.completed_streams: List[str] = []
+        self._current_stream: Optional[str] = None
+        # Streams that are finished by the tap, waiting for the next tap state.
+        self._finished_streams: List[str] = []
+        # All streams the tap has finished, whether they are complete or not.
+        self._seen_finished_streams: Set[str] = set()
+        # Whether a completed stream turned out to be unfinished, which stops tracking.
+        self._interleaved = False
+        # Groups of finished streams that wait for the target to confirm a later state,
+        # by a sequence number in the order the tap emitted them.
+        self._pending_groups: Dict[int, List[str]] = {}
+        # The tap states that are not confirmed by the target yet, with their group.
+        self._pending_states: Dict[str, int] = {}
+        # The latest state of every group, earlier states of a group are dropped.
+        self._group_states: Dict[int, str] = {}
+        self._next_group = 0
 
     def writelines(self, line: str) -> None:
         """
@@ -17,14 +57,173 @@ class RecordCounter:
         """
         try:
             message = json.loads(line)
-            if message.get("type") == "RECORD":
+            message_type = message.get("type")
+
+            if self.metrics:
+                self.metrics.observe(
+                    message_type, message.get("stream"), len(line.encode("utf-8"))
+                )
+
+            if message_type == "RECORD":
                 stream = message.get("stream")
                 if stream:
                     self.counts[stream] = self.counts.get(stream, 0) + 1
+                    self._switch_stream(stream)
+            elif message_type == "SCHEMA":
+                stream = message.get("stream")
+                if stream:
+                    self._switch_stream(stream)
+            elif (
+                message_type == "STATE"
+                and self._tracks_completion
+                and (self._finished_streams or self._pending_groups)
+            ):
+                self._add_pending_state(
+                    json.dumps(message.get("value"), sort_keys=True)
+                )
         except json.JSONDecodeError:
             pass
 
+    @property
+    def _tracks_completion(self) -> bool:
+        return self.track_completion and not self._interleaved
+
+    def _add_pending_state(self, value: str) -> None:
+        """
+        Track a tap state that completes the finished streams once the target confirms it.
+
+        Args:
+            value (str): The serialized value of the state.
+        """
+        if self._finished_streams:
+            group = self._next_group
+            self._next_group += 1
+            self._pending_groups[group] = self._finished_streams
+            self._finished_streams = []
+        else:
+            # Also keep later states, targets may only emit the latest state. Only the
+            # latest state of the group is kept, so the pending states stay bounded.
+            group = self._next_group - 1
+            previous_value = self._group_states.pop(group, None)
+            if previous_value is not None:
+                del self._pending_states[previous_value]
+
+        # An identical earlier state keeps referring to the earliest group it completes.
+        if value not in self._pending_states:
+            self._pending_states[value] = group
+            self._group_states[group] = value
+
+    def _switch_stream(self, stream: str) -> None:
+        """
+        Track the stream the tap is syncing, the previous stream is finished when it switches.
+
+        Args:
+            stream (str): The stream of the latest message.
+        """
+        if stream == self._current_stream:
+            return
+
+        if stream not in self.streams:
+            self.streams.append(stream)
+
+        if self._tracks_completion and stream in self._seen_finished_streams:
+            self._reopen_stream(stream)
+
+        if (
+            self._tracks_completion
+            and self._current_stream is not None
+            and self._current_stream not in self._seen_finished_streams
+        ):
+            self._finished_streams.append(self._current_stream)
+            self._seen_finished_streams.add(self._current_stream)
+
+        self._current_stream = stream
+
+    def _reopen_stream(self, stream: str) -> None:
+        """
+        Track that the tap returned to a finished stream, so it is not finished anymore.
+
+        Args:
+            stream (str): The stream the tap returned to.
+        """
+        if stream in self.completed_streams:
+            # The stream was completed too early, so don't complete streams before
+            # the end of the run anymore.
+            self._interleaved = True
+            self._finished_streams = []
+            self._pending_groups = {}
+            self._pending_states = {}
+            self._group_states = {}
+            return
+
+        self._seen_finished_streams.discard(stream)
+
+        if stream in self._finished_streams:
+            self._finished_streams.remove(stream)
+
+        for streams in self._pending_groups.values():
+            if stream in streams:
+                streams.remove(stream)
+
+    def confirm_state(self, state: dict) -> List[str]:
+        """
+        Confirm a state that was emitted by the target.
+
+        Args:
+            state (dict): The state emitted by the target.
+
+        Returns:
+            List[str]: The streams that are completed by this state.
+        """
+        confirmed_group = self._pending_states.get(json.dumps(state, sort_keys=True))
+
+        if confirmed_group is None:
+            return []
+
+        # The target confirmed this state and all states before it.
+        completed_streams = []
+        while self._pending_groups:
+            group = next(iter(self._pending_groups))
+            if group > confirmed_group:
+                break
+
+            completed_streams.extend(self._pending_groups.pop(group))
+            value = self._group_states.pop(group, None)
+            if value is not None:
+                del self._pending_states[value]
+
+        self.completed_streams.extend(completed_streams)
+
+        return completed_streams
+
+    def complete(self) -> List[str]:
+        """
+        Complete all remaining streams, e.g. when the run has finished.
+
+        Returns:
+            List[str]: The streams that were not completed yet.
+        """
+        remaining_streams = [
+            stream for stream in self.streams if stream not in self.completed_streams
+        ]
+        self._finished_streams = []
+        self._pending_groups = {}
+        self._pending_states = {}
+        self._group_states = {}
+        self.completed_streams.extend(remaining_streams)
+
+        return remaining_streams
+
     def reset(self) -> None:
         """Reset all counts to zero."""
         self.counts = {}
-
+        self.streams = []
+        self.completed_streams = []
+        self._current_stream = None
+        self._finished_streams = []
+        self._seen_finished_streams = set()
+        self._interleaved = False
+        self._pending_groups = {}
+        self._pending_states = {}
+        self._group_states = {}
+        self._next_group = 0
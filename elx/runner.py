@@ -1,18 +1,22 @@
 import asyncio
+import copy
 import datetime
 import json
 import logging
 import select
+import signal
 import subprocess
 import sys
 import threading
-from typing import List, Optional
+from typing import Callable, List, Optional
+from urllib.parse import quote
 
 from functools import cached_property
 from elx.tap import Tap
 from elx.target import Target
 from elx import StateManager
 from elx.record_counter import RecordCounter
+from elx.metrics import ProcessMetrics, RunMetrics
 from dotenv import load_dotenv
 
 from elx.utils import capture_subprocess_output
@@ -32,6 +36,14 @@ class Runner:
         self.target = target
         self.state_manager = state_manager
         self.record_counts: dict[str, int] = {}
+        self.metrics = RunMetrics()
+        self._stopped = False
+        self._tap_process = None
+        self._target_process = None
+        self._group_runners: List["Runner"] = []
+        self.partition_key: Optional[str] = None
+        self.partition_start: Optional[datetime.datetime] = None
+        self.partition_end: Optional[datetime.datetime] = None
 
     @property
     def name(self) -> str:
@@ -57,14 +69,121 @@ class Runner:
 
     @property
     def state_file_name(self) -> str:
+        # Every partition has its own state, so partitions can run in parallel.
+        if self.partition_key is not None:
+            return f"{self.tap.executable}-{self.target.executable}.{quote(self.partition_key, safe='')}.json"
+
         return f"{self.tap.executable}-{self.target.executable}.json"
 
+    def partition(
+        self,
+        key: str,
+        start: datetime.datetime,
+        end: datetime.datetime,
+    ) -> "Runner":
+        """
+        Create a runner for a time partition. The start and end of the partition
+        can be used in the config of the tap and target, e.g. `{PARTITION_START}`,
+        and the partition has its own state file.
+
+        Args:
+            key (str): The key of the partition, e.g. "2024-01-01".
+            start (datetime.datetime): The start of the partition.
+            end (datetime.datetime): The end of the partition.
+
+        Returns:
+            Runner: The runner for the partition.
+        """
+        runner = self._copy()
+        runner.partition_key = key
+        runner.partition_start = start
+        runner.partition_end = end
+        # Recompute the interpolation values with the partition.
+        runner.__dict__.pop("interpolation_values", None)
+        return runner
+
+    def _copy(self) -> "Runner":
+        """
+        Copy the runner with copies of its tap and target, e.g. to run a partition
+        or a group of streams. The copy shares the state manager and the catalog.
+
+        Returns:
+            Runner: The copy of the runner.
+        """
+        runner = copy.copy(self)
+        runner.tap = copy.copy(self.tap)
+        runner.target = copy.copy(self.target)
+        # The hash keys depend on the interpolated config, which can differ for the
+        # copy, and concurrent copies shouldn't evict each other's catalog files.
+        for singer in (runner.tap, runner.target):
+            singer.__dict__.pop("hash_key", None)
+        runner.tap._catalog_files = {}
+        runner.record_counts = {}
+        runner.metrics = RunMetrics()
+        runner._stopped = False
+        runner._tap_process = None
+        runner._target_process = None
+        runner._group_runners = []
+        return runner
+
+    def stop(self) -> None:
+        """
+        Stop a running tap early, e.g. to bound a benchmark. The target still
+        receives and writes all complete messages the tap emitted, and the run
+        ends without an error.
+        """
+        self._stopped = True
+
+        for runner in self._group_runners:
+            runner.stop()
+
+        if self._tap_process is not None and self._tap_process.returncode is None:
+            self._tap_process.terminate()
+
+    @property
+    def target_write_buffer_size(self) -> int:
+        """
+        The bytes of tap output that are waiting to be read by the target. A buffer
+        that stays full means the target is slower than the tap (backpressure).
+
+        Returns:
+            int: The size of the write buffer, 0 if the target isn't running.
+        """
+        size = sum(runner.target_write_buffer_size for runner in self._group_runners)
+
+        if self._target_process is not None and self._target_process.stdin is not None:
+            size += self._target_process.stdin.transport.get_write_buffer_size()
+
+        return size
+
     def load_state(self) -> dict:
         return self.state_manager.load(self.state_file_name)
 
     def save_state(self, state: dict) -> None:
         self.state_manager.save(self.state_file_name, state)
 
+    def save_stream_state(self, state: dict, streams: List[str]) -> None:
+        """
+        Save the state of a run of some of the streams. Only the bookmarks of
+        these streams are taken from the state, so runs of other streams at the
+        same time don't overwrite each other's bookmarks. The rest of the state,
+        e.g. `currently_syncing`, only applies to one run and is not merged.
+
+        Args:
+            state (dict): The state emitted by the target.
+            streams (List[str]): The streams that were run.
+        """
+        existing_state = self.load_state()
+        bookmarks = {
+            **existing_state.get("bookmarks", {}),
+            **{
+                stream: bookmark
+                for stream, bookmark in state.get("bookmarks", {}).items()
+                if stream in streams
+            },
+        }
+        self.save_state({"bookmarks": bookmarks})
+
     @cached_property
     def interpolation_values(self) -> dict:
         """
@@ -81,32 +200,173 @@ class Runner:
             "TAP_NAME": self.tap.executable.replace("-", "_"),
             "TARGET_EXECUTABLE": self.target.executable,
             "TARGET_NAME": self.target.executable.replace("-", "_"),
+            **self.partition_interpolation_values,
+        }
+
+    @property
+    def partition_interpolation_values(self) -> dict:
+        """
+        Values of the partition that can be used in the config of the tap or target.
+        """
+        if self.partition_key is None:
+            return {}
+
+        return {
+            "PARTITION_KEY": self.partition_key,
+            "PARTITION_START": self.partition_start.isoformat(),
+            "PARTITION_END": self.partition_end.isoformat(),
+            "PARTITION_START_DATE": self.partition_start.strftime("%Y-%m-%d"),
+            "PARTITION_END_DATE": self.partition_end.strftime("%Y-%m-%d"),
         }
 
     def run(
         self,
         streams: Optional[List[str]] = None,
         logger: logging.Logger = None,
+        on_stream_complete: Optional[Callable[[str], None]] = None,
+        parallelism: int = 1,
     ) -> None:
         asyncio.get_event_loop().run_until_complete(
             self.async_run(
                 streams=streams,
                 logger=logger,
+                on_stream_complete=on_stream_complete,
+                parallelism=parallelism,
             )
         )
 
+    async def _async_run_groups(
+        self,
+        streams: Optional[List[str]],
+        logger: Optional[logging.Logger],
+        on_stream_complete: Optional[Callable[[str], None]],
+        parallelism: int,
+    ) -> None:
+        """
+        Split the streams into groups and run every group as a separate tap and
+        target at the same time.
+
+        Args:
+            streams (Optional[List[str]]): The streams to run. Defaults to all selected streams.
+            logger (Optional[logging.Logger]): The logger for the output of the tap and target.
+            on_stream_complete (Optional[Callable[[str], None]]): Called with the name of every completed stream.
+            parallelism (int): The number of groups.
+        """
+        if streams is None:
+            streams = [
+                stream.name for stream in self.tap.catalog.streams if stream.is_selected
+            ]
+
+        groups = [streams[index::parallelism] for index in range(parallelism)]
+        groups = [group for group in groups if group]
+        runners = [self._copy() for _ in groups]
+        self._group_runners = runners
+
+        def collect() -> None:
+            # Combine the record counts and metrics of the groups, e.g. for completed streams.
+            self.record_counts = {
+                stream: count
+                for runner in runners
+                for stream, count in runner.record_counts.items()
+            }
+            self.metrics = RunMetrics.merge([runner.metrics for runner in runners])
+
+        def stream_completed(stream: str) -> None:
+            collect()
+            on_stream_complete(stream)
+
+        tasks = [
+            asyncio.ensure_future(
+                runner.async_run(
+                    streams=group,
+                    logger=logger,
+                    on_stream_complete=stream_completed if on_stream_complete else None,
+                    on_state=lambda state, group=group: self.save_stream_state(
+                        state, group
+                    ),
+                )
+            )
+            for runner, group in zip(runners, groups)
+        ]
+
+        try:
+            done, pending = await asyncio.wait(
+                tasks, return_when=asyncio.FIRST_EXCEPTION
+            )
+
+            if pending:
+                # A group failed, stop the other groups and wait until their targets
+                # have written the states they received, before the run fails.
+                for runner in runners:
+                    runner.stop()
+                await asyncio.wait(pending)
+
+            for task in tasks:
+                if task.exception() is not None:
+                    raise task.exception()
+        except asyncio.CancelledError:
+            for runner in runners:
+                runner.stop()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        finally:
+            collect()
+
     async def async_run(
         self,
         streams: Optional[List[str]] = None,
         logger: Optional[logging.Logger] = None,
+        on_stream_complete: Optional[Callable[[str], None]] = None,
+        parallelism: int = 1,
+        on_state: Optional[Callable[[dict], None]] = None,
     ) -> None:
+        """
+        Run the tap and target.
+
+        Args:
+            streams (Optional[List[str]]): The streams to run. Defaults to all selected streams.
+            logger (Optional[logging.Logger]): The logger for the output of the tap and target.
+            on_stream_complete (Optional[Callable[[str], None]]): Called with the name of
+                every stream as soon as it is completely written by the target, while
+                other streams are still running. Streams that can't be detected as
+                complete earlier are completed when the run succeeds.
+            parallelism (int): The number of groups the streams are split into, every
+                group runs as a separate tap and target at the same time. The bookmarks
+                of every group are merged per stream into the state. Defaults to 1.
+            on_state (Optional[Callable[[dict], None]]): Called with every state emitted
+                by the target. Defaults to saving the state.
+        """
+        if parallelism > 1:
+            return await self._async_run_groups(
+                streams=streams,
+                logger=logger,
+                on_stream_complete=on_stream_complete,
+                parallelism=parallelism,
+            )
+
+        on_state = on_state or self.save_state
         state = self.load_state()
+        self._stopped = False
+
+        # Create a record counter to track row counts, completed streams and
+        # performance metrics, which are updated while the runner runs.
+        self.metrics = RunMetrics()
+        record_counter = RecordCounter(
+            metrics=self.metrics,
+            track_completion=on_stream_complete is not None,
+        )
+        self.record_counts = record_counter.counts
 
         class StateWriter:
             @staticmethod
             def writelines(state_line: str):
                 state = json.loads(state_line)
-                self.save_state(state)
+                on_state(state)
+                self.metrics.checkpoint()
+
+                if on_stream_complete:
+                    for stream in record_counter.confirm_state(state):
+                        on_stream_complete(stream)
 
         class LogWriter:
             def __init__(self, logger: Optional[logging.Logger]):
@@ -116,9 +376,6 @@ class Runner:
                 if self.logger:
                     self.logger.info(line)
 
-        # Create a record counter to track row counts per stream
-        record_counter = RecordCounter()
-
         async with self.tap.process(
             state=state,
             streams=streams,
@@ -126,10 +383,28 @@ class Runner:
             async with self.target.process(
                 tap_process=tap_process,
             ) as target_process:
+                self._tap_process = tap_process
+                self._target_process = target_process
+                self.metrics.start()
+
+                # Sample the resource usage of the tap and target while they run.
+                self.metrics.tap = ProcessMetrics(tap_process.pid)
+                self.metrics.target = ProcessMetrics(target_process.pid)
+                sample_futures = [
+                    asyncio.ensure_future(
+                        self.metrics.tap.sample_until_exit(tap_process)
+                    ),
+                    asyncio.ensure_future(
+                        self.metrics.target.sample_until_exit(target_process)
+                    ),
+                ]
+
                 tap_outputs = [target_process.stdin, record_counter]
                 tap_stdout_future = asyncio.ensure_future(
                     # forward subproc stdout to tap_outputs (i.e. targets stdin)
-                    capture_subprocess_output(tap_process.stdout, *tap_outputs),
+                    capture_subprocess_output(
+                        tap_process.stdout, *tap_outputs, complete_lines_only=True
+                    ),
                 )
                 tap_stderr_future = asyncio.ensure_future(
                     capture_subprocess_output(
@@ -238,6 +513,16 @@ class Runner:
                     # Wait for target to complete
                     target_code = await target_process_future
 
+                for sample_future in sample_futures:
+                    sample_future.cancel()
+                self.metrics.finish()
+                self._tap_process = None
+                self._target_process = None
+
+                # A tap that was stopped on purpose didn't fail, unless it failed by itself.
+                if self._stopped and tap_code == -signal.SIGTERM:
+                    tap_code = 0
+
                 if tap_code and target_code:
                     raise Exception("Tap and target failed")
                 elif tap_code:
@@ -248,6 +533,10 @@ class Runner:
                 # Store the record counts for access after the run
                 self.record_counts = record_counter.counts
 
+                if on_stream_complete:
+                    for stream in record_counter.complete():
+                        on_stream_complete(stream)
+
 
 if __name__ == "__main__":
     tap = Tap(
@@ -1,16 +1,26 @@
+import asyncio
+import contextlib
+import copy
 import json
 import logging
 import subprocess
 import hashlib
+import threading
+from collections import deque
 from distutils.spawn import find_executable
 from functools import cached_property
-from typing import Optional
+from typing import Any, AsyncGenerator, Deque, Generator, Optional, Tuple
 from pipx.commands.common import package_name_from_spec
 from elx.exceptions import DecodeException, PipxInstallException
-from elx.utils import require_install, interpolate_in_config
+from elx.json_stream import JsonArrayParser
+from elx.utils import ConfigTemplate, require_install
 
 PYTHON = "python3"
 BUFFER_SIZE_LIMIT = 10485760
+# The size of the chunks that are read from the output of an executable.
+CHUNK_SIZE = 65536
+# The number of stderr lines that are kept for error messages.
+STDERR_TAIL_LINES = 200
 
 
 class Singer:
@@ -23,26 +33,45 @@ class Singer:
         self.spec = spec
         self._executable = executable
         self._config = config
+        # The template of the last config returned by a callable config.
+        self._callable_config_template: Optional[ConfigTemplate] = None
 
     @property
     def config(self) -> dict:
         """
-        Get the config for this plugin.
+        Get the config for this plugin. The config is shared between reads, copy
+        it before modifying it.
         """
-        config = self._config
-
         # If the config is a callable, call it and return the result.
         if callable(self._config):
             config = self._config()
 
-        # If there is a runner attribute, interpolate the config.
+            # If there is a runner attribute, interpolate the config with a template
+            # that is only compiled again when the callable returns another config.
+            if hasattr(self, "runner"):
+                template = self._callable_config_template
+                if template is None or template.config != config:
+                    # Compile a copy, so a config the callable modifies later is detected.
+                    template = ConfigTemplate(copy.deepcopy(config))
+                    self._callable_config_template = template
+
+                return template.render(self.runner.interpolation_values)
+
+            return config
+
+        # If there is a runner attribute, interpolate the config using the compiled template.
         if hasattr(self, "runner"):
-            config = interpolate_in_config(
-                config=config,
-                interpolation=self.runner.interpolation_values,
-            )
+            return self._config_template.render(self.runner.interpolation_values)
 
-        return config
+        return self._config
+
+    @cached_property
+    def _config_template(self) -> ConfigTemplate:
+        """
+        The static config compiled for interpolation, so repeated reads of the
+        config only render the placeholders, and only when their values change.
+        """
+        return ConfigTemplate(self._config)
 
     @property
     def name(self) -> str:
@@ -111,6 +140,59 @@ class Singer:
         except subprocess.CalledProcessError as e:
             raise PipxInstallException(e.stderr.decode())
 
+    @contextlib.contextmanager
+    def _popen(
+        self, args: list
+    ) -> Generator[Tuple[subprocess.Popen, Deque[bytes]], None, None]:
+        """
+        Start the executable with the given arguments. Stderr is drained
+        concurrently and only its tail is kept, so the executable can never
+        block on a full stderr pipe.
+
+        Args:
+            args (list): The arguments to pass to the executable.
+
+        Yields:
+            Tuple[subprocess.Popen, Deque[bytes]]: The process and the tail of its stderr.
+
+        Raises:
+            DecodeException: If the executable exits with a non-zero exit code.
+        """
+        process = subprocess.Popen(
+            [
+                self.executable,
+                *args,
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+
+        stderr = deque(maxlen=STDERR_TAIL_LINES)
+        stderr_thread = threading.Thread(
+            target=stderr.extend,
+            args=(process.stderr,),
+            daemon=True,
+        )
+        stderr_thread.start()
+
+        try:
+            yield process, stderr
+        except BaseException:
+            # Make sure the process does not outlive the caller.
+            process.kill()
+            raise
+        finally:
+            process.stdout.close()
+            process.wait()
+            stderr_thread.join()
+            process.stderr.close()
+
+        # If the process exited with a non-zero exit code, raise an exception.
+        if process.returncode != 0:
+            raise DecodeException(
+                f"Error running {self.executable}: {b''.join(stderr).decode()}"
+            )
+
     @require_install
     def run(self, args: list) -> dict:
         """
@@ -125,26 +207,122 @@ class Singer:
         Raises:
             DecodeException: If the JSON output of the executable is not valid.
         """
-        result = subprocess.Popen(
-            [
+        with self._popen(args) as (process, stderr):
+            stdout = process.stdout.read()
+
+        # Try to parse the JSON output.
+        try:
+            return json.loads(stdout)
+        except json.decoder.JSONDecodeError as e:
+            raise DecodeException(
+                f"Error parsing json: {e.msg} at position {e.pos} in {e.doc} \n\n {b''.join(stderr).decode()}"
+            )
+
+    @require_install
+    def run_streaming(self, args: list, key: str) -> Generator[Any, None, None]:
+        """
+        Run the executable with the given arguments and parse the items of the
+        array under `key` in its JSON output while it is being received.
+
+        Args:
+            args (list): The arguments to pass to the executable.
+            key (str): The top-level key of the array to parse, e.g. "streams".
+
+        Yields:
+            Any: The items of the array.
+
+        Raises:
+            DecodeException: If the JSON output of the executable is not valid.
+        """
+        parser = JsonArrayParser(key)
+
+        with self._popen(args) as (process, stderr):
+            try:
+                for chunk in iter(lambda: process.stdout.read1(CHUNK_SIZE), b""):
+                    yield from parser.feed(chunk)
+
+                yield from parser.close()
+            except json.decoder.JSONDecodeError as e:
+                # Wait for the process, a non-zero exit code is the better error.
+                process.stdout.close()
+                process.wait()
+                if process.returncode != 0:
+                    return
+
+                raise DecodeException(
+                    f"Error parsing json: {e.msg} at position {e.pos} \n\n {b''.join(stderr).decode()}"
+                )
+
+    async def async_run_streaming(
+        self, args: list, key: str
+    ) -> AsyncGenerator[Any, None]:
+        """
+        Run the executable as an async subprocess and parse the items of the
+        array under `key` in its JSON output while it is being received. The
+        executable has to be installed already.
+
+        Args:
+            args (list): The arguments to pass to the executable.
+            key (str): The top-level key of the array to parse, e.g. "streams".
+
+        Yields:
+            Any: The items of the array.
+
+        Raises:
+            DecodeException: If the JSON output of the executable is not valid.
+        """
+        parser = JsonArrayParser(key)
+        stderr = deque(maxlen=STDERR_TAIL_LINES)
+
+        process = await asyncio.create_subprocess_exec(
+            *[
                 self.executable,
                 *args,
             ],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            limit=BUFFER_SIZE_LIMIT,
         )
 
-        stdout, stderr = result.communicate()
+        async def drain_stderr() -> None:
+            while line := await process.stderr.readline():
+                stderr.append(line)
 
-        # If any of the processes exited with a non-zero exit code,
-        # raise an exception.
-        if result.returncode != 0:
-            raise DecodeException(f"Error running {self.executable}: {stderr.decode()}")
+        stderr_future = asyncio.ensure_future(drain_stderr())
 
-        # Else try to parse the JSON output.
         try:
-            return json.loads(stdout)
-        except json.decoder.JSONDecodeError as e:
+            try:
+                while chunk := await process.stdout.read(CHUNK_SIZE):
+                    for item in parser.feed(chunk):
+                        yield item
+
+                for item in parser.close():
+                    yield item
+            except json.decoder.JSONDecodeError as e:
+                # Wait for the process, a non-zero exit code is the better error.
+                await process.wait()
+                await stderr_future
+                if process.returncode != 0:
+                    raise DecodeException(
+                        f"Error running {self.executable}: {b''.join(stderr).decode()}"
+                    )
+
+                raise DecodeException(
+                    f"Error parsing json: {e.msg} at position {e.pos} \n\n {b''.join(stderr).decode()}"
+                )
+
+            await process.wait()
+            await stderr_future
+        except BaseException:
+            # Make sure the process does not outlive the caller, e.g. on a timeout.
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            stderr_future.cancel()
+            raise
+
+        # If the process exited with a non-zero exit code, raise an exception.
+        if process.returncode != 0:
             raise DecodeException(
-                f"Error parsing json: {e.msg} at position {e.pos} in {e.doc} \n\n {stderr.decode()}"
+                f"Error running {self.executable}: {b''.join(stderr).decode()}"
             )
@@ -1,17 +1,262 @@
 from abc import ABC, abstractproperty
+import contextlib
+import copy
 from functools import cache
+import gzip
+import hashlib
 from pathlib import Path
 import json
 from sre_parse import State
-from typing import Any, Dict
+import sqlite3
+import stat
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, quote, unquote, urlsplit
 from smart_open import open
 import os
 from functools import cached_property
 
+# Durability settings for local state files.
+DURABILITY_NONE = "none"  # Atomic rename only, survives process crashes.
+DURABILITY_FILE = "file"  # Also fsync the file, survives most system crashes.
+DURABILITY_DIRECTORY = (
+    "directory"  # Also fsync the directory, so the rename is durable too.
+)
+DURABILITY_LEVELS = (DURABILITY_NONE, DURABILITY_FILE, DURABILITY_DIRECTORY)
+
+# The default size of the connection pool of the state store clients.
+DEFAULT_POOL_SIZE = 10
+
+# The default number of state files that are read or written concurrently.
+DEFAULT_MAX_WORKERS = 8
+
+# The umask of the process, read once at import because it can only be read by
+# setting it. New local state files get the mode that `open` would give them.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+NEW_FILE_MODE = 0o666 & ~_UMASK
+
+# Compression of state files, detected by the magic header when reading.
+COMPRESSION_GZIP = "gzip"
+COMPRESSION_ZSTD = "zstd"
+COMPRESSIONS = (None, COMPRESSION_GZIP, COMPRESSION_ZSTD)
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# The default number of deltas that are appended to the delta log before it is compacted.
+DEFAULT_COMPACT_EVERY = 100
+# Prefix of the line in the delta log that marks the deltas before it as compacted
+# into the snapshot with the given hash. JSON deltas never start with it.
+COMPACTION_MARKER = b"#compacted "
+
+# State store clients shared by all state managers in the process.
+_shared_clients: Dict[Tuple, Any] = {}
+_shared_clients_lock = threading.Lock()
+
+
+def credentials_hash(*credentials: str) -> str:
+    """
+    Hash credentials, so they can be part of a client key without storing them.
+
+    Args:
+        credentials (str): The credentials to hash.
+
+    Returns:
+        str: The sha256 hash of the credentials.
+    """
+    return hashlib.sha256("\0".join(credentials).encode("utf-8")).hexdigest()
+
+
+def shared_client(key: Tuple, factory: Callable[[], Any]) -> Any:
+    """
+    Get a client that is shared by all state managers with the same key, so
+    they reuse the same (warm) connection pool.
+
+    Args:
+        key (Tuple): The key of the client, e.g. (backend, credentials hash, bucket, pool size).
+        factory (Callable[[], Any]): Creates the client if it doesn't exist yet.
+
+    Returns:
+        Any: The shared client.
+    """
+    if key not in _shared_clients:
+        with _shared_clients_lock:
+            if key not in _shared_clients:
+                _shared_clients[key] = factory()
+
+    return _shared_clients[key]
+
+
+def import_zstandard() -> Any:
+    """
+    Import the optional `zstandard` package for zstd compressed state files.
+
+    Returns:
+        Any: The `zstandard` module.
+
+    Raises:
+        ImportError: If `zstandard` is not installed.
+    """
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError(
+            "zstd compressed state files require the `zstandard` package, "
+            "install it with `pip install elx[zstd]`."
+        ) from e
+
+    return zstandard
+
+
+def compress(content: bytes, compression: Optional[str]) -> bytes:
+    """
+    Compress the contents of a state file.
+
+    Args:
+        content (bytes): The contents to compress.
+        compression (Optional[str]): The compression to use, one of None, "gzip" or "zstd".
+
+    Returns:
+        bytes: The compressed contents.
+    """
+    if compression == COMPRESSION_GZIP:
+        # A fixed mtime keeps the output deterministic.
+        return gzip.compress(content, mtime=0)
+
+    if compression == COMPRESSION_ZSTD:
+        return import_zstandard().ZstdCompressor().compress(content)
+
+    return content
+
+
+def decompress(content: bytes) -> bytes:
+    """
+    Decompress the contents of a state file, the compression is detected by
+    its magic header so compressed and uncompressed state files can be mixed.
+
+    Args:
+        content (bytes): The contents to decompress.
+
+    Returns:
+        bytes: The decompressed contents.
+    """
+    if content.startswith(GZIP_MAGIC):
+        return gzip.decompress(content)
+
+    if content.startswith(ZSTD_MAGIC):
+        return import_zstandard().ZstdDecompressor().decompress(content)
+
+    return content
+
+
+def contains_null(value: Any) -> bool:
+    """
+    Returns:
+        bool: True if the value is or contains a null, which a merge patch can't express.
+    """
+    if value is None:
+        return True
+
+    if isinstance(value, dict):
+        return any(contains_null(item) for item in value.values())
+
+    if isinstance(value, list):
+        return any(contains_null(item) for item in value)
+
+    return False
+
+
+def create_merge_patch(source: dict, target: dict) -> dict:
+    """
+    Create a JSON merge patch (RFC 7386) that turns the source into the target.
+
+    Args:
+        source (dict): The original document.
+        target (dict): The changed document.
+
+    Returns:
+        dict: The merge patch.
+
+    Raises:
+        ValueError: If the target contains nulls, which a merge patch can't express.
+    """
+    patch = {}
+
+    for key in source.keys() - target.keys():
+        patch[key] = None
+
+    for key, value in target.items():
+        existing_value = source.get(key)
+
+        if key in source and existing_value == value:
+            continue
+
+        if isinstance(value, dict) and isinstance(existing_value, dict):
+            patch[key] = create_merge_patch(existing_value, value)
+        elif contains_null(value):
+            raise ValueError(
+                f"Can't express the null value of `{key}` in a merge patch."
+            )
+        else:
+            patch[key] = value
+
+    return patch
+
+
+def apply_merge_patch(target: Any, patch: Any) -> Any:
+    """
+    Apply a JSON merge patch (RFC 7386) to a document.
+
+    Args:
+        target (Any): The document to patch.
+        patch (Any): The merge patch.
+
+    Returns:
+        Any: The patched document.
+    """
+    if not isinstance(patch, dict):
+        return patch
+
+    result = dict(target) if isinstance(target, dict) else {}
+
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = apply_merge_patch(result.get(key), value)
+
+    return result
+
 
 class StateClient(ABC):
-    def __init__(self, base_path: str):
+    def __init__(self, base_path: str, pool_size: int = DEFAULT_POOL_SIZE):
+        """
+        Args:
+            base_path (str): The base path to store state files in.
+            pool_size (int): The size of the connection pool of the client.
+        """
         self.base_path = base_path
+        self.pool_size = pool_size
+
+    @property
+    def root(self) -> str:
+        """
+        Returns:
+            str: The root of the base path, e.g. the bucket of `s3://bucket/path`.
+        """
+        return self.base_path.split("://", 1)[-1].split("/", 1)[0]
+
+    @property
+    def prefix(self) -> str:
+        """
+        Returns:
+            str: The base path without its root, e.g. `path/` for `s3://bucket/path`.
+        """
+        path = self.base_path.split("://", 1)[-1].partition("/")[2].strip("/")
+        return f"{path}/" if path else ""
 
     @property
     def client(self) -> Any:
@@ -43,6 +288,130 @@ class StateClient(ABC):
         """
         raise NotImplementedError
 
+    def read(self, state_file_name: str) -> Optional[bytes]:
+        """
+        Read the contents of a state file.
+
+        Args:
+            state_file_name (str): The name of the state file to read.
+
+        Returns:
+            Optional[bytes]: The contents of the state file, None if it doesn't exist.
+        """
+        if not self.has_existing_state(state_file_name):
+            return None
+
+        return self._read_existing(state_file_name)
+
+    def _read_existing(self, state_file_name: str) -> bytes:
+        """
+        Read the contents of a state file that is known to exist.
+
+        Args:
+            state_file_name (str): The name of the state file to read.
+
+        Returns:
+            bytes: The contents of the state file.
+        """
+        with open(
+            f"{self.base_path}/{state_file_name}",
+            "rb",
+            transport_params=self.params,
+        ) as state_file:
+            return state_file.read()
+
+    @property
+    def supports_append(self) -> bool:
+        """
+        Whether state files can be appended to in place. Object stores can only
+        rewrite whole objects, which would make every append read and write the
+        whole file.
+
+        Returns:
+            bool: True if `append` is supported.
+        """
+        return False
+
+    def append(self, state_file_name: str, content: bytes) -> None:
+        """
+        Append to a state file.
+
+        Args:
+            state_file_name (str): The name of the state file to append to.
+            content (bytes): The content to append.
+        """
+        raise NotImplementedError(
+            f"{self.__class__.__name__} doesn't support appending to state files."
+        )
+
+    def list_state_files(self, prefix: str = "") -> Optional[set]:
+        """
+        List the names of all state files under the base path.
+
+        Args:
+            prefix (str): Only list the state files whose names start with this prefix.
+
+        Returns:
+            Optional[set]: The names of the state files, None if the state store can't be listed.
+        """
+        return None
+
+    def delete(self, state_file_name: str) -> None:
+        """
+        Delete a state file, if it exists.
+
+        Args:
+            state_file_name (str): The name of the state file to delete.
+        """
+        raise NotImplementedError(
+            f"{self.__class__.__name__} doesn't support deleting state files."
+        )
+
+    def read_many(
+        self,
+        state_file_names: List[str],
+        max_workers: int = DEFAULT_MAX_WORKERS,
+    ) -> Dict[str, Optional[bytes]]:
+        """
+        Read the contents of many state files concurrently. If the state store can
+        be listed, it is listed once instead of checking every state file.
+
+        Args:
+            state_file_names (List[str]): The names of the state files to read.
+            max_workers (int): The number of state files that are read concurrently.
+
+        Returns:
+            Dict[str, Optional[bytes]]: The contents by state file name, None if it doesn't exist.
+        """
+        existing_state_files = self.list_state_files()
+
+        def read(state_file_name: str) -> Optional[bytes]:
+            if existing_state_files is None:
+                return self.read(state_file_name)
+
+            if state_file_name not in existing_state_files:
+                return None
+
+            return self._read_existing(state_file_name)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return dict(zip(state_file_names, executor.map(read, state_file_names)))
+
+    def write(self, state_file_name: str, content: bytes) -> None:
+        """
+        Write the contents of a state file.
+
+        Args:
+            state_file_name (str): The name of the state file to write.
+            content (bytes): The contents of the state file.
+        """
+        with open(
+            f"{self.base_path}/{state_file_name}",
+            "wb",
+            transport_params=self.params,
+        ) as state_file:
+            state_file.write(content)
+
 
 class S3StateClient(StateClient):
     """
@@ -52,12 +421,85 @@ class S3StateClient(StateClient):
     @cached_property
     def client(self):
         import boto3
+        from botocore.config import Config
+
+        access_key_id = os.environ["AWS_ACCESS_KEY_ID"]
+        secret_access_key = os.environ["AWS_SECRET_ACCESS_KEY"]
+
+        def create_client():
+            session = boto3.Session(
+                aws_access_key_id=access_key_id,
+                aws_secret_access_key=secret_access_key,
+            )
+            return session.client(
+                "s3",
+                config=Config(max_pool_connections=self.pool_size),
+            )
+
+        return shared_client(
+            key=(
+                "s3",
+                credentials_hash(access_key_id, secret_access_key),
+                self.root,
+                self.pool_size,
+            ),
+            factory=create_client,
+        )
+
+    def has_existing_state(self, state_file_name: str) -> bool:
+        """
+        Checks for a pre-existing state file.
+
+        Args:
+        state_file_name (str): The name of the state file to load.
 
-        session = boto3.Session(
-            aws_access_key_id=os.environ["AWS_ACCESS_KEY_ID"],
-            aws_secret_access_key=os.environ["AWS_SECRET_ACCESS_KEY"],
+        Returns:
+            bool: Boolean flag to indicate whether there is a pre-existing state file.
+        """
+        from botocore.exceptions import ClientError
+
+        try:
+            self.client.head_object(
+                Bucket=self.root,
+                Key=f"{self.prefix}{state_file_name}",
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+        return True
+
+    def list_state_files(self, prefix: str = "") -> Optional[set]:
+        """
+        List the names of all state files under the base path.
+
+        Args:
+            prefix (str): Only list the state files whose names start with this prefix.
+
+        Returns:
+            Optional[set]: The names of the state files.
+        """
+        paginator = self.client.get_paginator("list_objects_v2")
+
+        return {
+            item["Key"].removeprefix(self.prefix)
+            for page in paginator.paginate(
+                Bucket=self.root, Prefix=f"{self.prefix}{prefix}"
+            )
+            for item in page.get("Contents", [])
+        }
+
+    def delete(self, state_file_name: str) -> None:
+        """
+        Delete a state file, if it exists.
+
+        Args:
+            state_file_name (str): The name of the state file to delete.
+        """
+        self.client.delete_object(
+            Bucket=self.root, Key=f"{self.prefix}{state_file_name}"
         )
-        return session.client("s3")
 
 
 class AzureStateClient(StateClient):
@@ -67,10 +509,34 @@ class AzureStateClient(StateClient):
 
     @cached_property
     def client(self):
+        import requests
+        from azure.core.pipeline.transport import RequestsTransport
         from azure.storage.blob import BlobServiceClient
 
-        return BlobServiceClient.from_connection_string(
-            os.environ["AZURE_STORAGE_CONNECTION_STRING"]
+        connection_string = os.environ["AZURE_STORAGE_CONNECTION_STRING"]
+
+        def create_client():
+            session = requests.Session()
+            session.mount(
+                "https://",
+                requests.adapters.HTTPAdapter(
+                    pool_connections=self.pool_size,
+                    pool_maxsize=self.pool_size,
+                ),
+            )
+            return BlobServiceClient.from_connection_string(
+                connection_string,
+                transport=RequestsTransport(session=session, session_owner=False),
+            )
+
+        return shared_client(
+            key=(
+                "azure",
+                credentials_hash(connection_string),
+                self.root,
+                self.pool_size,
+            ),
+            factory=create_client,
         )
 
     @property
@@ -99,6 +565,34 @@ class AzureStateClient(StateClient):
         # Check if state file exists
         return container.get_blob_client(blob=state_file_name).exists()
 
+    def list_state_files(self, prefix: str = "") -> Optional[set]:
+        """
+        List the names of all state files in the container.
+
+        Args:
+            prefix (str): Only list the state files whose names start with this prefix.
+
+        Returns:
+            Optional[set]: The names of the state files.
+        """
+        container = self.client.get_container_client(container=self.container_name)
+
+        return set(container.list_blob_names(name_starts_with=prefix or None))
+
+    def delete(self, state_file_name: str) -> None:
+        """
+        Delete a state file, if it exists.
+
+        Args:
+            state_file_name (str): The name of the state file to delete.
+        """
+        from azure.core.exceptions import ResourceNotFoundError
+
+        container = self.client.get_container_client(container=self.container_name)
+
+        with contextlib.suppress(ResourceNotFoundError):
+            container.get_blob_client(blob=state_file_name).delete_blob()
+
 
 class GCSStateClient(StateClient):
     """
@@ -107,28 +601,44 @@ class GCSStateClient(StateClient):
 
     @cached_property
     def client(self):
+        import requests
         from google.cloud.storage import Client
         from google.auth.credentials import Credentials
 
         if "GOOGLE_APPLICATION_CREDENTIALS" in os.environ:
             service_account_path = os.environ["GOOGLE_APPLICATION_CREDENTIALS"]
-            return Client.from_service_account_json(service_account_path)
+            credentials_key = credentials_hash("service_account", service_account_path)
+
+            def create_client():
+                return Client.from_service_account_json(service_account_path)
+
         elif "GOOGLE_API_TOKEN" in os.environ:
             token = os.environ["GOOGLE_API_TOKEN"]
-            credentials = Credentials(token=token)
-            return Client(credentials=credentials)
+            credentials_key = credentials_hash("token", token)
+
+            def create_client():
+                credentials = Credentials(token=token)
+                return Client(credentials=credentials)
+
         else:
             raise Exception("No credentials found for Google Cloud Storage")
 
+        def create_pooled_client():
+            client = create_client()
+            # The storage client exposes its requests session as `_http`.
+            client._http.mount(
+                "https://",
+                requests.adapters.HTTPAdapter(
+                    pool_connections=self.pool_size,
+                    pool_maxsize=self.pool_size,
+                ),
+            )
+            return client
 
-class LocalStateClient(StateClient):
-    """
-    A state client for local (and all other) state stores.
-    """
-
-    @property
-    def params(self) -> dict:
-        return {}
+        return shared_client(
+            key=("gcs", credentials_key, self.root, self.pool_size),
+            factory=create_pooled_client,
+        )
 
     def has_existing_state(self, state_file_name: str) -> bool:
         """
@@ -140,64 +650,1441 @@ class LocalStateClient(StateClient):
         Returns:
             bool: Boolean flag to indicate whether there is a pre-existing state file.
         """
-        return Path(f"{self.base_path}/{state_file_name}").exists()
+        return (
+            self.client.bucket(self.root)
+            .blob(f"{self.prefix}{state_file_name}")
+            .exists()
+        )
 
+    def list_state_files(self, prefix: str = "") -> Optional[set]:
+        """
+        List the names of all state files under the base path.
 
-def state_client_factory(base_path: str) -> StateClient:
-    if base_path.startswith("s3://"):
-        return S3StateClient(base_path)
-    elif base_path.startswith("azure://"):
-        return AzureStateClient(base_path)
-    elif base_path.startswith("gs://"):
-        return GCSStateClient(base_path)
-    else:
-        return LocalStateClient(base_path)
+        Args:
+            prefix (str): Only list the state files whose names start with this prefix.
 
+        Returns:
+            Optional[set]: The names of the state files.
+        """
+        return {
+            blob.name.removeprefix(self.prefix)
+            for blob in self.client.list_blobs(
+                self.root, prefix=f"{self.prefix}{prefix}"
+            )
+        }
 
-class StateManager:
-    def __init__(self, base_path: str = ".") -> None:
+    def delete(self, state_file_name: str) -> None:
         """
+        Delete a state file, if it exists.
+
         Args:
-            base_path (str): The base path to store state files in. Defaults to "./state".
+            state_file_name (str): The name of the state file to delete.
         """
-        self.base_path = base_path
-        self.state_client = state_client_factory(base_path)
+        from google.api_core.exceptions import NotFound
+
+        with contextlib.suppress(NotFound):
+            self.client.bucket(self.root).blob(
+                f"{self.prefix}{state_file_name}"
+            ).delete()
 
-    def load(self, state_file_name: str) -> dict:
-        """
-        Load a state file.
 
+class LocalStateClient(StateClient):
+    """
+    A state client for local (and all other) state stores.
+    """
+
+    def __init__(
+        self,
+        base_path: str,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        durability: str = DURABILITY_NONE,
+    ):
+        """
         Args:
-            state_file_name (str): The name of the state file to load.
+            base_path (str): The base path to store state files in.
+            pool_size (int): The size of the connection pool of the client.
+            durability (str): How durable local writes are, one of "none" (atomic
+                rename only), "file" (fsync the file) or "directory" (fsync the file
+                and the directory). Defaults to "none".
+        """
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(
+                f"Invalid durability `{durability}`, expected one of {DURABILITY_LEVELS}."
+            )
 
-        Returns:
-            dict: The contents of the state file.
+        super().__init__(base_path, pool_size=pool_size)
+        self.durability = durability
+
+    @property
+    def params(self) -> dict:
+        return {}
+
+    @property
+    def is_local(self) -> bool:
         """
-        if not self.state_client.has_existing_state(state_file_name):
-            return {}
+        Whether the base path is on the local file system, other paths (e.g. ssh)
+        are written through smart_open.
 
-        with open(
-            f"{self.base_path}/{state_file_name}",
-            "r",
-            transport_params=self.state_client.params,
-        ) as state_file:
-            return json.loads(state_file.read())
+        Returns:
+            bool: True if the base path is a local path.
+        """
+        return "://" not in self.base_path or self.base_path.startswith("file://")
 
-    def save(self, state_file_name: str, state: dict = {}) -> None:
+    def path(self, state_file_name: str) -> Path:
         """
-        Save a state file.
+        Get the local path of a state file.
+
+        Args:
+            state_file_name (str): The name of the state file.
+
+        Returns:
+            Path: The path of the state file.
+        """
+        base_path = self.base_path.removeprefix("file://")
+        return Path(os.path.expanduser(base_path)) / state_file_name
+
+    def read(self, state_file_name: str) -> Optional[bytes]:
+        """
+        Read the contents of a state file.
+
+        Args:
+            state_file_name (str): The name of the state file to read.
+
+        Returns:
+            Optional[bytes]: The contents of the state file, None if it doesn't exist.
+        """
+        if not self.is_local:
+            return super().read(state_file_name)
+
+        try:
+            return self.path(state_file_name).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def write(self, state_file_name: str, content: bytes) -> None:
+        """
+        Write the contents of a state file. Local state files are written to a
+        temporary file that is atomically renamed into place, so a crash never
+        leaves a truncated state file behind.
+
+        Args:
+            state_file_name (str): The name of the state file to write.
+            content (bytes): The contents of the state file.
+        """
+        if not self.is_local:
+            return super().write(state_file_name, content)
+
+        path = self.path(state_file_name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Temporary files are only readable by the owner, keep the mode of the
+        # existing state file instead, so other readers of the state keep access.
+        try:
+            mode = stat.S_IMODE(os.stat(path).st_mode)
+        except FileNotFoundError:
+            mode = NEW_FILE_MODE
+
+        file_descriptor, temp_path = tempfile.mkstemp(
+            dir=path.parent,
+            prefix=f".{path.name}.",
+            suffix=".tmp",
+        )
+
+        try:
+            with os.fdopen(file_descriptor, "wb") as state_file:
+                os.fchmod(state_file.fileno(), mode)
+                state_file.write(content)
+
+                if self.durability != DURABILITY_NONE:
+                    state_file.flush()
+                    os.fsync(state_file.fileno())
+
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+        # Make sure the rename itself is persisted.
+        if self.durability == DURABILITY_DIRECTORY:
+            directory_descriptor = os.open(path.parent, os.O_RDONLY)
+            try:
+                os.fsync(directory_descriptor)
+            finally:
+                os.close(directory_descriptor)
+
+    @property
+    def supports_append(self) -> bool:
+        return self.is_local
+
+    def append(self, state_file_name: str, content: bytes) -> None:
+        """
+        Append to a state file. Local state files are appended to in place.
+
+        Args:
+            state_file_name (str): The name of the state file to append to.
+            content (bytes): The content to append.
+        """
+        if not self.is_local:
+            return super().append(state_file_name, content)
+
+        path = self.path(state_file_name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        with path.open("ab") as state_file:
+            state_file.write(content)
+
+            if self.durability != DURABILITY_NONE:
+                state_file.flush()
+                os.fsync(state_file.fileno())
+
+    def read_many(
+        self,
+        state_file_names: List[str],
+        max_workers: int = DEFAULT_MAX_WORKERS,
+    ) -> Dict[str, Optional[bytes]]:
+        """
+        Read the contents of many state files concurrently. Local state files are
+        read without listing the directory, a missing file is detected as cheaply.
+
+        Args:
+            state_file_names (List[str]): The names of the state files to read.
+            max_workers (int): The number of state files that are read concurrently.
+
+        Returns:
+            Dict[str, Optional[bytes]]: The contents by state file name, None if it doesn't exist.
+        """
+        if not self.is_local:
+            return super().read_many(state_file_names, max_workers=max_workers)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return dict(
+                zip(state_file_names, executor.map(self.read, state_file_names))
+            )
+
+    def list_state_files(self, prefix: str = "") -> Optional[set]:
+        """
+        List the names of all local state files under the base path.
+
+        Args:
+            prefix (str): Only list the state files whose names start with this prefix.
+
+        Returns:
+            Optional[set]: The names of the state files, None if the base path isn't local.
+        """
+        if not self.is_local:
+            return None
+
+        root = self.path("")
+        # Only walk the directory of the prefix, e.g. the shards of a state file.
+        directory = root / prefix.rpartition("/")[0]
+
+        if not directory.is_dir():
+            return set()
+
+        names = set()
+        for path in directory.rglob("*"):
+            name = path.relative_to(root).as_posix()
+
+            # Skip temporary files of writes that are in progress.
+            if (
+                name.startswith(prefix)
+                and path.is_file()
+                and not path.name.startswith(".")
+            ):
+                names.add(name)
+
+        return names
+
+    def delete(self, state_file_name: str) -> None:
+        """
+        Delete a state file, if it exists.
+
+        Args:
+            state_file_name (str): The name of the state file to delete.
+        """
+        if not self.is_local:
+            return super().delete(state_file_name)
+
+        self.path(state_file_name).unlink(missing_ok=True)
+
+    def has_existing_state(self, state_file_name: str) -> bool:
+        """
+        Checks for a pre-existing state file.
+
+        Args:
+        state_file_name (str): The name of the state file to load.
+
+        Returns:
+            bool: Boolean flag to indicate whether there is a pre-existing state file.
+        """
+        if self.is_local:
+            return self.path(state_file_name).exists()
+
+        return Path(f"{self.base_path}/{state_file_name}").exists()
+
+
+class SQLiteStateClient(StateClient):
+    """
+    A state client that stores all state files in a single SQLite database in
+    WAL mode, one row per state file. Use `sqlite:///relative/path.db` or
+    `sqlite:////absolute/path.db`, and add `?history=true` to keep every
+    version of the state files in a history table. All clients of a database
+    share one connection, so there is no connection pool.
+    """
+
+    def __init__(
+        self,
+        base_path: str,
+        durability: str = DURABILITY_NONE,
+    ):
+        """
+        Args:
+            base_path (str): The SQLite url, e.g. `sqlite:///state.db?history=true`.
+            durability (str): "none" commits with `synchronous=NORMAL`, "file" and
+                "directory" commit with `synchronous=FULL`. Defaults to "none".
+        """
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(
+                f"Invalid durability `{durability}`, expected one of {DURABILITY_LEVELS}."
+            )
+
+        super().__init__(base_path)
+        self.durability = durability
+
+        url = urlsplit(base_path)
+        if url.scheme != "sqlite" or url.netloc or not url.path.startswith("/"):
+            raise ValueError(
+                f"Invalid SQLite url `{base_path}`, expected e.g. `sqlite:///state.db`."
+            )
+
+        # The path after the third slash is relative, a fourth slash makes it absolute.
+        path = unquote(url.path[1:])
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.history = (
+            parse_qs(url.query).get("history", ["false"])[0].lower() == "true"
+        )
+
+    @property
+    def params(self) -> dict:
+        return {}
+
+    @cached_property
+    def _shared_connection(self) -> Tuple[sqlite3.Connection, threading.Lock]:
+        """
+        Returns:
+            Tuple[sqlite3.Connection, threading.Lock]: The connection shared by all clients
+                of the database, and the lock that serializes its use.
+        """
+
+        def create_client():
+            connection = sqlite3.connect(
+                self.path,
+                check_same_thread=False,
+                isolation_level=None,
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS states ("
+                "name TEXT PRIMARY KEY, content BLOB NOT NULL, updated_at TEXT NOT NULL)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS state_history ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, "
+                "content BLOB NOT NULL, created_at TEXT NOT NULL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS state_history_name ON state_history (name, id)"
+            )
+            return connection, threading.Lock()
+
+        return shared_client(key=("sqlite", self.path), factory=create_client)
+
+    @property
+    def client(self) -> sqlite3.Connection:
+        return self._shared_connection[0]
+
+    @property
+    def lock(self) -> threading.Lock:
+        return self._shared_connection[1]
+
+    def _execute(self, sql: str, parameters: Any = ()) -> List[Tuple]:
+        """
+        Execute a statement on the shared connection.
+
+        Args:
+            sql (str): The statement to execute.
+            parameters (Any): The parameters of the statement.
+
+        Returns:
+            List[Tuple]: The resulting rows.
+        """
+        with self.lock:
+            return self.client.execute(sql, parameters).fetchall()
+
+    def has_existing_state(self, state_file_name: str) -> bool:
+        """
+        Checks for a pre-existing state file.
+
+        Args:
+        state_file_name (str): The name of the state file to load.
+
+        Returns:
+            bool: Boolean flag to indicate whether there is a pre-existing state file.
+        """
+        return self.read(state_file_name) is not None
+
+    def read(self, state_file_name: str) -> Optional[bytes]:
+        """
+        Read the contents of a state file.
+
+        Args:
+            state_file_name (str): The name of the state file to read.
+
+        Returns:
+            Optional[bytes]: The contents of the state file, None if it doesn't exist.
+        """
+        return self.read_many([state_file_name])[state_file_name]
+
+    def list_state_files(self, prefix: str = "") -> Optional[set]:
+        """
+        List the names of all state files in the database.
+
+        Args:
+            prefix (str): Only list the state files whose names start with this prefix.
+
+        Returns:
+            Optional[set]: The names of the state files.
+        """
+        rows = self._execute(
+            "SELECT name FROM states WHERE substr(name, 1, ?) = ?",
+            (len(prefix), prefix),
+        )
+
+        return {name for (name,) in rows}
+
+    def delete(self, state_file_name: str) -> None:
+        """
+        Delete a state file, if it exists.
+
+        Args:
+            state_file_name (str): The name of the state file to delete.
+        """
+        self._execute("DELETE FROM states WHERE name = ?", (state_file_name,))
+
+    def read_many(
+        self,
+        state_file_names: List[str],
+        max_workers: int = DEFAULT_MAX_WORKERS,
+    ) -> Dict[str, Optional[bytes]]:
+        """
+        Read the contents of many state files in a single query.
+
+        Args:
+            state_file_names (List[str]): The names of the state files to read.
+            max_workers (int): Unused, the state files are read in a single query.
+
+        Returns:
+            Dict[str, Optional[bytes]]: The contents by state file name, None if it doesn't exist.
+        """
+        contents = dict.fromkeys(state_file_names)
+
+        if not state_file_names:
+            return contents
+
+        rows = self._execute(
+            f"SELECT name, content FROM states WHERE name IN ({', '.join('?' * len(state_file_names))})",
+            list(state_file_names),
+        )
+
+        contents.update({name: bytes(content) for name, content in rows})
+        return contents
+
+    def write(self, state_file_name: str, content: bytes) -> None:
+        """
+        Write the contents of a state file, and add it to the history if enabled.
+
+        Args:
+            state_file_name (str): The name of the state file to write.
+            content (bytes): The contents of the state file.
+        """
+        now = datetime.now(timezone.utc).isoformat()
+        synchronous = "NORMAL" if self.durability == DURABILITY_NONE else "FULL"
+
+        with self.lock:
+            self.client.execute(f"PRAGMA synchronous={synchronous}")
+            self.client.execute("BEGIN IMMEDIATE")
+            try:
+                self.client.execute(
+                    "INSERT INTO states (name, content, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT (name) DO UPDATE SET content = excluded.content, "
+                    "updated_at = excluded.updated_at",
+                    (state_file_name, content, now),
+                )
+                if self.history:
+                    self.client.execute(
+                        "INSERT INTO state_history (name, content, created_at) VALUES (?, ?, ?)",
+                        (state_file_name, content, now),
+                    )
+            except BaseException:
+                self.client.execute("ROLLBACK")
+                raise
+
+            self.client.execute("COMMIT")
+
+    def read_history(self, state_file_name: str) -> List[Tuple[str, bytes]]:
+        """
+        Read the history of a state file.
+
+        Args:
+            state_file_name (str): The name of the state file.
+
+        Returns:
+            List[Tuple[str, bytes]]: The creation time and contents of every version, newest first.
+        """
+        rows = self._execute(
+            "SELECT created_at, content FROM state_history WHERE name = ? ORDER BY id DESC",
+            (state_file_name,),
+        )
+
+        return [(created_at, bytes(content)) for created_at, content in rows]
+
+    def list_versions(self, state_file_name: str) -> List[Tuple[int, str]]:
+        """
+        List the versions of a state file in the history.
+
+        Args:
+            state_file_name (str): The name of the state file.
+
+        Returns:
+            List[Tuple[int, str]]: The id and creation time of every version, newest first.
+        """
+        return self._execute(
+            "SELECT id, created_at FROM state_history WHERE name = ? ORDER BY id DESC",
+            (state_file_name,),
+        )
+
+    def read_version(self, state_file_name: str, version: int) -> Optional[bytes]:
+        """
+        Read a version of a state file from the history.
+
+        Args:
+            state_file_name (str): The name of the state file.
+            version (int): The id of the version.
+
+        Returns:
+            Optional[bytes]: The contents of the version, None if it doesn't exist.
+        """
+        rows = self._execute(
+            "SELECT content FROM state_history WHERE name = ? AND id = ?",
+            (state_file_name, version),
+        )
+
+        return bytes(rows[0][0]) if rows else None
+
+    def prune_history(
+        self,
+        state_file_name: str,
+        keep: Optional[int] = None,
+        before: Optional[str] = None,
+    ) -> None:
+        """
+        Remove old versions of a state file from the history.
+
+        Args:
+            state_file_name (str): The name of the state file.
+            keep (Optional[int]): The number of newest versions to keep.
+            before (Optional[str]): Remove the versions created before this time.
+        """
+        if keep is not None:
+            self._execute(
+                "DELETE FROM state_history WHERE name = ? AND id NOT IN ("
+                "SELECT id FROM state_history WHERE name = ? ORDER BY id DESC LIMIT ?)",
+                (state_file_name, state_file_name, keep),
+            )
+
+        if before is not None:
+            self._execute(
+                "DELETE FROM state_history WHERE name = ? AND created_at < ?",
+                (state_file_name, before),
+            )
+
+
+def state_client_factory(
+    base_path: str,
+    pool_size: int = DEFAULT_POOL_SIZE,
+    durability: str = DURABILITY_NONE,
+) -> StateClient:
+    if base_path.startswith("s3://"):
+        return S3StateClient(base_path, pool_size=pool_size)
+    elif base_path.startswith("azure://"):
+        return AzureStateClient(base_path, pool_size=pool_size)
+    elif base_path.startswith("gs://"):
+        return GCSStateClient(base_path, pool_size=pool_size)
+    elif base_path.startswith("sqlite://"):
+        return SQLiteStateClient(base_path, durability=durability)
+    else:
+        return LocalStateClient(base_path, pool_size=pool_size, durability=durability)
+
+
+class StateManager:
+    def __init__(
+        self,
+        base_path: str = ".",
+        cache: bool = True,
+        durability: str = DURABILITY_NONE,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        compression: Optional[str] = None,
+        delta_log: bool = False,
+        compact_every: int = DEFAULT_COMPACT_EVERY,
+        versions: int = 0,
+        version_retention: Optional[timedelta] = None,
+    ) -> None:
+        """
+        Args:
+            base_path (str): The base path to store state files in. Defaults to "./state".
+            cache (bool): Whether to keep a write-through cache of the state files in memory.
+                When multiple processes write the same state file, use `invalidate` or
+                `refresh` to pick up their changes. Defaults to True.
+            durability (str): How durable local state writes are, one of "none" (atomic
+                rename only), "file" (fsync the file) or "directory" (fsync the file and
+                the directory). Defaults to "none".
+            pool_size (int): The size of the connection pool of the state store client.
+                Clients are shared by all state managers with the same backend, credentials
+                and bucket. SQLite uses one connection per database. Defaults to 10.
+            max_workers (int): The number of state files that are read concurrently
+                by `load_many`. Defaults to 8.
+            compression (Optional[str]): The compression of written state files, one
+                of None, "gzip" or "zstd" (requires `elx[zstd]`). Compressed state files
+                are detected when reading, regardless of this setting. Defaults to None.
+            delta_log (bool): Whether to append the changes of every save to a delta
+                log (`<state file>.log`) instead of rewriting the whole state file.
+                Only local state files can be appended to. Defaults to False.
+            compact_every (int): The number of deltas after which the delta log is
+                compacted into the state file. Defaults to 100.
+            versions (int): The number of earlier versions of every state file to keep,
+                so they can be restored. Versions are kept in a ring buffer of state
+                files (`<state file>.v<slot>`) or, for SQLite with `?history=true`, in
+                the history table. Defaults to 0 (no versions).
+            version_retention (Optional[timedelta]): How long versions are kept, on top
+                of the number of versions. Defaults to None (no time limit).
+        """
+        if compression not in COMPRESSIONS:
+            raise ValueError(
+                f"Invalid compression `{compression}`, expected one of {COMPRESSIONS}."
+            )
+
+        # Fail early instead of on the first save.
+        if compression == COMPRESSION_ZSTD:
+            import_zstandard()
+
+        self.base_path = base_path
+        self.max_workers = max_workers
+        self.compression = compression
+        self.delta_log = delta_log
+        self.compact_every = compact_every
+        self.versions = versions
+        self.version_retention = version_retention
+        # The number of deltas in the delta log of every state file.
+        self._delta_counts: Dict[str, int] = {}
+        self.state_client = state_client_factory(
+            base_path,
+            pool_size=pool_size,
+            durability=durability,
+        )
+        self.cache = cache
+        self._states: Dict[str, dict] = {}
+
+        if delta_log and not self.state_client.supports_append:
+            raise ValueError(
+                f"The delta log requires a state store that supports appends, "
+                f"{self.state_client.__class__.__name__} for `{base_path}` doesn't."
+            )
+
+    def invalidate(self, state_file_name: Optional[str] = None) -> None:
+        """
+        Remove a state file from the cache, so the next load reads it from the state store.
+
+        Args:
+            state_file_name (Optional[str]): The name of the state file. Invalidates all
+                state files if not provided.
+        """
+        if state_file_name is None:
+            self._states.clear()
+        else:
+            self._states.pop(state_file_name, None)
+
+    def refresh(self, state_file_name: str) -> dict:
+        """
+        Load a state file from the state store, bypassing the cache.
+
+        Args:
+            state_file_name (str): The name of the state file to load.
+
+        Returns:
+            dict: The contents of the state file.
+        """
+        self.invalidate(state_file_name)
+        return self.load(state_file_name)
+
+    def _encode(self, state: dict) -> bytes:
+        """
+        Returns:
+            bytes: The (compressed) contents of a state file.
+        """
+        return compress(json.dumps(state).encode("utf-8"), self.compression)
+
+    def _decode(self, content: Optional[bytes]) -> dict:
+        """
+        Returns:
+            dict: The state of (compressed) state file contents, empty if there are none.
+        """
+        if not content:
+            return {}
+
+        return json.loads(decompress(content))
+
+    def _delta_log_file_name(self, state_file_name: str) -> str:
+        """
+        Returns:
+            str: The name of the delta log of a state file.
+        """
+        return f"{state_file_name}.log"
+
+    def _apply_delta_log(
+        self,
+        state_file_name: str,
+        state: dict,
+        snapshot_content: Optional[bytes],
+    ) -> dict:
+        """
+        Apply the deltas in the delta log of a state file to its last snapshot.
+
+        Args:
+            state_file_name (str): The name of the state file.
+            state (dict): The last snapshot of the state file.
+            snapshot_content (Optional[bytes]): The contents of the last snapshot.
+
+        Returns:
+            dict: The current state.
+        """
+        content = self.state_client.read(self._delta_log_file_name(state_file_name))
+        lines = [line for line in (content or b"").splitlines() if line]
+        snapshot_hash = (
+            hashlib.sha256(snapshot_content or b"").hexdigest().encode("utf-8")
+        )
+        deltas = []
+        torn = False
+
+        for line in lines:
+            if line.startswith(COMPACTION_MARKER):
+                # The snapshot was written after this marker, so it already contains
+                # the deltas before it, e.g. when the log was not truncated after a crash.
+                if line[len(COMPACTION_MARKER) :] == snapshot_hash:
+                    deltas = []
+                continue
+
+            # Only the last delta can be torn, nothing is appended after it until compaction.
+            if torn:
+                raise ValueError(f"The delta log of `{state_file_name}` is corrupt.")
+
+            try:
+                deltas.append(json.loads(line))
+            except ValueError:
+                # The last delta is torn if appending it was interrupted, e.g. by a crash.
+                torn = True
+
+        for delta in deltas:
+            state = apply_merge_patch(state, delta)
+
+        # Compact a torn or unfinished delta log with the next save, before anything is appended to it.
+        self._delta_counts[state_file_name] = (
+            self.compact_every if torn or len(deltas) < len(lines) else len(deltas)
+        )
+        return state
+
+    def _read(self, state_file_name: str) -> dict:
+        """
+        Read a state file from the state store.
+
+        Args:
+            state_file_name (str): The name of the state file to read.
+
+        Returns:
+            dict: The contents of the state file.
+        """
+        content = self.state_client.read(state_file_name)
+        state = self._decode(content)
+
+        if self.delta_log:
+            state = self._apply_delta_log(state_file_name, state, content)
+
+        return state
+
+    def _write(
+        self,
+        state_file_name: str,
+        state: dict,
+        existing_state: dict,
+    ) -> None:
+        """
+        Write a state file to the state store.
+
+        Args:
+            state_file_name (str): The name of the state file to write.
+            state (dict): The state to write.
+            existing_state (dict): The state that was stored before.
+        """
+        if self.delta_log and self._write_delta(state_file_name, state, existing_state):
+            return
+
+        content = self._encode(state)
+        compact = bool(self._delta_counts.get(state_file_name))
+
+        # Mark the deltas as compacted into the snapshot before writing it, so the
+        # deltas are not applied to the snapshot again if the log isn't truncated.
+        if compact:
+            self.state_client.append(
+                self._delta_log_file_name(state_file_name),
+                # Start on a new line, in case the last delta is torn.
+                b"\n"
+                + COMPACTION_MARKER
+                + hashlib.sha256(content).hexdigest().encode("utf-8")
+                + b"\n",
+            )
+
+        self.state_client.write(state_file_name, content)
+
+        # Compact the delta log, the snapshot now contains all of its deltas.
+        if compact:
+            self.state_client.write(self._delta_log_file_name(state_file_name), b"")
+            self._delta_counts[state_file_name] = 0
+
+    def _write_delta(
+        self, state_file_name: str, state: dict, existing_state: dict
+    ) -> bool:
+        """
+        Append the changes to the state to the delta log of a state file.
+
+        Args:
+            state_file_name (str): The name of the state file to write.
+            state (dict): The state to write.
+            existing_state (dict): The state that was stored before.
+
+        Returns:
+            bool: False if a full snapshot has to be written instead.
+        """
+        delta_count = self._delta_counts.get(state_file_name, 0)
+
+        # Start with a snapshot, and compact the delta log once it is full.
+        if not existing_state or delta_count >= self.compact_every:
+            return False
+
+        try:
+            delta = create_merge_patch(existing_state, state)
+        except ValueError:
+            return False
+
+        if delta:
+            self.state_client.append(
+                self._delta_log_file_name(state_file_name),
+                json.dumps(delta).encode("utf-8") + b"\n",
+            )
+            self._delta_counts[state_file_name] = delta_count + 1
+
+        return True
+
+    def _merge(self, existing_state: dict, state: dict) -> dict:
+        """
+        Merge a new state into the existing state.
+
+        Args:
+            existing_state (dict): The existing state.
+            state (dict): The new state.
+
+        Returns:
+            dict: The merged state.
+        """
+        return {**existing_state, **state}
+
+    def _read_many(self, state_file_names: List[str]) -> Dict[str, dict]:
+        """
+        Read many state files from the state store.
+
+        Args:
+            state_file_names (List[str]): The names of the state files to read.
+
+        Returns:
+            Dict[str, dict]: The contents by state file name.
+        """
+        if self.delta_log:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                return dict(
+                    zip(state_file_names, executor.map(self._read, state_file_names))
+                )
+
+        contents = self.state_client.read_many(
+            state_file_names,
+            max_workers=self.max_workers,
+        )
+
+        return {
+            state_file_name: self._decode(content)
+            for state_file_name, content in contents.items()
+        }
+
+    def load_many(self, state_file_names: List[str]) -> Dict[str, dict]:
+        """
+        Load many state files at once, e.g. for the status of many runners. State
+        files that are not cached are read from the state store concurrently.
+
+        Args:
+            state_file_names (List[str]): The names of the state files to load.
+
+        Returns:
+            Dict[str, dict]: The contents by state file name.
+        """
+        missing_state_file_names = [
+            state_file_name
+            for state_file_name in dict.fromkeys(state_file_names)
+            if state_file_name not in self._states
+        ]
+
+        states = (
+            self._read_many(missing_state_file_names)
+            if missing_state_file_names
+            else {}
+        )
+
+        if not self.cache:
+            return {
+                state_file_name: states[state_file_name]
+                for state_file_name in state_file_names
+            }
+
+        self._states.update(states)
+
+        return {
+            state_file_name: copy.deepcopy(self._states[state_file_name])
+            for state_file_name in state_file_names
+        }
+
+    @property
+    def _native_versions(self) -> bool:
+        """
+        Returns:
+            bool: Whether the state store keeps the versions itself, i.e. SQLite with history.
+        """
+        return (
+            isinstance(self.state_client, SQLiteStateClient)
+            and self.state_client.history
+        )
+
+    def _version_index_file_name(self, state_file_name: str) -> str:
+        """
+        Returns:
+            str: The name of the index of the versions of a state file.
+        """
+        return f"{state_file_name}.versions"
+
+    def _version_file_name(self, state_file_name: str, slot: int) -> str:
+        """
+        Returns:
+            str: The name of a slot in the ring buffer of versions of a state file.
+        """
+        return f"{state_file_name}.v{slot}"
+
+    def _retention_cutoff(self) -> Optional[str]:
+        """
+        Returns:
+            Optional[str]: The time before which versions are removed, if any.
+        """
+        if self.version_retention is None:
+            return None
+
+        return (datetime.now(timezone.utc) - self.version_retention).isoformat()
+
+    def _read_version_index(self, state_file_name: str) -> dict:
+        """
+        Read the index of the versions of a state file, without expired versions.
+
+        Returns:
+            dict: The next version number and the versions, newest first.
+        """
+        content = self.state_client.read(self._version_index_file_name(state_file_name))
+        index = json.loads(content) if content else {"next": 1, "versions": []}
+
+        cutoff = self._retention_cutoff()
+        if cutoff is not None:
+            index["versions"] = [
+                version
+                for version in index["versions"]
+                if version["saved_at"] >= cutoff
+            ]
+
+        return index
+
+    def _save_version(self, state_file_name: str, state: dict) -> None:
+        """
+        Keep a version of a state file.
+
+        Args:
+            state_file_name (str): The name of the state file.
+            state (dict): The saved state.
+        """
+        if self._native_versions:
+            self.state_client.prune_history(
+                state_file_name,
+                keep=self.versions or None,
+                before=self._retention_cutoff(),
+            )
+            return
+
+        if not self.versions:
+            return
+
+        index = self._read_version_index(state_file_name)
+        version = index["next"]
+        slot = version % self.versions
+
+        # Write the version before the index, so the index never points to a missing version.
+        self.state_client.write(
+            self._version_file_name(state_file_name, slot),
+            self._encode(state),
+        )
+
+        index["next"] = version + 1
+        index["versions"] = [
+            {
+                "version": version,
+                "slot": slot,
+                "saved_at": datetime.now(timezone.utc).isoformat(),
+            },
+            *index["versions"][: self.versions - 1],
+        ]
+        self.state_client.write(
+            self._version_index_file_name(state_file_name),
+            json.dumps(index).encode("utf-8"),
+        )
+
+    def list_versions(self, state_file_name: str) -> List[dict]:
+        """
+        List the versions of a state file that can be restored.
+
+        Args:
+            state_file_name (str): The name of the state file.
+
+        Returns:
+            List[dict]: The `version` and `saved_at` time of every version, newest first.
+        """
+        if self._native_versions:
+            cutoff = self._retention_cutoff()
+
+            return [
+                {"version": version, "saved_at": saved_at}
+                for version, saved_at in self.state_client.list_versions(
+                    state_file_name
+                )
+                if cutoff is None or saved_at >= cutoff
+            ]
+
+        return [
+            {"version": version["version"], "saved_at": version["saved_at"]}
+            for version in self._read_version_index(state_file_name)["versions"]
+        ]
+
+    def load_version(self, state_file_name: str, version: int) -> dict:
+        """
+        Load a version of a state file.
+
+        Args:
+            state_file_name (str): The name of the state file.
+            version (int): The version to load, see `list_versions`.
+
+        Returns:
+            dict: The state of the version.
+
+        Raises:
+            KeyError: If the version doesn't exist (anymore).
+        """
+        if self._native_versions:
+            content = self.state_client.read_version(state_file_name, version)
+        else:
+            slots = {
+                item["version"]: item["slot"]
+                for item in self._read_version_index(state_file_name)["versions"]
+            }
+            content = (
+                self.state_client.read(
+                    self._version_file_name(state_file_name, slots[version])
+                )
+                if version in slots
+                else None
+            )
+
+        if content is None:
+            raise KeyError(f"Version {version} of `{state_file_name}` does not exist.")
+
+        return self._decode(content)
+
+    def restore(self, state_file_name: str, version: int) -> dict:
+        """
+        Restore a version of a state file, e.g. to roll back bookmarks after a bad
+        run. The state is replaced instead of merged, and the restore is kept as a
+        new version so it can be undone.
+
+        Args:
+            state_file_name (str): The name of the state file.
+            version (int): The version to restore, see `list_versions`.
+
+        Returns:
+            dict: The restored state.
+        """
+        state = self.load_version(state_file_name, version)
+        existing_state = self.refresh(state_file_name)
+
+        self._write(state_file_name, state, existing_state)
+        self._save_version(state_file_name, state)
+
+        if self.cache:
+            self._states[state_file_name] = copy.deepcopy(state)
+
+        return state
+
+    def load(self, state_file_name: str) -> dict:
+        """
+        Load a state file.
+
+        Args:
+            state_file_name (str): The name of the state file to load.
+
+        Returns:
+            dict: The contents of the state file.
+        """
+        if state_file_name not in self._states:
+            state = self._read(state_file_name)
+
+            if not self.cache:
+                return state
+
+            self._states[state_file_name] = state
+
+        # Return a copy, so the cached state can't be modified by the caller.
+        return copy.deepcopy(self._states[state_file_name])
+
+    def save(self, state_file_name: str, state: dict = {}) -> None:
+        """
+        Save a state file.
 
         Args:
             state_file_name (str): The name of the state file to save.
         """
         # We first merge with any existing state to ensure that we don't overwrite
-        existing_state = self.load(state_file_name)
-        merged_state = {**existing_state, **state}
+        if state_file_name in self._states:
+            existing_state = self._states[state_file_name]
+        else:
+            existing_state = self.load(state_file_name)
+        merged_state = self._merge(existing_state, state)
 
         # Then we write the merged state to the state file
-        with open(
-            f"{self.base_path}/{state_file_name}",
-            "wb",
-            transport_params=self.state_client.params,
-        ) as state_file:
-            state_file.write(json.dumps(merged_state).encode("utf-8"))
+        self._write(state_file_name, merged_state, existing_state)
+        self._save_version(state_file_name, merged_state)
+
+        # Keep a copy of the written state, so the next load doesn't need the state store.
+        if self.cache:
+            self._states[state_file_name] = copy.deepcopy(merged_state)
+
+
+class ShardedStateManager(StateManager):
+    """
+    A state manager that stores the bookmarks of every stream in a separate
+    state file, plus a manifest with the streams and the rest of the state:
+
+        <tap>-<target>/manifest.json
+        <tap>-<target>/bookmarks.<stream>.json
+
+    Shards are read in parallel and only changed shards are written, so writers
+    that run different streams of the same tap and target don't overwrite each
+    other's bookmarks. If the state store can be listed, the streams are found
+    by listing the shards, so concurrent manifest writes can't lose streams.
+    """
+
+    MANIFEST_FILE_NAME = "manifest.json"
+
+    def __init__(self, base_path: str = ".", **kwargs) -> None:
+        """
+        Args:
+            base_path (str): The base path to store state files in. Defaults to "./state".
+            kwargs: The other arguments of the StateManager, `max_workers` is also the
+                number of shards that are read or written concurrently.
+        """
+        super().__init__(base_path, **kwargs)
+
+        if self.delta_log:
+            raise ValueError("The sharded state layout doesn't support a delta log.")
+
+        # State files that were read from an unsharded state file and still need all shards written.
+        self._unsharded_state_files = set()
+
+    def _shard_directory(self, state_file_name: str) -> str:
+        """
+        Returns:
+            str: The directory of the shards of a state file.
+        """
+        return state_file_name.removesuffix(".json")
+
+    def _manifest_file_name(self, state_file_name: str) -> str:
+        """
+        Returns:
+            str: The name of the manifest of a state file.
+        """
+        return f"{self._shard_directory(state_file_name)}/{self.MANIFEST_FILE_NAME}"
+
+    def _shard_file_name(self, state_file_name: str, stream: str) -> str:
+        """
+        Returns:
+            str: The name of the shard with the bookmarks of a stream.
+        """
+        return f"{self._shard_directory(state_file_name)}/bookmarks.{quote(stream, safe='')}.json"
+
+    @property
+    def _native_versions(self) -> bool:
+        """
+        Returns:
+            bool: False, the history of SQLite has versions of the shards, not of the
+                state file, so the versions are kept as version files.
+        """
+        return False
+
+    def restore(self, state_file_name: str, version: int) -> dict:
+        """
+        Restore a version of a state file, see `StateManager.restore`. The shards
+        of streams that are not in the version are deleted first, so they don't
+        show up in the restored state.
+
+        Args:
+            state_file_name (str): The name of the state file.
+            version (int): The version to restore, see `list_versions`.
+
+        Returns:
+            dict: The restored state.
+
+        Raises:
+            NotImplementedError: If there are shards to delete, but the state store
+                doesn't support deleting state files.
+        """
+        bookmarks = self.load_version(state_file_name, version).get("bookmarks", {})
+        manifest = self._read_manifest(state_file_name) or {"streams": [], "state": {}}
+        removed_streams = sorted(
+            (
+                set(manifest["streams"])
+                | set(self._list_shard_streams(state_file_name) or [])
+            )
+            - set(bookmarks)
+        )
+
+        def delete_shard(stream: str) -> None:
+            self.state_client.delete(self._shard_file_name(state_file_name, stream))
+
+        self._map(delete_shard, removed_streams)
+        state = super().restore(state_file_name, version)
+
+        # The manifest keeps the streams of other writers, so remove the deleted streams.
+        if removed_streams:
+            manifest = self._read_manifest(state_file_name) or {"streams": []}
+            self.state_client.write(
+                self._manifest_file_name(state_file_name),
+                self._encode(
+                    {
+                        "streams": sorted(
+                            (set(manifest["streams"]) - set(removed_streams))
+                            | set(bookmarks)
+                        ),
+                        "state": {
+                            key: value
+                            for key, value in state.items()
+                            if key != "bookmarks"
+                        },
+                    }
+                ),
+            )
+
+        return state
+
+    def _list_shard_streams(self, state_file_name: str) -> Optional[List[str]]:
+        """
+        List the streams that have a shard.
+
+        Returns:
+            Optional[List[str]]: The streams, None if the state store can't be listed.
+        """
+        prefix = f"{self._shard_directory(state_file_name)}/bookmarks."
+        names = self.state_client.list_state_files(prefix=prefix)
+
+        if names is None:
+            return None
+
+        return sorted(
+            unquote(name.removeprefix(prefix).removesuffix(".json"))
+            for name in names
+            if name.startswith(prefix) and name.endswith(".json")
+        )
+
+    def _read_manifest(self, state_file_name: str) -> Optional[dict]:
+        """
+        Read the manifest of a state file.
+
+        Returns:
+            Optional[dict]: The manifest, None if the state file is not sharded yet.
+        """
+        content = self.state_client.read(self._manifest_file_name(state_file_name))
+
+        if content is None:
+            return None
+
+        return self._decode(content)
+
+    def _map(self, function: Callable, items: List) -> List:
+        """
+        Apply a function to the items in parallel.
+        """
+        if len(items) <= 1:
+            return [function(item) for item in items]
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(function, items))
+
+    def _read(self, state_file_name: str) -> dict:
+        """
+        Read the manifest and all shards of a state file.
+
+        Args:
+            state_file_name (str): The name of the state file to read.
+
+        Returns:
+            dict: The assembled state.
+        """
+        manifest = self._read_manifest(state_file_name)
+        listed_streams = self._list_shard_streams(state_file_name)
+
+        # Fall back to an unsharded state file, so existing state is picked up.
+        if manifest is None and not listed_streams:
+            self._unsharded_state_files.add(state_file_name)
+            return super()._read(state_file_name)
+
+        manifest = manifest or {"streams": [], "state": {}}
+        streams = sorted(set(manifest["streams"]) | set(listed_streams or []))
+
+        def read_shard(stream: str) -> Optional[bytes]:
+            return self.state_client.read(
+                self._shard_file_name(state_file_name, stream)
+            )
+
+        shards = self._map(read_shard, streams)
+
+        state = dict(manifest["state"])
+        if streams or "bookmarks" in state:
+            state["bookmarks"] = {
+                stream: self._decode(shard)
+                for stream, shard in zip(streams, shards)
+                if shard is not None
+            }
+
+        return state
+
+    def _read_many(self, state_file_names: List[str]) -> Dict[str, dict]:
+        """
+        Read many sharded state files concurrently.
+
+        Args:
+            state_file_names (List[str]): The names of the state files to read.
+
+        Returns:
+            Dict[str, dict]: The assembled states by state file name.
+        """
+        return dict(zip(state_file_names, self._map(self._read, state_file_names)))
+
+    def _merge(self, existing_state: dict, state: dict) -> dict:
+        """
+        Merge a new state into the existing state, bookmarks are merged per stream.
+
+        Args:
+            existing_state (dict): The existing state.
+            state (dict): The new state.
+
+        Returns:
+            dict: The merged state.
+        """
+        merged_state = {**existing_state, **state}
+
+        if "bookmarks" in state:
+            merged_state["bookmarks"] = {
+                **existing_state.get("bookmarks", {}),
+                **state["bookmarks"],
+            }
+
+        return merged_state
+
+    def _write(
+        self,
+        state_file_name: str,
+        state: dict,
+        existing_state: dict,
+    ) -> None:
+        """
+        Write the changed shards and, if needed, the manifest of a state file.
+
+        Args:
+            state_file_name (str): The name of the state file to write.
+            state (dict): The state to write.
+            existing_state (dict): The state that was stored before.
+        """
+        bookmarks = state.get("bookmarks", {})
+        existing_bookmarks = existing_state.get("bookmarks", {})
+
+        # Write all shards if the existing state was not sharded yet. If another
+        # writer migrated it in the meantime, only write the changed shards, so its
+        # newer shards aren't overwritten with the stale unsharded bookmarks.
+        if state_file_name in self._unsharded_state_files:
+            self._unsharded_state_files.discard(state_file_name)
+
+            listed_streams = self._list_shard_streams(state_file_name)
+            if not listed_streams and self._read_manifest(state_file_name) is None:
+                existing_bookmarks = {}
+                existing_state = {}
+
+        # Only write the shards of streams with changed bookmarks.
+        changed_streams = [
+            stream
+            for stream, bookmark in bookmarks.items()
+            if existing_bookmarks.get(stream) != bookmark
+        ]
+
+        def write_shard(stream: str) -> None:
+            self.state_client.write(
+                self._shard_file_name(state_file_name, stream),
+                self._encode(bookmarks[stream]),
+            )
+
+        self._map(write_shard, changed_streams)
+
+        # Only write the manifest if the streams or the rest of the state changed.
+        manifest_state = {
+            key: value for key, value in state.items() if key != "bookmarks"
+        }
+        existing_manifest_state = {
+            key: value for key, value in existing_state.items() if key != "bookmarks"
+        }
+
+        if set(bookmarks) - set(existing_bookmarks) or (
+            manifest_state != existing_manifest_state
+        ):
+            # Re-read the manifest right before writing it, so streams that were
+            # added by another writer in the meantime are kept.
+            manifest = self._read_manifest(state_file_name) or {"streams": []}
+            streams = sorted(set(manifest["streams"]) | set(bookmarks))
+
+            self.state_client.write(
+                self._manifest_file_name(state_file_name),
+                self._encode({"streams": streams, "state": manifest_state}),
+            )
@@ -1,13 +1,28 @@
 import asyncio
+import hashlib
+import json
 import logging
 import contextlib
+import os
+import signal
+import time
+from collections import deque
 from functools import cached_property
 from pathlib import Path
-from typing import Generator, List, Optional
+from typing import Dict, Generator, Iterable, List, Optional, Tuple
 from elx.singer import Singer, require_install, BUFFER_SIZE_LIMIT
 from elx.catalog import Stream, Catalog
-from elx.json_temp_file import json_temp_file
-from subprocess import Popen, PIPE
+from elx.json_temp_file import json_temp_file, content_addressed_file
+from subprocess import Popen
+
+# The number of serialized catalog selections to keep in memory per tap.
+CATALOG_CACHE_SIZE = 16
+# The default number of taps that are discovered at the same time.
+DISCOVERY_CONCURRENCY = 8
+# The default number of records that are sampled per stream.
+SAMPLE_LIMIT = 10
+# The number of lines of stderr that are kept to explain a failed sample.
+SAMPLE_STDERR_LINES = 20
 
 
 class Tap(Singer):
@@ -24,19 +39,61 @@ class Tap(Singer):
         self.deselected = deselected
         self.replication_keys = replication_keys
         self.schema = schema
+        self._catalog_files: Dict[
+            Optional[Tuple[str, ...]], Tuple[Catalog, bytes, Path]
+        ] = {}
 
-    def discover(self, config_path: Path) -> dict:
+    def discover(self, config_path: Path) -> Catalog:
         """
-        Run the tap in discovery mode.
+        Run the tap in discovery mode. The catalog is parsed stream by stream
+        while the tap writes it, so the raw output is never held in memory.
 
         Args:
             config_path (Path): Path to the config file.
 
         Returns:
-            dict: The catalog.
+            Catalog: The discovered catalog.
         """
         logging.debug(f"Discovering {self.executable} with {config_path}")
-        return self.run(["--config", str(config_path), "--discover"])
+        streams = self.run_streaming(
+            ["--config", str(config_path), "--discover"],
+            key="streams",
+        )
+        return Catalog(streams=[Stream(**stream) for stream in streams])
+
+    async def async_discover(self, config_path: Path) -> Catalog:
+        """
+        Run the tap in discovery mode as an async subprocess. The tap has to be
+        installed already.
+
+        Args:
+            config_path (Path): Path to the config file.
+
+        Returns:
+            Catalog: The discovered catalog.
+        """
+        logging.debug(f"Discovering {self.executable} with {config_path}")
+        streams = self.async_run_streaming(
+            ["--config", str(config_path), "--discover"],
+            key="streams",
+        )
+        return Catalog(streams=[Stream(**stream) async for stream in streams])
+
+    def configure_catalog(self, catalog: Catalog) -> Catalog:
+        """
+        Apply the deselected streams, replication keys and custom schema of the
+        tap to a discovered catalog.
+
+        Args:
+            catalog (Catalog): The discovered catalog.
+
+        Returns:
+            Catalog: The configured catalog.
+        """
+        catalog = catalog.deselect(patterns=self.deselected)
+        catalog = catalog.set_replication_keys(replication_keys=self.replication_keys)
+        catalog = catalog.add_properties_to_schema(custom_schema=self.schema)
+        return catalog
 
     @cached_property
     def catalog(self) -> Catalog:
@@ -46,15 +103,115 @@ class Tap(Singer):
         Returns:
             Catalog: The catalog as a Pydantic model.
         """
+        with json_temp_file(self.config) as config_path:
+            return self.configure_catalog(self.discover(config_path))
+
+    def catalog_snapshot_path(self, directory: str | Path) -> Path:
+        """
+        Get the path to the catalog snapshot of the tap. Snapshots are keyed by
+        the executable, spec and config before interpolation, so a change of the
+        spec or config invalidates them, but e.g. every partition of a runner
+        shares the snapshot.
+
+        Args:
+            directory (str | Path): The directory of the catalog snapshots.
+
+        Returns:
+            Path: Path to the catalog snapshot.
+        """
+        config = self._config() if callable(self._config) else self._config
+        snapshot_key = hashlib.md5(
+            json.dumps(
+                {
+                    "executable": self.executable,
+                    "spec": self.spec,
+                    "config": config,
+                },
+                sort_keys=True,
+                default=str,
+            ).encode()
+        ).hexdigest()
+
+        return Path(directory) / f"{self.executable}-{snapshot_key}.json"
+
+    def load_catalog_snapshot(self, directory: str | Path) -> Optional[Catalog]:
+        """
+        Load the catalog from a snapshot instead of running discovery. The
+        snapshot contains the discovered catalog, the deselected streams,
+        replication keys and custom schema of the tap are applied to it.
+
+        Args:
+            directory (str | Path): The directory of the catalog snapshots.
+
+        Returns:
+            Optional[Catalog]: The configured catalog, None if there is no snapshot.
+        """
+        path = self.catalog_snapshot_path(directory)
+
+        if not path.exists():
+            return None
+
+        return self.configure_catalog(Catalog.model_validate_json(path.read_bytes()))
+
+    def save_catalog_snapshot(self, directory: str | Path) -> Catalog:
+        """
+        Discover the catalog and save it as a snapshot.
+
+        Args:
+            directory (str | Path): The directory of the catalog snapshots.
+
+        Returns:
+            Catalog: The configured catalog.
+        """
         with json_temp_file(self.config) as config_path:
             catalog = self.discover(config_path)
-            catalog = Catalog(**catalog)
-            catalog = catalog.deselect(patterns=self.deselected)
-            catalog = catalog.set_replication_keys(
-                replication_keys=self.replication_keys
-            )
-            catalog = catalog.add_properties_to_schema(custom_schema=self.schema)
-            return catalog
+
+        path = self.catalog_snapshot_path(directory)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Write to a temporary file first, so a concurrent reader never sees a partial snapshot.
+        temp_path = path.with_name(f".{path.name}.tmp")
+        temp_path.write_text(json.dumps(catalog.dict(by_alias=True), indent=2))
+        temp_path.replace(path)
+
+        self.catalog = self.configure_catalog(catalog)
+        return self.catalog
+
+    def catalog_file(self, streams: Optional[List[str]] = None) -> Path:
+        """
+        Get the path to the serialized catalog with the given streams selected.
+        The serialized catalog is memoized per selection and written to a
+        content-addressed file, so repeated runs skip the serialization.
+
+        Args:
+            streams (Optional[List[str]], optional): The streams to select. Defaults to None.
+
+        Returns:
+            Path: Path to the catalog file.
+        """
+        key = None if streams is None else tuple(sorted(set(streams)))
+        cached = self._catalog_files.get(key)
+
+        # Only use the cached file if it was created from the current catalog.
+        if cached is not None and cached[0] is self.catalog:
+            _, content, path = cached
+
+            # Rewrite the file if it was removed from the temp directory.
+            if not path.exists():
+                path = content_addressed_file(content)
+        else:
+            catalog = self.catalog.select(streams=streams)
+            content = json.dumps(catalog.dict(by_alias=True)).encode("utf-8")
+            path = content_addressed_file(content)
+
+        # Move the selection to the end, so the least recently used is evicted first.
+        self._catalog_files.pop(key, None)
+        self._catalog_files[key] = (self.catalog, content, path)
+
+        if len(self._catalog_files) > CATALOG_CACHE_SIZE:
+            self._catalog_files.pop(next(iter(self._catalog_files)))
+
+        return path
 
     @contextlib.asynccontextmanager
     @require_install
@@ -62,71 +219,277 @@ class Tap(Singer):
         self,
         state: dict = {},
         streams: Optional[List[str]] = None,
+        new_session: bool = False,
     ) -> Generator[Popen, None, None]:
         """
         Run the tap process.
 
+        Args:
+            state (dict): The state to run the tap with.
+            streams (Optional[List[str]]): The streams to run. Defaults to all selected streams.
+            new_session (bool): Start the tap in a new session, so the tap and the
+                processes it started can be killed together as a process group.
+
         Returns:
             Popen: The tap process.
         """
-        catalog = self.catalog.select(streams=streams)
+        catalog_path = self.catalog_file(streams=streams)
 
         with json_temp_file(self.config) as config_path:
-            with json_temp_file(catalog.dict(by_alias=True)) as catalog_path:
-                with json_temp_file(state) as state_path:
-                    yield await asyncio.create_subprocess_exec(
-                        *[
-                            self.executable,
-                            "--config",
-                            str(config_path),
-                            "--catalog",
-                            str(catalog_path),
-                            "--state",
-                            str(state_path),
-                        ],
-                        stdout=asyncio.subprocess.PIPE,
-                        stderr=asyncio.subprocess.PIPE,
-                        limit=BUFFER_SIZE_LIMIT,
+            with json_temp_file(state) as state_path:
+                yield await asyncio.create_subprocess_exec(
+                    *[
+                        self.executable,
+                        "--config",
+                        str(config_path),
+                        "--catalog",
+                        str(catalog_path),
+                        "--state",
+                        str(state_path),
+                    ],
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                    limit=BUFFER_SIZE_LIMIT,
+                    start_new_session=new_session,
+                )
+
+    async def async_sample(
+        self,
+        streams: Optional[List[str]] = None,
+        limit: Optional[int] = SAMPLE_LIMIT,
+        timeout: Optional[float] = None,
+    ) -> Dict[str, List[dict]]:
+        """
+        Sample the first records of every stream, e.g. to smoke test a tap
+        against a production source. The tap runs without state and is killed,
+        together with the processes it started, as soon as every stream has
+        reached the limit or is complete, or when the timeout expires. Like in
+        the record counter, a stream is complete once the tap has moved on to
+        another stream and emitted a state after that.
+
+        Args:
+            streams (Optional[List[str]]): The streams to sample. Defaults to all selected streams.
+            limit (Optional[int]): The number of records per stream, None for all records.
+            timeout (Optional[float]): The maximum number of seconds to sample for.
+
+        Returns:
+            Dict[str, List[dict]]: The sampled records by stream.
+        """
+        if streams is None:
+            streams = [
+                stream.name for stream in self.catalog.streams if stream.is_selected
+            ]
+
+        samples: Dict[str, List[dict]] = {stream: [] for stream in streams}
+        stderr_lines = deque(maxlen=SAMPLE_STDERR_LINES)
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        async def drain_stderr(reader: asyncio.StreamReader) -> None:
+            # Keep reading stderr, so the tap never blocks on a full pipe.
+            while line := await reader.readline():
+                stderr_lines.append(line.decode("utf-8", errors="replace").rstrip())
+
+        # Streams the tap has moved on from, and streams a state was emitted after.
+        left_streams = set()
+        complete_streams = set()
+        current_stream = None
+
+        def is_complete() -> bool:
+            return limit is not None and all(
+                len(records) >= limit or stream in complete_streams
+                for stream, records in samples.items()
+            )
+
+        async with self.process(streams=streams, new_session=True) as process:
+            stderr_future = asyncio.ensure_future(drain_stderr(process.stderr))
+            stopped = False
+
+            try:
+                while not is_complete():
+                    remaining = (
+                        None if deadline is None else deadline - time.monotonic()
                     )
 
+                    if remaining is not None and remaining <= 0:
+                        break
+
+                    try:
+                        line = await asyncio.wait_for(
+                            process.stdout.readline(), remaining
+                        )
+                    except asyncio.TimeoutError:
+                        break
+
+                    if not line:
+                        await process.wait()
+                        break
+
+                    try:
+                        message = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+
+                    if message.get("type") == "STATE":
+                        complete_streams.update(left_streams)
+                        continue
+
+                    if message.get("type") != "RECORD":
+                        continue
+
+                    stream = message.get("stream")
+                    if stream != current_stream:
+                        if current_stream is not None:
+                            left_streams.add(current_stream)
+
+                        # Taps that interleave streams return to a stream later.
+                        left_streams.discard(stream)
+                        complete_streams.discard(stream)
+                        current_stream = stream
+
+                    # Ignore the streams that weren't requested.
+                    records = samples.get(stream)
+                    if records is not None and (limit is None or len(records) < limit):
+                        records.append(message.get("record"))
+            finally:
+                if process.returncode is None:
+                    stopped = True
+                    with contextlib.suppress(ProcessLookupError):
+                        os.killpg(process.pid, signal.SIGKILL)
+
+                returncode = await process.wait()
+                await stderr_future
+
+        if returncode and not stopped:
+            logging.error("\n".join(stderr_lines))
+            raise Exception("Tap failed")
+
+        return samples
+
+    def sample(
+        self,
+        streams: Optional[List[str]] = None,
+        limit: Optional[int] = SAMPLE_LIMIT,
+        timeout: Optional[float] = None,
+    ) -> Dict[str, List[dict]]:
+        """
+        Sample the first records of every stream, see `async_sample`.
+
+        Args:
+            streams (Optional[List[str]]): The streams to sample. Defaults to all selected streams.
+            limit (Optional[int]): The number of records per stream, None for all records.
+            timeout (Optional[float]): The maximum number of seconds to sample for.
+
+        Returns:
+            Dict[str, List[dict]]: The sampled records by stream.
+        """
+        return asyncio.get_event_loop().run_until_complete(
+            self.async_sample(streams=streams, limit=limit, timeout=timeout)
+        )
+
     def invoke(
         self,
         streams: Optional[List[str]] = None,
-        limit: int = None,
+        limit: Optional[int] = SAMPLE_LIMIT,
         debug: bool = True,
-    ) -> None:
+    ) -> Dict[str, List[dict]]:
         """
-        Invoke the tap.
+        Invoke the tap and stop it as soon as every stream has `limit` records.
 
         Args:
             streams (Optional[List[str]], optional): The streams to invoke. Defaults to None.
+            limit (Optional[int], optional): The number of records per stream. Defaults to
+                SAMPLE_LIMIT. None keeps all records in memory, until the tap exits.
+            debug (bool, optional): Whether to print the records. Defaults to True.
+
+        Returns:
+            Dict[str, List[dict]]: The records by stream.
         """
-        # TODO: Make use of the process context manager.
+        samples = self.sample(streams=streams, limit=limit)
 
-        catalog = self.catalog.select(streams=streams)
+        if debug:
+            for stream, records in samples.items():
+                for record in records:
+                    print(json.dumps({"stream": stream, "record": record}))
 
-        with json_temp_file(self.config) as config_path:
-            with json_temp_file(catalog.dict(by_alias=True)) as catalog_path:
-                with json_temp_file({}) as state_path:
-                    process = Popen(
-                        [
-                            self.executable,
-                            "--config",
-                            str(config_path),
-                            "--catalog",
-                            str(catalog_path),
-                            "--state",
-                            str(state_path),
-                        ],
-                        stdout=PIPE,
-                        stderr=PIPE,
-                    )
+        return samples
+
+
+async def async_discover_catalogs(
+    taps: Iterable[Tap],
+    concurrency: int = DISCOVERY_CONCURRENCY,
+    timeout: Optional[float] = None,
+    return_exceptions: bool = False,
+) -> List[Catalog | BaseException]:
+    """
+    Discover the catalogs of many taps concurrently and cache them on the taps.
+    Taps that already have a cached catalog are not discovered again.
+
+    Args:
+        taps (Iterable[Tap]): The taps to discover.
+        concurrency (int): The maximum number of taps that are discovered at the same time.
+        timeout (Optional[float]): The maximum number of seconds discovery may take per tap.
+        return_exceptions (bool): Whether to return exceptions instead of raising the first one.
+
+    Returns:
+        List[Catalog | BaseException]: The catalogs (or exceptions) in the order of the taps.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def discover(tap: Tap) -> Catalog:
+        # Use the cached catalog if the tap has been discovered already.
+        if "catalog" in tap.__dict__:
+            return tap.catalog
+
+        async with semaphore:
+            if not tap.is_installed:
+                await asyncio.to_thread(tap.install)
+
+            with json_temp_file(tap.config) as config_path:
+                catalog = await asyncio.wait_for(
+                    tap.async_discover(config_path),
+                    timeout=timeout,
+                )
+
+        tap.catalog = tap.configure_catalog(catalog)
+        return tap.catalog
+
+    tasks = [asyncio.ensure_future(discover(tap)) for tap in taps]
+
+    try:
+        return await asyncio.gather(*tasks, return_exceptions=return_exceptions)
+    except BaseException:
+        # Kill the other discoveries, which also removes their config files.
+        for task in tasks:
+            task.cancel()
+
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+def discover_catalogs(
+    taps: Iterable[Tap],
+    concurrency: int = DISCOVERY_CONCURRENCY,
+    timeout: Optional[float] = None,
+    return_exceptions: bool = False,
+) -> List[Catalog | BaseException]:
+    """
+    Discover the catalogs of many taps concurrently and cache them on the taps,
+    e.g. before building the Dagster definitions of many runners.
 
-                    n_lines = 0
+    Args:
+        taps (Iterable[Tap]): The taps to discover.
+        concurrency (int): The maximum number of taps that are discovered at the same time.
+        timeout (Optional[float]): The maximum number of seconds discovery may take per tap.
+        return_exceptions (bool): Whether to return exceptions instead of raising the first one.
 
-                    for line in process.stdout:
-                        if limit and n_lines >= limit:
-                            break
-                        if debug:
-                            print(line.decode("utf-8"))
-                        n_lines += 1
+    Returns:
+        List[Catalog | BaseException]: The catalogs (or exceptions) in the order of the taps.
+    """
+    return asyncio.get_event_loop().run_until_complete(
+        async_discover_catalogs(
+            taps=taps,
+            concurrency=concurrency,
+            timeout=timeout,
+            return_exceptions=return_exceptions,
+        )
+    )
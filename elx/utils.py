@@ -1,4 +1,8 @@
 import asyncio
+import re
+import string
+from typing import Any, Callable, Optional
+
 
 def require_install(func):
     """
@@ -14,6 +18,108 @@ def require_install(func):
     return wrapper
 
 
+# The number of rendered configs that are memoized per config template.
+INTERPOLATION_CACHE_SIZE = 16
+
+
+class ConfigTemplate:
+    """
+    A config that is compiled once for interpolation. Only the string leaves
+    that contain placeholders are rendered, and rendered configs are memoized
+    per set of values of the placeholders that are used. Rendered configs are
+    shared with the memoized ones and the original config, copy them before
+    modifying them.
+    """
+
+    def __init__(self, config: dict):
+        """
+        Args:
+            config (dict): The config to compile.
+        """
+        self.config = config
+        # The interpolation values that are used by the config.
+        self.fields = set()
+        self._render = self._compile(config)
+        self._rendered = {}
+
+    def _compile(self, value: Any) -> Optional[Callable[[dict], Any]]:
+        """
+        Compile a value of the config.
+
+        Args:
+            value (Any): The value to compile.
+
+        Returns:
+            Optional[Callable[[dict], Any]]: Renders the value, None if the value has no placeholders.
+        """
+        if isinstance(value, str):
+            if "{" not in value and "}" not in value:
+                return None
+
+            self.fields.update(
+                re.split(r"[.\[]", field_name, 1)[0]
+                for _, field_name, _, _ in string.Formatter().parse(value)
+                if field_name
+            )
+            return lambda interpolation: value.format(**interpolation)
+
+        if isinstance(value, dict):
+            renderers = {key: self._compile(item) for key, item in value.items()}
+
+            if not any(renderers.values()):
+                return None
+
+            return lambda interpolation: {
+                key: renderers[key](interpolation) if renderers[key] else item
+                for key, item in value.items()
+            }
+
+        if isinstance(value, list):
+            renderers = [self._compile(item) for item in value]
+
+            if not any(renderers):
+                return None
+
+            return lambda interpolation: [
+                renderer(interpolation) if renderer else item
+                for renderer, item in zip(renderers, value)
+            ]
+
+        return None
+
+    def render(self, interpolation: dict) -> dict:
+        """
+        Render the config with the interpolation values.
+
+        Args:
+            interpolation (dict): The values to interpolate, E.g. {"key": "value"}.
+
+        Returns:
+            dict: The interpolated config, which must not be modified.
+        """
+        if self._render is None:
+            return self.config
+
+        key = tuple((field, interpolation.get(field)) for field in sorted(self.fields))
+
+        try:
+            return self._rendered[key]
+        except TypeError:
+            # Unhashable values can't be memoized.
+            return self._render(interpolation)
+        except KeyError:
+            pass
+
+        rendered = self._render(interpolation)
+
+        # Evict the oldest rendered config.
+        if len(self._rendered) >= INTERPOLATION_CACHE_SIZE:
+            self._rendered.pop(next(iter(self._rendered)))
+
+        self._rendered[key] = rendered
+        return rendered
+
+
 def interpolate_in_config(config: dict, interpolation: dict) -> dict:
     """
     Interpolate a value in the config. Recurse through the config and use format strings to interpolate the value.
@@ -23,16 +129,16 @@ def interpolate_in_config(config: dict, interpolation: dict) -> dict:
         interpolation (dict): The config to interpolate with, E.g. {"key": "value"}.
 
     Returns:
-        dict: The interpolated config.
+        dict: The interpolated config, which doesn't share any dicts or lists with the config.
     """
 
-    def _interpolate(value: str) -> str:
+    def _interpolate(value: Any) -> Any:
         if isinstance(value, str):
             return value.format(**interpolation)
         elif isinstance(value, list):
             return [_interpolate(item) for item in value]
         elif isinstance(value, dict):
-            return {key: _interpolate(value) for key, value in value.items()}
+            return {key: _interpolate(item) for key, item in value.items()}
         else:
             return value
 
@@ -57,6 +163,7 @@ async def _write_line_writer(writer, line):
 async def capture_subprocess_output(
     reader: asyncio.StreamReader | None,
     *line_writers,
+    complete_lines_only: bool = False,
 ) -> None:
     """Capture in real time the output stream of a suprocess that is run async.
 
@@ -71,12 +178,17 @@ async def capture_subprocess_output(
         reader: `asyncio.StreamReader` object that is the output stream of the
             subprocess.
         line_writers: A `StreamWriter`, or object has a compatible writelines method.
+        complete_lines_only: Skip a last line without a line ending, e.g. a message
+            that was cut off because the subprocess was stopped.
     """
     while not reader.at_eof():
         line = await reader.readline()
         if not line:
             continue
 
+        if complete_lines_only and not line.endswith(b"\n"):
+            continue
+
         for writer in line_writers:
             if not await _write_line_writer(writer, line):
                 # If the destination stream is closed, we can stop capturing output.
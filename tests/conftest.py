@@ -3,3 +3,4 @@ from fixtures.tap import tap
 from fixtures.target import target
 from fixtures.runner import runner
 from fixtures.state import state_manager
+from fixtures.executable import executable
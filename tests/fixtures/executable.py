@@ -0,0 +1,18 @@
+import sys
+from typing import Callable
+import pytest
+
+
+@pytest.fixture
+def executable(tmp_path) -> Callable[[str, str], str]:
+    """
+    Return a factory that creates an executable python script and returns its path.
+    """
+
+    def create(name: str, script: str) -> str:
+        path = tmp_path / name
+        path.write_text(f"#!{sys.executable}\n{script}")
+        path.chmod(0o755)
+        return str(path)
+
+    return create
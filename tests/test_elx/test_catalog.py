@@ -264,7 +264,11 @@ def test_deselect_updates_schema_selected():
                 {
                     "tap_stream_id": "my_stream",
                     "key_properties": [],
-                    "schema": {"type": "object", "properties": {"col": {"type": "string"}}, "selected": True},
+                    "schema": {
+                        "type": "object",
+                        "properties": {"col": {"type": "string"}},
+                        "selected": True,
+                    },
                     "metadata": [],
                 },
             ]
@@ -289,7 +293,11 @@ def test_deselect_property_does_not_change_schema_selected():
                 {
                     "tap_stream_id": "my_stream",
                     "key_properties": [],
-                    "schema": {"type": "object", "properties": {"col": {"type": "string"}}, "selected": True},
+                    "schema": {
+                        "type": "object",
+                        "properties": {"col": {"type": "string"}},
+                        "selected": True,
+                    },
                     "metadata": [],
                 },
             ]
@@ -326,3 +334,137 @@ def test_select_none_returns_unchanged_catalog():
 
     result = catalog.select(None)
     assert result.streams[0].stream_schema.get("selected") == True
+
+
+def test_catalog_copy_on_write():
+    """
+    Transformations should only copy the streams they modify, and never
+    modify the streams of the original catalog.
+    """
+    catalog = Catalog(**DEFAULT_CATALOG)
+
+    result = catalog.deselect(["users.name"]).set_replication_keys(
+        {"users": "updated_at"}
+    )
+
+    # The untouched stream is shared, the modified stream is a copy.
+    assert result.streams[0] is catalog.streams[0]
+    assert result.streams[1] is not catalog.streams[1]
+
+    # The original catalog is left untouched.
+    assert catalog.dict(by_alias=True) == DEFAULT_CATALOG
+    assert (
+        result.streams[1].find_metadata_by_breadcrumb(["properties", "name"])[
+            "selected"
+        ]
+        == False
+    )
+
+    # Selecting streams does not copy streams that are already in the right state.
+    selected = result.select(["users"])
+    reselected = selected.select(["users"])
+    assert reselected.streams[0] is selected.streams[0]
+    assert reselected.streams[1] is selected.streams[1]
+    assert "selected" not in catalog.streams[1].stream_schema
+
+
+def test_catalog_indexes_stay_in_sync():
+    """
+    The stream and breadcrumb lookups should stay correct when the
+    catalog is modified or copied.
+    """
+    catalog = Catalog(**DEFAULT_CATALOG)
+    stream = catalog.find_stream("users")
+
+    assert stream.find_metadata_by_breadcrumb(["properties", "missing"]) is None
+
+    # Upserting new metadata makes it findable.
+    stream.upsert_metadata(["properties", "missing"], {"selected": False})
+    assert stream.find_metadata_by_breadcrumb(["properties", "missing"]) == {
+        "selected": False
+    }
+
+    # Appending to the lists directly is picked up as well.
+    stream.metadata.append({"breadcrumb": ["properties", "extra"], "metadata": {}})
+    assert stream.find_metadata_by_breadcrumb(["properties", "extra"]) == {}
+
+    catalog.streams.append(Stream(tap_stream_id="orders", key_properties=[], schema={}))
+    assert catalog.find_stream("orders").tap_stream_id == "orders"
+
+    # Entries that are replaced in place are not found by their old key.
+    stream.metadata[-1] = {"breadcrumb": ["properties", "replaced"], "metadata": {}}
+    assert stream.find_metadata_by_breadcrumb(["properties", "extra"]) is None
+    assert stream.find_metadata_by_breadcrumb(["properties", "replaced"]) == {}
+
+    catalog.streams[-1] = Stream(tap_stream_id="invoices", key_properties=[], schema={})
+    assert catalog.find_stream("orders") is None
+    assert catalog.find_stream("invoices").tap_stream_id == "invoices"
+
+    # Copies keep working on their own metadata.
+    copy = catalog.model_copy(deep=True)
+    copied_stream = copy.find_stream("users")
+    copied_stream.upsert_metadata(["properties", "missing"], {"selected": True})
+    assert copied_stream.find_metadata_by_breadcrumb(["properties", "missing"]) == {
+        "selected": True
+    }
+    assert stream.find_metadata_by_breadcrumb(["properties", "missing"]) == {
+        "selected": False
+    }
+
+
+def test_catalog_equality_ignores_caches():
+    """
+    Lookups and copies should not influence catalog equality.
+    """
+    catalog = Catalog(**DEFAULT_CATALOG)
+    catalog.find_stream("users").find_metadata_by_breadcrumb([])
+
+    assert catalog.deselect() == catalog
+    assert catalog.deselect(["invalid"]) == catalog
+    assert catalog.deselect(["users"]) != catalog
+
+
+def test_catalog_deselect_glob_patterns():
+    """
+    Glob patterns should deselect all matching streams and properties.
+    """
+    catalog = Catalog(**DEFAULT_CATALOG)
+
+    result = catalog.deselect(["*.updated_*", "user?.na*"])
+
+    for stream in result.streams:
+        assert (
+            stream.find_metadata_by_breadcrumb(["properties", "updated_at"])["selected"]
+            == False
+        )
+        assert stream.find_metadata_by_breadcrumb(["properties", "id"]).get(
+            "selected", True
+        )
+
+    assert (
+        result.streams[1].find_metadata_by_breadcrumb(["properties", "name"])[
+            "selected"
+        ]
+        == False
+    )
+    assert "selected" not in result.streams[0].find_metadata_by_breadcrumb(
+        ["properties", "animal_name"]
+    )
+
+    # An entire stream can be deselected with a glob as well.
+    result = catalog.deselect(["us*"])
+    assert result.streams[1].is_selected == False
+    assert result.streams[0] is catalog.streams[0]
+
+
+def test_catalog_select_glob_patterns():
+    """
+    Glob patterns should select all matching streams.
+    """
+    catalog = Catalog(**DEFAULT_CATALOG)
+
+    result = catalog.select(["*s"])
+    assert [stream.is_selected for stream in result.streams] == [True, True]
+
+    result = catalog.select(["an*"])
+    assert [stream.is_selected for stream in result.streams] == [True, False]
@@ -0,0 +1,47 @@
+import json
+
+import pytest
+from elx import Tap
+from elx.cli.utils import (
+    FULL_IMPORT_ENV_VAR,
+    SCAN_CACHE_FILE_NAME,
+    ModuleScanCache,
+    creates_instances,
+    find_instances_of_type,
+)
+
+
+def test_find_instances_of_type_scans_modules(tmp_path, monkeypatch):
+    """
+    Test that only the submodules that create instances are imported, and that the scan is cached.
+    """
+    package = tmp_path / "pipelines"
+    (package / "taps").mkdir(parents=True)
+    (package / "__init__.py").write_text("")
+    (package / "taps" / "__init__.py").write_text("")
+    (package / "taps" / "foo.py").write_text(
+        'import elx\n\ntap = elx.Tap("tap-foo", config={})\n'
+    )
+    (package / "heavy.py").write_text('raise RuntimeError("imported")\n')
+
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+
+    assert creates_instances(str(package / "taps" / "foo.py"))
+    assert not creates_instances(str(package / "heavy.py"))
+
+    taps = list(find_instances_of_type("pipelines", Tap))
+    assert [tap.executable for tap in taps] == ["tap-foo"]
+
+    cache_path = tmp_path / "cache" / "elx" / SCAN_CACHE_FILE_NAME
+    cache = json.loads(cache_path.read_text())
+    assert cache[str(package / "heavy.py")][1] is False
+
+    # A cache directory that other users can write to is not trusted.
+    cache_path.parent.chmod(0o777)
+    assert ModuleScanCache().entries == {}
+
+    # Importing every module runs the module level code of the other modules.
+    monkeypatch.setenv(FULL_IMPORT_ENV_VAR, "true")
+    with pytest.raises(RuntimeError):
+        list(find_instances_of_type("pipelines", Tap))
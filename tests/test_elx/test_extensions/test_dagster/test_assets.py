@@ -1,6 +1,11 @@
-from elx import Runner
+import asyncio
+import json
+import threading
+import pytest
+from elx import Runner, Tap, Target
 from elx.extensions.dagster import load_assets
-from dagster import AssetsDefinition
+from elx.extensions.dagster.assets import run_incrementally
+from dagster import AssetsDefinition, DailyPartitionsDefinition
 
 
 def test_asset_loading(runner: Runner):
@@ -16,3 +21,78 @@ def test_asset_loading(runner: Runner):
     # Length of assets should be 1 as one stream is deselected per default
     assert len(assets) == 1
     assert isinstance(assets[0], AssetsDefinition)
+
+
+def test_asset_loading_from_catalog_snapshot(tmp_path):
+    """
+    Test that assets are loaded from a catalog snapshot without running discovery.
+    """
+    snapshot = {
+        "streams": [
+            {"tap_stream_id": "animals", "key_properties": [], "schema": {}},
+            {"tap_stream_id": "users", "key_properties": [], "schema": {}},
+        ]
+    }
+    tap = Tap(spec="tap-snapshot", executable="tap-snapshot", deselected=["animals"])
+    tap.catalog_snapshot_path(tmp_path).write_text(json.dumps(snapshot))
+    runner = Runner(
+        tap=tap, target=Target(spec="target-jsonl", executable="target-jsonl")
+    )
+
+    assets = load_assets(runner, catalog_snapshot=tmp_path)
+
+    assert list(assets[0].keys_by_output_name) == ["users"]
+    # The catalog is not discovered until the assets are run.
+    assert "catalog" not in tap.__dict__
+
+
+def test_run_incrementally():
+    """
+    Test that completed streams are yielded while the runner is still running.
+    """
+
+    class FakeRunner:
+        name = "tap-fake-target-fake"
+
+        async def async_run(self, streams, logger, on_stream_complete, parallelism):
+            on_stream_complete("users")
+            # The next stream only completes after the first one was consumed.
+            await asyncio.to_thread(consumed.wait, 5)
+            on_stream_complete("orders")
+            raise ValueError("Target failed")
+
+    consumed = threading.Event()
+    completed_streams = run_incrementally(FakeRunner(), ["users", "orders"])
+
+    assert next(completed_streams) == "users"
+    consumed.set()
+    assert next(completed_streams) == "orders"
+
+    with pytest.raises(ValueError):
+        next(completed_streams)
+
+
+def test_asset_loading_partitioned(tmp_path):
+    """
+    Test that assets can be partitioned by time window.
+    """
+    tap = Tap(spec="tap-snapshot", executable="tap-snapshot")
+    tap.catalog_snapshot_path(tmp_path).write_text(
+        json.dumps(
+            {
+                "streams": [
+                    {"tap_stream_id": "users", "key_properties": [], "schema": {}}
+                ]
+            }
+        )
+    )
+    runner = Runner(
+        tap=tap, target=Target(spec="target-jsonl", executable="target-jsonl")
+    )
+    partitions_def = DailyPartitionsDefinition(start_date="2024-01-01")
+
+    assets = load_assets(
+        runner, catalog_snapshot=tmp_path, partitions_def=partitions_def
+    )
+
+    assert assets[0].partitions_def == partitions_def
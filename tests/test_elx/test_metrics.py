@@ -0,0 +1,49 @@
+import os
+import sys
+import pytest
+from elx import RecordCounter
+from elx.metrics import ProcessMetrics, RunMetrics
+
+
+def test_run_metrics():
+    """
+    Test that the throughput of every stream is measured.
+    """
+    metrics = RunMetrics()
+    counter = RecordCounter(metrics=metrics)
+
+    lines = [
+        '{"type": "SCHEMA", "stream": "users", "schema": {}}',
+        '{"type": "RECORD", "stream": "users", "record": {"id": 1}}',
+        '{"type": "STATE", "value": {}}',
+    ]
+    for line in lines:
+        counter.writelines(line)
+    metrics.checkpoint()
+    metrics.finish()
+
+    users = metrics.stream("users")
+    assert users["records"] == 1
+    assert users["bytes"] == len(lines[0]) + len(lines[1])
+    assert users["time_to_first_record_seconds"] >= 0
+    assert metrics.stream("orders")["records"] == 0
+    assert metrics.to_dict()["state_checkpoints"] == 1
+    assert metrics.started_at <= metrics.last_state_at <= metrics.finished_at
+    assert (
+        RunMetrics.merge([metrics, RunMetrics()]).last_state_at == metrics.last_state_at
+    )
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="Requires /proc")
+def test_process_metrics():
+    """
+    Test that the cpu time and peak memory of a process are sampled.
+    """
+    process_metrics = ProcessMetrics(os.getpid())
+
+    assert process_metrics.sample()
+    assert process_metrics.cpu_seconds > 0
+    assert process_metrics.peak_rss_bytes > 0
+
+    # Processes that don't exist can't be sampled.
+    assert not ProcessMetrics(2**22 + 1).sample()
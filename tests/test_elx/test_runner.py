@@ -1,4 +1,10 @@
-from elx import Runner, Target, Tap
+import asyncio
+import datetime
+import time
+
+import pytest
+from elx import Runner, StateManager, Target, Tap
+from elx.catalog import Catalog
 from pathlib import Path
 
 
@@ -60,3 +66,167 @@ def test_record_counts(runner: Runner):
     for stream_name, count in runner.record_counts.items():
         assert isinstance(count, int)
         assert count > 0
+
+
+def test_partition():
+    """
+    Make sure a partition has its own interpolation values and state file.
+    """
+    tap = Tap(
+        "tap-foo", executable="tap-foo", config={"start_date": "{PARTITION_START}"}
+    )
+    target = Target("target-bar", executable="target-bar")
+    runner = Runner(tap, target)
+
+    partition = runner.partition(
+        key="2024-01-01",
+        start=datetime.datetime(2024, 1, 1),
+        end=datetime.datetime(2024, 1, 2),
+    )
+
+    assert partition.tap.config == {"start_date": "2024-01-01T00:00:00"}
+    assert partition.interpolation_values["PARTITION_END_DATE"] == "2024-01-02"
+    assert partition.state_file_name == "tap-foo-target-bar.2024-01-01.json"
+    assert partition.tap.runner is partition
+    # Copies don't share the caches that depend on the config or the selection.
+    next_partition = partition.partition(
+        key="2024-01-02",
+        start=datetime.datetime(2024, 1, 2),
+        end=datetime.datetime(2024, 1, 3),
+    )
+    assert next_partition.tap.hash_key != partition.tap.hash_key
+    assert partition.tap._catalog_files is not tap._catalog_files
+
+    # The original runner is not partitioned.
+    assert runner.state_file_name == "tap-foo-target-bar.json"
+    assert tap.runner is runner
+
+
+def test_save_stream_state(tmp_path):
+    """
+    Make sure concurrent groups of streams only save the bookmarks of their own streams.
+    """
+    tap = Tap("tap-foo", executable="tap-foo")
+    target = Target("target-bar", executable="target-bar")
+    runner = Runner(tap, target, StateManager(base_path=str(tmp_path)))
+    runner.save_state({"bookmarks": {"users": {"id": 1}, "orders": {"id": 1}}})
+
+    # Both groups started with the same state, and emit stale bookmarks of the other group.
+    runner.save_stream_state(
+        {"bookmarks": {"users": {"id": 2}, "orders": {"id": 1}}}, streams=["users"]
+    )
+    runner.save_stream_state(
+        {"bookmarks": {"users": {"id": 1}, "orders": {"id": 2}}}, streams=["orders"]
+    )
+
+    assert runner.load_state() == {
+        "bookmarks": {"users": {"id": 2}, "orders": {"id": 2}}
+    }
+
+    # Only the bookmarks of a group are merged, not e.g. the stream it is syncing.
+    runner.save_stream_state(
+        {"currently_syncing": "users", "bookmarks": {"users": {"id": 3}}},
+        streams=["users"],
+    )
+    assert "currently_syncing" not in runner.load_state()
+
+
+def test_failing_group_stops_other_groups(tmp_path, executable):
+    """
+    Make sure a failing group of streams stops the other groups before the run fails.
+    """
+    tap_script = (
+        "import itertools, json, sys, time\n"
+        "catalog = json.load(open(sys.argv[sys.argv.index('--catalog') + 1]))\n"
+        "streams = [stream['tap_stream_id'] for stream in catalog['streams']\n"
+        "           if stream['metadata'][0]['metadata'].get('selected')]\n"
+        "if streams == ['failing']:\n"
+        "    sys.exit(1)\n"
+        "for i in itertools.count():\n"
+        "    print(json.dumps({'type': 'RECORD', 'stream': streams[0], 'record': {'id': i}}), flush=True)\n"
+        "    time.sleep(0.01)\n"
+    )
+    target_script = "import sys\nfor line in sys.stdin:\n    pass\n"
+    tap = Tap("tap-groups", executable=executable("tap-groups", tap_script))
+    tap.catalog = Catalog(
+        streams=[
+            {
+                "tap_stream_id": stream,
+                "key_properties": [],
+                "schema": {},
+                "metadata": [{"breadcrumb": [], "metadata": {"selected": True}}],
+            }
+            for stream in ["failing", "endless"]
+        ]
+    )
+    target = Target(
+        "target-groups", executable=executable("target-groups", target_script)
+    )
+    runner = Runner(tap, target, StateManager(base_path=str(tmp_path)))
+
+    started_at = time.monotonic()
+    with pytest.raises(Exception, match="Tap failed"):
+        asyncio.run(runner.async_run(parallelism=2))
+
+    assert time.monotonic() - started_at < 30
+    assert all(
+        group_runner._tap_process is None for group_runner in runner._group_runners
+    )
+
+
+def test_metrics_start_with_the_processes(tmp_path, executable):
+    """
+    Make sure the time it takes to start the tap, e.g. its discovery, doesn't count toward the run.
+    """
+    tap_script = "import json\nprint(json.dumps({'type': 'RECORD', 'stream': 'users', 'record': {}}))\n"
+    target_script = "import sys\nfor line in sys.stdin:\n    pass\n"
+    tap = Tap("tap-metrics", executable=executable("tap-metrics", tap_script))
+    tap.catalog = Catalog(streams=[])
+    target = Target(
+        "target-metrics", executable=executable("target-metrics", target_script)
+    )
+    runner = Runner(tap, target, StateManager(base_path=str(tmp_path)))
+
+    def slow_catalog_file(streams=None):
+        time.sleep(1)
+        return Tap.catalog_file(tap, streams=streams)
+
+    tap.catalog_file = slow_catalog_file
+    asyncio.run(runner.async_run())
+
+    assert runner.record_counts == {"users": 1}
+    assert runner.metrics.duration < 1
+
+
+@pytest.mark.parametrize("exit_on_stop, fails", [(False, False), (True, True)])
+def test_stop(tmp_path, executable, exit_on_stop: bool, fails: bool):
+    """
+    Make sure a stopped tap doesn't fail the run, unless it exits with an error by itself.
+    """
+    tap_script = (
+        "import itertools, json, signal, sys, time\n"
+        f"if {exit_on_stop}:\n"
+        "    signal.signal(signal.SIGTERM, lambda *args: sys.exit(3))\n"
+        "for i in itertools.count():\n"
+        "    print(json.dumps({'type': 'RECORD', 'stream': 'users', 'record': {'id': i}}), flush=True)\n"
+        "    time.sleep(0.01)\n"
+    )
+    target_script = "import sys\nfor line in sys.stdin:\n    pass\n"
+    tap = Tap("tap-stop", executable=executable("tap-stop", tap_script))
+    tap.catalog = Catalog(streams=[])
+    target = Target("target-stop", executable=executable("target-stop", target_script))
+    runner = Runner(tap, target, StateManager(base_path=str(tmp_path)))
+
+    async def run_and_stop() -> None:
+        run = asyncio.ensure_future(runner.async_run())
+        while not runner.record_counts:
+            await asyncio.sleep(0.01)
+        runner.stop()
+        await run
+
+    if fails:
+        with pytest.raises(Exception, match="Tap failed"):
+            asyncio.run(run_and_stop())
+    else:
+        asyncio.run(run_and_stop())
+        assert runner.record_counts["users"] > 0
@@ -1,10 +1,21 @@
+import errno
 import json
 import subprocess
+import tempfile
+import time
+from pathlib import Path
 import pytest
 from elx.runner import Runner
 from elx.singer import Singer
 from elx.exceptions import DecodeException
-from elx.json_temp_file import json_temp_file
+import os
+import elx.json_temp_file as json_temp_file_module
+from elx.json_temp_file import (
+    CACHE_DIRECTORY_NAME,
+    content_addressed_file,
+    json_temp_file,
+    with_disk_fallback,
+)
 
 
 def pipx_uninstall(executable: str) -> None:
@@ -59,6 +70,78 @@ def test_singer_config_file(singer: Singer):
     assert not config_path.exists()
 
 
+def test_singer_config_file_temp_directory(tmp_path, monkeypatch: pytest.MonkeyPatch):
+    """
+    Test that config files are written to the configured directory, readable by the owner only.
+    """
+    monkeypatch.setenv("ELX_TEMP_DIR", str(tmp_path))
+
+    with json_temp_file({"password": "secret"}) as config_path:
+        assert config_path.parent == tmp_path
+        assert config_path.stat().st_mode & 0o777 == 0o600
+
+
+def test_content_addressed_file_directory(tmp_path, monkeypatch: pytest.MonkeyPatch):
+    """
+    Test that unused files are evicted and that a shared directory isn't trusted.
+    """
+    monkeypatch.setenv("ELX_TEMP_DIR", str(tmp_path))
+
+    stale_path = content_addressed_file(b"stale")
+    assert stale_path.parent == tmp_path / CACHE_DIRECTORY_NAME
+    os.utime(stale_path, (0, 0))
+
+    path = content_addressed_file(b"fresh")
+    assert path.read_bytes() == b"fresh"
+    assert not stale_path.exists()
+
+    # A directory that other users can write to may contain planted files.
+    shared_directory = tmp_path / "shared"
+    (shared_directory / CACHE_DIRECTORY_NAME).mkdir(parents=True)
+    (shared_directory / CACHE_DIRECTORY_NAME).chmod(0o777)
+    monkeypatch.setenv("ELX_TEMP_DIR", str(shared_directory))
+
+    path = content_addressed_file(b"content")
+    assert path.parent != shared_directory / CACHE_DIRECTORY_NAME
+    assert path.read_bytes() == b"content"
+
+
+def test_content_addressed_file_eviction_by_size(
+    tmp_path, monkeypatch: pytest.MonkeyPatch
+):
+    """
+    Test that the least recently used files are evicted beyond the maximum total size.
+    """
+    monkeypatch.setenv("ELX_TEMP_DIR", str(tmp_path))
+    monkeypatch.setattr(json_temp_file_module, "CACHE_MAX_BYTES", 25)
+
+    old_path = content_addressed_file(b"a" * 10)
+    os.utime(old_path, (time.time() - 10, time.time() - 10))
+    used_path = content_addressed_file(b"b" * 10)
+    new_path = content_addressed_file(b"c" * 10)
+
+    assert not old_path.exists()
+    assert used_path.exists() and new_path.exists()
+
+
+def test_temp_directory_full(tmp_path, monkeypatch: pytest.MonkeyPatch):
+    """
+    Test that a full temporary directory only falls back to disk when that is allowed.
+    """
+    monkeypatch.setenv("ELX_TEMP_DIR", str(tmp_path))
+
+    def write(directory):
+        if directory == tmp_path:
+            raise OSError(errno.ENOSPC, "No space left on device")
+        return directory
+
+    with pytest.raises(OSError, match="ELX_DISK_FALLBACK"):
+        with_disk_fallback(write)
+
+    monkeypatch.setenv("ELX_DISK_FALLBACK", "true")
+    assert with_disk_fallback(write) == Path(tempfile.gettempdir())
+
+
 def test_singer_hash_key(singer: Singer):
     """
     Make sure the hash key is a valid md5 hash.
@@ -79,6 +162,22 @@ def test_singer_dynamic_config():
     assert singer.config == {}
 
 
+def test_singer_dynamic_config_interpolation(runner: Runner):
+    """
+    Make sure a dynamic config is only compiled again when it returns another config.
+    """
+    config = {"target_schema": "{TAP_NAME}"}
+    singer = Singer(spec="python3", executable="python3", config=lambda: config)
+    singer.runner = runner
+
+    rendered = singer.config
+    assert rendered == {"target_schema": "tap_mock_fixture"}
+    assert singer.config is rendered
+
+    config["target_schema"] = "{TAP_NAME}_copy"
+    assert singer.config == {"target_schema": "tap_mock_fixture_copy"}
+
+
 def test_singer_config_interpolation(runner: Runner):
     """
     Make sure the Singer instance is able to handle config interpolation.
@@ -95,3 +194,38 @@ def test_singer_config_interpolation(runner: Runner):
     singer.runner = runner
 
     assert singer.config == {"target_schema": "tap_mock_fixture"}
+
+
+def test_singer_run_streaming():
+    """
+    Make sure the items of a JSON array are parsed while the output is received.
+    """
+    singer = Singer(spec="python3", executable="python3")
+
+    script = (
+        "import json, sys;"
+        "sys.stderr.write('x' * 1000000);"
+        "print(json.dumps({'streams': [{'id': i} for i in range(1000)]}))"
+    )
+
+    streams = list(singer.run_streaming(["-c", script], key="streams"))
+
+    assert streams == [{"id": i} for i in range(1000)]
+
+
+def test_singer_run_streaming_errors():
+    """
+    Make sure failing executables and invalid output raise a DecodeException.
+    """
+    singer = Singer(spec="python3", executable="python3")
+
+    with pytest.raises(DecodeException, match="boom"):
+        list(
+            singer.run_streaming(
+                ["-c", "import sys; sys.stderr.write('boom'); sys.exit(1)"],
+                key="streams",
+            )
+        )
+
+    with pytest.raises(DecodeException, match="Error parsing json"):
+        list(singer.run_streaming(["-c", "print('{\"streams\": [1,')"], key="streams"))
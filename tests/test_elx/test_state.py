@@ -1,8 +1,17 @@
 from anyio import Path
+import hashlib
+import json
+import os
+import sys
 from click import File
 import pytest
 from pytest import MonkeyPatch
-from elx.state import state_client_factory, StateManager
+from elx.state import (
+    NEW_FILE_MODE,
+    state_client_factory,
+    StateManager,
+    ShardedStateManager,
+)
 from azure.storage.blob import BlobServiceClient
 from google.cloud.storage import Client
 
@@ -55,3 +64,362 @@ def test_state_merge(state_manager: StateManager):
     state_manager.save("test.json", {"foo": "bar"})
     state_manager.save("test.json", {"bar": "foo"})
     assert state_manager.load("test.json") == {"foo": "bar", "bar": "foo"}
+
+
+def test_state_cache(state_manager: StateManager):
+    """
+    Test that saved state is cached and can be refreshed from the state store.
+    """
+    state_manager.save("test.json", {"foo": "bar"})
+
+    # Changes by another writer are not visible until the cache is refreshed.
+    StateManager(base_path=state_manager.base_path).save("test.json", {"bar": "foo"})
+    assert state_manager.load("test.json") == {"foo": "bar"}
+    assert state_manager.refresh("test.json") == {"foo": "bar", "bar": "foo"}
+
+    # The cached state can't be modified through a loaded state.
+    state_manager.load("test.json")["foo"] = "baz"
+    assert state_manager.load("test.json")["foo"] == "bar"
+
+    # Loads are served from the cache.
+    os.remove(os.path.join(state_manager.base_path, "test.json"))
+    assert state_manager.load("test.json") == {"foo": "bar", "bar": "foo"}
+    state_manager.invalidate()
+    assert state_manager.load("test.json") == {}
+
+
+@pytest.mark.parametrize(
+    "base_path",
+    ["{tmp_path}", "sqlite:///{tmp_path}/state.db"],
+)
+def test_state_load_many(tmp_path, base_path: str):
+    """
+    Test that many state files can be loaded at once, including missing ones.
+    """
+    state_manager = StateManager(base_path=base_path.format(tmp_path=tmp_path))
+    state_manager.save("foo.json", {"foo": "bar"})
+    state_manager.save("bar.json", {"bar": "foo"})
+
+    other_state_manager = StateManager(base_path=state_manager.base_path)
+    states = other_state_manager.load_many(["foo.json", "bar.json", "baz.json"])
+
+    assert states == {
+        "foo.json": {"foo": "bar"},
+        "bar.json": {"bar": "foo"},
+        "baz.json": {},
+    }
+
+    # The loaded states are cached.
+    state_manager.save("foo.json", {"foo": "baz"})
+    assert other_state_manager.load("foo.json") == {"foo": "bar"}
+
+
+def test_state_compression(tmp_path):
+    """
+    Test that compressed state files are detected when reading.
+    """
+    state_manager = StateManager(base_path=str(tmp_path), compression="gzip")
+    state_manager.save("test.json", {"foo": "bar"})
+
+    assert (tmp_path / "test.json").read_bytes().startswith(b"\x1f\x8b")
+    assert StateManager(base_path=str(tmp_path)).load("test.json") == {"foo": "bar"}
+
+    with pytest.raises(ValueError):
+        StateManager(base_path=str(tmp_path), compression="lz4")
+
+
+def test_state_compression_requires_zstandard(tmp_path, monkeypatch: MonkeyPatch):
+    """
+    Test that a missing zstandard package fails when the state manager is created.
+    """
+    monkeypatch.setitem(sys.modules, "zstandard", None)
+
+    with pytest.raises(ImportError, match=r"elx\[zstd\]"):
+        StateManager(base_path=str(tmp_path), compression="zstd")
+
+
+def test_state_delta_log(tmp_path):
+    """
+    Test that saves are appended to a delta log that is compacted periodically.
+    """
+    state_manager = StateManager(
+        base_path=str(tmp_path), delta_log=True, compact_every=2
+    )
+    state = {"bookmarks": {"users": {"id": 1}, "orders": {"id": 1}}}
+    state_manager.save("test.json", state)
+
+    state["bookmarks"]["users"] = {"id": 2}
+    state_manager.save("test.json", state)
+    del state["bookmarks"]["orders"]
+    state_manager.save("test.json", state)
+
+    # The changes are only in the delta log.
+    log = (tmp_path / "test.json.log").read_bytes().splitlines()
+    assert json.loads(log[0]) == {"bookmarks": {"users": {"id": 2}}}
+    assert json.loads(log[1]) == {"bookmarks": {"orders": None}}
+    assert (
+        StateManager(base_path=str(tmp_path), delta_log=True).load("test.json") == state
+    )
+
+    # The delta log is compacted into the state file.
+    state["bookmarks"]["users"] = {"id": 3}
+    state_manager.save("test.json", state)
+    assert (tmp_path / "test.json.log").read_bytes() == b""
+    assert json.loads((tmp_path / "test.json").read_bytes()) == state
+
+
+def test_state_delta_log_recovery(tmp_path):
+    """
+    Test that the delta log can be read after a crash while appending or compacting.
+    """
+    state_manager = StateManager(
+        base_path=str(tmp_path), delta_log=True, compact_every=1
+    )
+    state_manager.save("test.json", {"bookmarks": {"users": 1}})
+    state_manager.save("test.json", {"bookmarks": {"users": 2}})
+
+    # A torn last line is skipped.
+    with (tmp_path / "test.json.log").open("ab") as log_file:
+        log_file.write(b'{"bookmarks": {"us')
+    state_manager = StateManager(
+        base_path=str(tmp_path), delta_log=True, compact_every=1
+    )
+    assert state_manager.load("test.json") == {"bookmarks": {"users": 2}}
+
+    # The next save compacts the log, old deltas are not applied to the new snapshot
+    # even if the log wasn't truncated.
+    log = (tmp_path / "test.json.log").read_bytes()
+    state_manager.save("test.json", {"bookmarks": {"users": 3}})
+    (tmp_path / "test.json.log").write_bytes(
+        log
+        + b"\n#compacted "
+        + hashlib.sha256((tmp_path / "test.json").read_bytes()).hexdigest().encode()
+        + b"\n"
+    )
+    state_manager = StateManager(base_path=str(tmp_path), delta_log=True)
+    assert state_manager.load("test.json") == {"bookmarks": {"users": 3}}
+
+    with pytest.raises(ValueError):
+        StateManager(base_path=f"sqlite:///{tmp_path}/state.db", delta_log=True)
+
+
+@pytest.mark.parametrize(
+    "base_path",
+    ["{tmp_path}", "sqlite:///{tmp_path}/state.db?history=true"],
+)
+@pytest.mark.parametrize("state_manager_class", [StateManager, ShardedStateManager])
+def test_state_versions(tmp_path, base_path: str, state_manager_class: type):
+    """
+    Test that a bounded number of versions is kept and can be restored.
+    """
+    state_manager = state_manager_class(
+        base_path=base_path.format(tmp_path=tmp_path), versions=2
+    )
+
+    for id in range(1, 3):
+        state_manager.save("test.json", {"bookmarks": {"users": {"id": id}}})
+    state_manager.save(
+        "test.json", {"bookmarks": {"users": {"id": 3}, "orders": {"id": 1}}}
+    )
+
+    versions = state_manager.list_versions("test.json")
+    assert len(versions) == 2
+
+    # Restore the previous version, the restore itself is a new version. Streams
+    # that were added after that version are removed.
+    previous_version = versions[1]["version"]
+    assert state_manager.restore("test.json", previous_version) == {
+        "bookmarks": {"users": {"id": 2}}
+    }
+    assert state_manager_class(base_path=state_manager.base_path).load("test.json") == {
+        "bookmarks": {"users": {"id": 2}}
+    }
+    assert len(state_manager.list_versions("test.json")) == 2
+
+    # Versions that are out of the ring buffer can't be restored.
+    with pytest.raises(KeyError):
+        state_manager.restore("test.json", previous_version)
+
+
+def test_state_local_file_mode(tmp_path):
+    """
+    Test that local state files get the mode of the umask, or keep their existing mode.
+    """
+    state_manager = StateManager(base_path=str(tmp_path))
+    state_manager.save("test.json", {"foo": "bar"})
+    assert (tmp_path / "test.json").stat().st_mode & 0o777 == NEW_FILE_MODE
+
+    (tmp_path / "test.json").chmod(0o640)
+    state_manager.save("test.json", {"foo": "baz"})
+    assert (tmp_path / "test.json").stat().st_mode & 0o777 == 0o640
+
+
+@pytest.mark.parametrize("durability", ["none", "file", "directory"])
+def test_state_atomic_local_write(tmp_path, monkeypatch: MonkeyPatch, durability: str):
+    """
+    Test that a failed local write leaves the previous state file intact.
+    """
+    state_manager = StateManager(base_path=str(tmp_path), durability=durability)
+    state_manager.save("test.json", {"foo": "bar"})
+
+    # Fail halfway through replacing the state file.
+    def failing_replace(*args, **kwargs):
+        raise OSError("Crash")
+
+    monkeypatch.setattr(os, "replace", failing_replace)
+
+    with pytest.raises(OSError):
+        state_manager.save("test.json", {"foo": "baz"})
+
+    # The state file is intact and no temporary files are left behind.
+    assert os.listdir(tmp_path) == ["test.json"]
+    assert state_manager.refresh("test.json") == {"foo": "bar"}
+
+
+def test_state_invalid_durability(tmp_path):
+    with pytest.raises(ValueError):
+        StateManager(base_path=str(tmp_path), durability="sometimes")
+
+
+def test_shared_clients(monkeypatch: MonkeyPatch):
+    """
+    Test that state clients with the same backend, credentials and bucket share a client.
+    """
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "abc123")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "abc123")
+
+    client = state_client_factory("s3://bucket/path").client
+    assert state_client_factory("s3://bucket/other/path").client is client
+    assert state_client_factory("s3://other-bucket/path").client is not client
+    assert state_client_factory("s3://bucket/path", pool_size=50).client is not client
+    assert client.meta.config.max_pool_connections == 10
+
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "def456")
+    assert state_client_factory("s3://bucket/path").client is not client
+
+
+def test_sharded_state(tmp_path):
+    """
+    Test that concurrent writers of different streams don't overwrite each other's bookmarks.
+    """
+    writer_one = ShardedStateManager(base_path=str(tmp_path))
+    writer_two = ShardedStateManager(base_path=str(tmp_path))
+
+    writer_one.save("test.json", {"bookmarks": {"users": {"id": 1}}})
+    writer_two.save("test.json", {"bookmarks": {"orders": {"id": 2}}})
+    writer_one.save("test.json", {"bookmarks": {"users": {"id": 3}}})
+
+    assert sorted(os.listdir(tmp_path / "test")) == [
+        "bookmarks.orders.json",
+        "bookmarks.users.json",
+        "manifest.json",
+    ]
+    assert ShardedStateManager(base_path=str(tmp_path)).load("test.json") == {
+        "bookmarks": {"users": {"id": 3}, "orders": {"id": 2}}
+    }
+
+
+def test_sharded_state_migrates_existing_state(state_manager: StateManager):
+    """
+    Test that sharded state picks up an existing unsharded state file.
+    """
+    state_manager.save("test.json", {"bookmarks": {"users": {"id": 1}}})
+
+    sharded_state_manager = ShardedStateManager(base_path=state_manager.base_path)
+    assert sharded_state_manager.load("test.json") == {
+        "bookmarks": {"users": {"id": 1}}
+    }
+
+    # The first save writes the shards of all streams.
+    sharded_state_manager.save("test.json", {"bookmarks": {"orders": {"id": 2}}})
+    assert ShardedStateManager(base_path=state_manager.base_path).load("test.json") == {
+        "bookmarks": {"users": {"id": 1}, "orders": {"id": 2}}
+    }
+
+
+def test_sqlite_state(tmp_path):
+    """
+    Test that state can be stored in a SQLite database, optionally with history.
+    """
+    base_path = f"sqlite:///{tmp_path}/state.db?history=true"
+    state_manager = StateManager(base_path=base_path)
+
+    assert state_manager.load("test.json") == {}
+
+    state_manager.save("test.json", {"foo": "bar"})
+    state_manager.save("test.json", {"bar": "foo"})
+    state_manager.save("other.json", {"baz": "qux"})
+
+    assert StateManager(base_path=base_path).load("test.json") == {
+        "foo": "bar",
+        "bar": "foo",
+    }
+    assert os.listdir(tmp_path)[0].startswith("state.db")
+
+    state_client = state_manager.state_client
+    assert state_client.read_many(["test.json", "other.json", "missing.json"]) == {
+        "test.json": b'{"foo": "bar", "bar": "foo"}',
+        "other.json": b'{"baz": "qux"}',
+        "missing.json": None,
+    }
+    assert [content for _, content in state_client.read_history("test.json")] == [
+        b'{"foo": "bar", "bar": "foo"}',
+        b'{"foo": "bar"}',
+    ]
+
+
+def test_sqlite_url(tmp_path, monkeypatch: MonkeyPatch):
+    """
+    Test that SQLite urls are parsed into relative and absolute paths.
+    """
+    monkeypatch.chdir(tmp_path)
+
+    assert state_client_factory("sqlite:///state.db").path == str(tmp_path / "state.db")
+    assert (
+        state_client_factory("sqlite:////tmp/state.db?history=true").path
+        == "/tmp/state.db"
+    )
+    assert state_client_factory("sqlite:////tmp/state.db?history=true").history
+    assert state_client_factory("sqlite:///my%20state.db").path == str(
+        tmp_path / "my state.db"
+    )
+
+    with pytest.raises(ValueError, match="Invalid SQLite url"):
+        state_client_factory("sqlite://state.db")
+
+
+def test_sharded_state_lists_shards(tmp_path):
+    """
+    Test that streams are found by their shards when a racing writer overwrote the manifest.
+    """
+    state_manager = ShardedStateManager(base_path=str(tmp_path))
+    state_manager.save("test.json", {"bookmarks": {"users": {"id": 1}}})
+    state_manager.save("test.json", {"bookmarks": {"orders": {"id": 2}}})
+
+    # The manifest written by the other writer doesn't know about the orders stream.
+    (tmp_path / "test" / "manifest.json").write_text(
+        json.dumps({"streams": ["users"], "state": {}})
+    )
+
+    assert ShardedStateManager(base_path=str(tmp_path)).load("test.json") == {
+        "bookmarks": {"users": {"id": 1}, "orders": {"id": 2}}
+    }
+
+
+def test_sharded_state_migrates_once(state_manager: StateManager):
+    """
+    Test that a writer doesn't migrate stale unsharded bookmarks over newer shards.
+    """
+    state_manager.save("test.json", {"bookmarks": {"users": {"id": 1}}})
+
+    writer_one = ShardedStateManager(base_path=state_manager.base_path)
+    writer_two = ShardedStateManager(base_path=state_manager.base_path)
+    writer_one.load("test.json")
+    writer_two.load("test.json")
+
+    writer_one.save("test.json", {"bookmarks": {"users": {"id": 2}}})
+    writer_two.save("test.json", {"bookmarks": {"orders": {"id": 3}}})
+
+    assert ShardedStateManager(base_path=state_manager.base_path).load("test.json") == {
+        "bookmarks": {"users": {"id": 2}, "orders": {"id": 3}}
+    }
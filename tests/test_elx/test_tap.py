@@ -1,7 +1,13 @@
 import asyncio
+import datetime
+import json
+import os
+import time
+from typing import Callable
 import pytest
-from elx import Tap
+from elx import Runner, Tap, Target, discover_catalogs
 from elx.catalog import Stream, Catalog
+from elx.exceptions import DecodeException
 
 
 def test_tap_discovery(tap: Tap):
@@ -24,3 +30,213 @@ async def test_tap_process(tap: Tap):
     async with tap.process() as process:
         # Make sure the tap process is of the right type.
         assert type(process) == asyncio.subprocess.Process
+
+
+def test_tap_catalog_file_is_memoized():
+    """
+    Test that the serialized catalog is memoized per stream selection.
+    """
+    tap = Tap(spec="tap-foo", executable="tap-foo")
+    tap.catalog = Catalog(
+        streams=[
+            Stream(tap_stream_id="users", key_properties=[], schema={}),
+            Stream(tap_stream_id="orders", key_properties=[], schema={}),
+        ]
+    )
+
+    catalog_path = tap.catalog_file(["users", "orders"])
+    catalog = json.loads(catalog_path.read_text())
+    assert [stream["schema"]["selected"] for stream in catalog["streams"]] == [
+        True,
+        True,
+    ]
+
+    # The same selection (in any order) reuses the same file.
+    assert tap.catalog_file(["orders", "users"]) == catalog_path
+
+    # A different selection results in a different file.
+    users_path = tap.catalog_file(["users"])
+    assert users_path != catalog_path
+
+    # The file is rewritten if it has been removed.
+    users_path.unlink()
+    assert tap.catalog_file(["users"]) == users_path
+    assert users_path.exists()
+
+
+@pytest.fixture
+def fake_tap(executable) -> Callable[[str, str], Tap]:
+    """
+    Return a factory that creates a tap for an executable python script.
+    """
+
+    def create(name: str, script: str) -> Tap:
+        return Tap(
+            spec=name, executable=executable(name, script), deselected=["animals"]
+        )
+
+    return create
+
+
+def test_discover_catalogs(tmp_path, fake_tap):
+    """
+    Test that the catalogs of many taps can be discovered concurrently.
+    """
+    script = (
+        "import json;"
+        "print(json.dumps({'streams': ["
+        "{'tap_stream_id': 'animals', 'key_properties': [], 'schema': {}},"
+        "{'tap_stream_id': 'users', 'key_properties': [], 'schema': {}}"
+        "]}))"
+    )
+    taps = [fake_tap(f"tap-{i}", script) for i in range(3)]
+    slow_tap = fake_tap("tap-slow", "import time; time.sleep(10)")
+
+    catalogs = discover_catalogs(
+        [*taps, slow_tap],
+        concurrency=2,
+        timeout=2,
+        return_exceptions=True,
+    )
+
+    # The catalogs are configured and cached on the taps.
+    for tap, catalog in zip(taps, catalogs):
+        assert tap.catalog is catalog
+        assert [stream.is_selected for stream in catalog.streams] == [False, True]
+
+    # The slow tap timed out and has no cached catalog.
+    assert isinstance(catalogs[-1], asyncio.TimeoutError)
+    assert "catalog" not in slow_tap.__dict__
+
+
+def test_discover_catalogs_failure_stops_other_taps(tmp_path, fake_tap):
+    """
+    Test that the other discoveries are killed and cleaned up when one of them fails.
+    """
+    slow_script = (
+        "import os, sys, time\n"
+        f"open({str(tmp_path / 'slow.txt')!r}, 'w').write(f'{{os.getpid()}} {{sys.argv[2]}}')\n"
+        "time.sleep(60)\n"
+    )
+    slow_tap = fake_tap("tap-slow", slow_script)
+    failing_tap = fake_tap(
+        "tap-failing", "import time; time.sleep(1); raise SystemExit(1)"
+    )
+
+    with pytest.raises(DecodeException):
+        discover_catalogs([slow_tap, failing_tap])
+
+    pid, config_path = (tmp_path / "slow.txt").read_text().split()
+    with pytest.raises(ProcessLookupError):
+        os.kill(int(pid), 0)
+    assert not os.path.exists(config_path)
+
+
+def test_catalog_snapshot(tmp_path, fake_tap):
+    """
+    Test that the catalog can be loaded from a snapshot instead of discovery.
+    """
+    script = (
+        "import json;"
+        "print(json.dumps({'streams': ["
+        "{'tap_stream_id': 'animals', 'key_properties': [], 'schema': {}},"
+        "{'tap_stream_id': 'users', 'key_properties': [], 'schema': {}}"
+        "]}))"
+    )
+    tap = fake_tap("tap-snapshot", script)
+
+    assert tap.load_catalog_snapshot(tmp_path / "snapshots") is None
+    catalog = tap.save_catalog_snapshot(tmp_path / "snapshots")
+    assert tap.catalog_snapshot_path(tmp_path / "snapshots").exists()
+
+    # The snapshot is configured with the current deselection of the tap.
+    tap = fake_tap("tap-snapshot", "raise SystemExit(1)")
+    assert tap.load_catalog_snapshot(tmp_path / "snapshots") == catalog
+    tap.deselected = ["users"]
+    snapshot = tap.load_catalog_snapshot(tmp_path / "snapshots")
+    assert [stream.is_selected for stream in snapshot.streams] == [True, False]
+
+
+def test_catalog_snapshot_path_ignores_interpolation(tmp_path):
+    """
+    Test that partitions share the snapshot, and that a change of the config creates a new one.
+    """
+    tap = Tap(
+        "tap-foo", executable="tap-foo", config={"start_date": "{PARTITION_START}"}
+    )
+    runner = Runner(tap, Target("target-bar", executable="target-bar"))
+    partition = runner.partition(
+        key="2024-01-01",
+        start=datetime.datetime(2024, 1, 1),
+        end=datetime.datetime(2024, 1, 2),
+    )
+
+    path = runner.tap.catalog_snapshot_path(tmp_path)
+    assert partition.tap.catalog_snapshot_path(tmp_path) == path
+
+    other_tap = Tap(
+        "tap-foo", executable="tap-foo", config={"start_date": "2024-01-01"}
+    )
+    assert other_tap.catalog_snapshot_path(tmp_path) != path
+
+
+def test_tap_sample(tmp_path, fake_tap):
+    """
+    Test that the tap is killed, with the processes it started, once every stream has been sampled.
+    """
+    script = (
+        "import itertools, json, subprocess, sys\n"
+        "child = subprocess.Popen(['sleep', '60'])\n"
+        f"open({str(tmp_path / 'child.pid')!r}, 'w').write(str(child.pid))\n"
+        "for i in itertools.count():\n"
+        "    print('x' * 1000, file=sys.stderr)\n"
+        "    for stream in ['animals', 'users']:\n"
+        "        print(json.dumps({'type': 'RECORD', 'stream': stream, 'record': {'id': i}}))\n"
+    )
+    tap = fake_tap("tap-sample", script)
+    tap.catalog = Catalog(
+        streams=[
+            {"tap_stream_id": stream, "key_properties": [], "schema": {}}
+            for stream in ["animals", "users"]
+        ]
+    )
+
+    samples = tap.sample(streams=["animals", "users"], limit=2, timeout=30)
+    assert samples == {
+        "animals": [{"id": 0}, {"id": 1}],
+        "users": [{"id": 0}, {"id": 1}],
+    }
+
+    # The process started by the tap has been killed with the tap.
+    child_pid = int((tmp_path / "child.pid").read_text())
+    with pytest.raises(ProcessLookupError):
+        for _ in range(50):
+            os.kill(child_pid, 0)
+            time.sleep(0.1)
+
+    failing_tap = fake_tap("tap-failing", "raise SystemExit(1)")
+    failing_tap.catalog = tap.catalog
+    with pytest.raises(Exception, match="Tap failed"):
+        failing_tap.sample(streams=["users"])
+
+
+def test_tap_sample_complete_streams(tmp_path, fake_tap):
+    """
+    Test that unrequested streams are ignored and that complete streams don't need the limit.
+    """
+    script = (
+        "import itertools, json\n"
+        "print(json.dumps({'type': 'RECORD', 'stream': 'users', 'record': {'id': 0}}))\n"
+        "for i in itertools.count():\n"
+        "    print(json.dumps({'type': 'RECORD', 'stream': 'animals', 'record': {'id': i}}))\n"
+        "    print(json.dumps({'type': 'STATE', 'value': {}}))\n"
+    )
+    tap = fake_tap("tap-sample", script)
+    tap.catalog = Catalog(
+        streams=[
+            {"tap_stream_id": stream, "key_properties": [], "schema": {}}
+            for stream in ["animals", "users"]
+        ]
+    )
+
+    assert tap.sample(streams=["users"], limit=2, timeout=30) == {"users": [{"id": 0}]}
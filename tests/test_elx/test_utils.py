@@ -1,5 +1,7 @@
+import asyncio
+
 from elx import RecordCounter
-from elx.utils import interpolate_in_config
+from elx.utils import ConfigTemplate, capture_subprocess_output, interpolate_in_config
 
 
 def test_interpolate_in_config():
@@ -25,6 +27,54 @@ def test_interpolate_in_config():
     assert interpolated_config == expected_config
 
 
+def test_config_template():
+    """
+    Test that a config template only renders placeholders and memoizes the result.
+    """
+    streams = [{"name": f"stream_{i}"} for i in range(100)]
+    template = ConfigTemplate({"streams": streams, "start_date": "{TODAY}"})
+
+    assert template.fields == {"TODAY"}
+
+    config = template.render({"TODAY": "2024-01-01", "NOW": "12:00"})
+    assert config == {"streams": streams, "start_date": "2024-01-01"}
+
+    # Values without placeholders are shared with the original config.
+    assert config["streams"] is streams
+
+    # Values that are not used don't invalidate the memoized config.
+    assert template.render({"TODAY": "2024-01-01", "NOW": "12:01"}) is config
+    assert template.render({"TODAY": "2024-01-02"})["start_date"] == "2024-01-02"
+
+    # Interpolating a config without a template doesn't share anything with it.
+    assert interpolate_in_config({"streams": streams}, {})["streams"] is not streams
+
+
+def test_capture_subprocess_output_complete_lines_only():
+    """
+    Test that a line that was cut off is skipped when only complete lines are captured.
+    """
+
+    async def capture(complete_lines_only: bool) -> list:
+        reader = asyncio.StreamReader()
+        reader.feed_data(b'{"type": "RECORD"}\n{"type": "REC')
+        reader.feed_eof()
+
+        lines = []
+
+        class Writer:
+            def writelines(self, line: str) -> None:
+                lines.append(line)
+
+        await capture_subprocess_output(
+            reader, Writer(), complete_lines_only=complete_lines_only
+        )
+        return lines
+
+    assert asyncio.run(capture(complete_lines_only=True)) == ['{"type": "RECORD"}\n']
+    assert len(asyncio.run(capture(complete_lines_only=False))) == 2
+
+
 def test_record_counter_counts_records():
     """
     Test that RecordCounter correctly counts RECORD messages per stream.
@@ -76,3 +126,81 @@ def test_record_counter_reset():
 
     counter.reset()
     assert counter.counts == {}
+
+
+def test_record_counter_completed_streams():
+    """
+    Test that a stream is complete once the target confirms a state after the tap switched streams.
+    """
+    counter = RecordCounter(track_completion=True)
+
+    counter.writelines('{"type": "SCHEMA", "stream": "users", "schema": {}}')
+    counter.writelines('{"type": "RECORD", "stream": "users", "record": {"id": 1}}')
+    counter.writelines('{"type": "STATE", "value": {"bookmarks": {"users": 1}}}')
+    counter.writelines('{"type": "SCHEMA", "stream": "orders", "schema": {}}')
+    counter.writelines('{"type": "RECORD", "stream": "orders", "record": {"id": 1}}')
+
+    # The state before the switch doesn't complete the users stream.
+    assert counter.confirm_state({"bookmarks": {"users": 1}}) == []
+
+    counter.writelines(
+        '{"type": "STATE", "value": {"bookmarks": {"users": 1, "orders": 1}}}'
+    )
+    counter.writelines(
+        '{"type": "STATE", "value": {"bookmarks": {"users": 1, "orders": 2}}}'
+    )
+
+    # Targets may only emit the latest state.
+    assert counter.confirm_state({"bookmarks": {"users": 1, "orders": 2}}) == ["users"]
+    assert counter.complete() == ["orders"]
+
+
+def test_record_counter_interleaved_streams():
+    """
+    Test that a stream the tap returns to is not complete, and that completing
+    streams early stops once a completed stream turns out to be unfinished.
+    """
+    counter = RecordCounter(track_completion=True)
+
+    counter.writelines('{"type": "RECORD", "stream": "users", "record": {"id": 1}}')
+    counter.writelines('{"type": "RECORD", "stream": "orders", "record": {"id": 1}}')
+    counter.writelines('{"type": "STATE", "value": {"bookmarks": {"orders": 1}}}')
+    counter.writelines('{"type": "RECORD", "stream": "users", "record": {"id": 2}}')
+
+    # The tap returned to the users stream before the target confirmed the state.
+    assert counter.confirm_state({"bookmarks": {"orders": 1}}) == []
+
+    counter.writelines('{"type": "STATE", "value": {"bookmarks": {"orders": 2}}}')
+    assert counter.confirm_state({"bookmarks": {"orders": 2}}) == ["orders"]
+
+    counter.writelines('{"type": "RECORD", "stream": "orders", "record": {"id": 2}}')
+    counter.writelines('{"type": "STATE", "value": {"bookmarks": {"orders": 3}}}')
+
+    # The completed orders stream returned, so streams only complete at the end.
+    assert counter.confirm_state({"bookmarks": {"orders": 3}}) == []
+    assert counter.complete() == ["users"]
+
+
+def test_record_counter_pending_states_are_bounded():
+    """
+    Test that only the latest state is kept while no other stream finished.
+    """
+    counter = RecordCounter(track_completion=True)
+
+    counter.writelines('{"type": "RECORD", "stream": "users", "record": {"id": 1}}')
+    counter.writelines('{"type": "RECORD", "stream": "orders", "record": {"id": 1}}')
+    for i in range(1000):
+        counter.writelines(
+            f'{{"type": "STATE", "value": {{"bookmarks": {{"orders": {i}}}}}}}'
+        )
+
+    assert len(counter._pending_states) == 1
+    assert counter.confirm_state({"bookmarks": {"orders": 999}}) == ["users"]
+    assert counter._pending_states == {}
+
+    # Without completion tracking, no states are kept at all.
+    counter = RecordCounter()
+    counter.writelines('{"type": "RECORD", "stream": "users", "record": {"id": 1}}')
+    counter.writelines('{"type": "RECORD", "stream": "orders", "record": {"id": 1}}')
+    counter.writelines('{"type": "STATE", "value": {"bookmarks": {"orders": 1}}}')
+    assert counter._pending_states == {}